@@ -0,0 +1,230 @@
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+
+from scripts.utils import Constants, fatal
+
+# Number of runs of each workload, the median duration is reported
+REPEAT = int(os.getenv("BENCH_REPEAT", "5"))
+
+# Relative slowdown or memory growth over the baseline considered a regression
+TOLERANCE = float(os.getenv("BENCH_TOLERANCE", "0.2"))
+
+# Workloads are generated from a fixed seed to be reproducible
+SEED = 42
+
+
+class Workload:
+    """Command run against generated data"""
+
+    def __init__(
+        self, name: str, args: list[str], stdin: str = "", python: bool = True
+    ) -> None:
+        """Init workload."""
+        self.name = name
+        self.args = args
+        self.stdin = stdin
+        self.python = python
+
+
+# Spawns a workload from a lean process, a child inherits the peak memory of its parent
+LAUNCHER = """
+import os, sys, time
+start = time.perf_counter()
+pid = os.posix_spawn(sys.argv[1], sys.argv[1:], os.environ)
+_, status, rusage = os.wait4(pid, 0)
+print(time.perf_counter() - start, os.waitstatus_to_exitcode(status), rusage.ru_maxrss)
+"""
+
+
+def __measure(workload: Workload, workdir: Path) -> dict[str, float]:
+    command = workload.args
+    if workload.python:
+        command = [sys.executable, Constants.TEMPLY_BIN_PATH.absolute().as_posix()]
+        command.extend(workload.args)
+
+    stdin_path = workdir / "stdin"
+    stdin_path.write_text(workload.stdin)
+    stderr_path = workdir / "stderr"
+    durations, peaks = [], []
+    for _ in range(REPEAT):
+        with open(stdin_path, "rb") as stdin, open(stderr_path, "wb") as stderr:
+            result = subprocess.run(
+                [sys.executable, "-I", "-S", "-c", LAUNCHER, *command],
+                cwd=workdir,
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                check=True,
+            )
+        # Workload output is discarded, the launcher reports on the last line
+        seconds, returncode, peak = result.stdout.splitlines()[-1].split()
+        if int(returncode) != 0:
+            fatal(
+                f"The `{workload.name}` workload failed",
+                RuntimeError(stderr_path.read_text()),
+            )
+        durations.append(float(seconds))
+        # Kilobytes on linux, bytes on macOS
+        peaks.append(int(peak) * (1 if sys.platform == "darwin" else 1024))
+    return {
+        "seconds": statistics.median(durations),
+        "peak_memory_bytes": max(peaks),
+    }
+
+
+def __envdir(workdir: Path, rng: random.Random) -> Workload:
+    envdir = workdir / "envdir"
+    envdir.mkdir()
+    for idx in range(10_000):
+        (envdir / f"VAR_{idx}").write_text(f"{rng.random()}\n")
+    (workdir / "envdir.tpl").write_text("{{ VAR_0 }} {{ VAR_9999 }}")
+    return Workload("envdir", ["--keep-template", "--envdir", "envdir", "envdir.tpl"])
+
+
+def __dotenv(workdir: Path, rng: random.Random) -> Workload:
+    (workdir / "dotenv").write_text(
+        "".join(f"VAR_{idx}={rng.random()}\n" for idx in range(100_000))
+    )
+    (workdir / "dotenv.tpl").write_text("{{ VAR_0 }} {{ VAR_99999 }}")
+    return Workload("dotenv", ["--keep-template", "--dotenv", "dotenv", "dotenv.tpl"])
+
+
+def __json_file(workdir: Path, rng: random.Random) -> Workload:
+    with open(workdir / "data.json", "w") as file_descriptor:
+        json.dump(
+            [
+                {"key": f"VAR_{idx}", "value": {"nested": [rng.random()] * 10}}
+                for idx in range(100_000)
+            ],
+            file_descriptor,
+        )
+    (workdir / "json.tpl").write_text("{{ VAR_0 | tojson }}")
+    return Workload(
+        "json-file", ["--keep-template", "--json-file", "data.json", "json.tpl"]
+    )
+
+
+def __includes(workdir: Path, _: random.Random) -> Workload:
+    templates = workdir / "includes"
+    templates.mkdir()
+    for idx in range(500):
+        (templates / f"part_{idx}.tpl").write_text(
+            f"{{% for i in range(20) %}}part {idx}: {{{{ i }}}} {{{{ HOME }}}}\n{{% endfor %}}"
+        )
+    (templates / "main.tpl").write_text(
+        "".join(f"{{% include 'part_{idx}.tpl' %}}\n" for idx in range(500))
+    )
+    return Workload(
+        "includes", ["--keep-template", "-o", "includes.out", "includes/main.tpl"]
+    )
+
+
+def __fromyaml(workdir: Path, rng: random.Random) -> Workload:
+    services = "".join(
+        f"- name: service-{idx}\n  port: {rng.randint(1024, 65535)}\n  tags: [a, b]\n"
+        for idx in range(100)
+    )
+    (workdir / "services.json").write_text(
+        json.dumps([{"key": "SERVICES", "value": services}])
+    )
+    (workdir / "fromyaml.tpl").write_text(
+        "{% for i in range(1000) %}"
+        "{{ (SERVICES | fromyaml)[i % 100].name }}\n"
+        "{% endfor %}"
+    )
+    return Workload(
+        "fromyaml",
+        ["--keep-template", "--json-file", "services.json", "fromyaml.tpl"],
+    )
+
+
+def __stdin(_: Path, __: random.Random) -> Workload:
+    return Workload("stdin", [], stdin="Hello {{ HOME }}")
+
+
+def __bundle(_: Path, __: random.Random) -> Workload | None:
+    bundle = Constants.DIST_PATH / "temply" / "temply"
+    if not bundle.exists():
+        return None
+    return Workload(
+        "bundle-cold-start", [bundle.absolute().as_posix(), "--version"], python=False
+    )
+
+
+WORKLOADS: list[Callable[[Path, random.Random], Workload | None]] = [
+    __envdir,
+    __dotenv,
+    __json_file,
+    __includes,
+    __fromyaml,
+    __stdin,
+    __bundle,
+]
+
+
+def __run_workloads() -> dict[str, dict[str, float]]:
+    rng = random.Random(SEED)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="temply-bench-") as tmp:
+        workdir = Path(tmp)
+        for create_workload in WORKLOADS:
+            workload = create_workload(workdir, rng)
+            if workload is None:
+                continue
+            results[workload.name] = __measure(workload, workdir)
+    return results
+
+
+def __report(
+    results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]]
+) -> list[str]:
+    regressions = []
+    print(f"{'workload':<20}{'time (ms)':>12}{'peak (MiB)':>12}{'vs baseline':>24}")
+    for name, result in results.items():
+        seconds, peak = result["seconds"], result["peak_memory_bytes"]
+        comparison = "-"
+        if name in baseline:
+            time_ratio = seconds / baseline[name]["seconds"] - 1
+            memory_ratio = peak / baseline[name]["peak_memory_bytes"] - 1
+            comparison = f"{time_ratio:+.0%} time {memory_ratio:+.0%} mem"
+            if time_ratio > TOLERANCE or memory_ratio > TOLERANCE:
+                regressions.append(name)
+        print(f"{name:<20}{seconds * 1000:>12.1f}{peak / 2**20:>12.1f}{comparison:>24}")
+    return regressions
+
+
+def run() -> None:
+    try:
+        baseline = json.loads(Constants.BENCH_BASELINE_PATH.read_text())
+    except FileNotFoundError:
+        baseline = {}
+    except (OSError, ValueError) as err:
+        fatal(
+            f"The `{Constants.BENCH_BASELINE_PATH.as_posix()}` file can't be read", err
+        )
+
+    regressions = __report(__run_workloads(), baseline)
+    if regressions:
+        fatal(f"Regressions over {TOLERANCE:.0%}: {', '.join(regressions)}")
+
+
+def baseline() -> None:
+    results = __run_workloads()
+    __report(results, {})
+    try:
+        Constants.BENCH_BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        Constants.BENCH_BASELINE_PATH.write_text(
+            json.dumps(results, indent=2, sort_keys=True) + "\n"
+        )
+    except OSError as err:
+        fatal(
+            f"The `{Constants.BENCH_BASELINE_PATH.as_posix()}` file can't be written",
+            err,
+        )
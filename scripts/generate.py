@@ -5,7 +5,7 @@ from scripts.utils import Constants, detect_pyinstaller
 
 def run() -> None:
     for os in ("macOS", "linux"):
-        args = ["-n", "temply", "--onedir", "--optimize=1", "--noconfirm"]
+        args = ["-n", "temply", "--onedir", "--optimize=1", "--noconfirm", "--noupx"]
         exclude_modules = ()
         for exclude_module in exclude_modules:
             args.extend(["--exclude-module", exclude_module])
@@ -10,6 +10,7 @@ from sh import Command, CommandNotFound
 class Constants:
     """All constants"""
 
+    BENCH_BASELINE_PATH: Final[Path] = Path("benchmarks") / "baseline.json"
     DIST_PATH: Final[Path] = Path("dist")
     DISTRIBUTIONS_TARBALL_PATH: Final[Path] = Path("distributions") / "tarball"
     DISTRIBUTIONS_TARBALL_LINUX_SPEC_PATH: Final[Path] = (
@@ -29,6 +30,7 @@ class Constants:
     PYINSTALLER_SPEC_PATH: Final[Path] = Path("temply.spec")
     PYPROJECT_PATH: Final[Path] = Path("pyproject.toml")
     REGISTRY_URL: str = os.getenv("REGISTRY_URL", "local.dev")
+    TEMPLY_BIN_PATH: Final[Path] = Path("bin") / "temply"
     TEMPLY_INIT_PATH: Final[Path] = Path("src/temply") / "__init__.py"
 
 
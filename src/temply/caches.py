@@ -0,0 +1,82 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+
+from jinja2 import BytecodeCache, Environment
+from jinja2.bccache import Bucket
+
+from .memo import DEFAULT_BYTECODE_CACHE_SIZE, evict_entries
+
+# Bumped when the code generated for templates changes
+BYTECODE_VERSION = 2
+
+
+class ContentBytecodeCache(BytecodeCache):
+    """Content addressed bytecode cache implementation"""
+
+    def __init__(
+        self, directory: Path, max_size: int = DEFAULT_BYTECODE_CACHE_SIZE
+    ) -> None:
+        """Init content bytecode cache."""
+        self.__directory = directory
+        self.__max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__directory.mkdir(parents=True, exist_ok=True)
+
+    def get_bucket(
+        self, environment: Environment, name: str, filename: str | None, source: str
+    ) -> Bucket:
+        # Key on template name and content, an edited template never reuses stale code
+        key = hashlib.sha256(
+            f"{BYTECODE_VERSION}\0{name}\0{source}".encode()
+        ).hexdigest()
+        bucket = Bucket(environment, key, self.get_source_checksum(source))
+        self.load_bytecode(bucket)
+        return bucket
+
+    def __path(self, bucket: Bucket) -> Path:
+        return self.__directory / f"{bucket.key}.cache"
+
+    def load_bytecode(self, bucket: Bucket) -> None:
+        path = self.__path(bucket)
+        try:
+            with open(path, "rb") as file_descriptor:
+                bucket.load_bytecode(file_descriptor)
+            # Mark entry as recently used for eviction
+            os.utime(path)
+        except OSError:
+            pass
+
+        if bucket.code is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def dump_bytecode(self, bucket: Bucket) -> None:
+        # Write to a temporary file then rename so that concurrent processes
+        # never observe a partially written entry
+        with tempfile.NamedTemporaryFile(
+            mode="wb", dir=self.__directory, prefix=".", suffix=".tmp", delete=False
+        ) as file_descriptor:
+            tmp_path = Path(file_descriptor.name)
+            try:
+                bucket.write_bytecode(file_descriptor)
+            except OSError:
+                tmp_path.unlink(missing_ok=True)
+                return
+        try:
+            os.replace(tmp_path, self.__path(bucket))
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            return
+        self.__evict()
+
+    def __evict(self) -> None:
+        """Remove least recently used entries until the cache fits its size."""
+        evict_entries(self.__directory, (".cache",), self.__max_size)
+
+    def clear(self) -> None:
+        for path in self.__directory.glob("*.cache"):
+            path.unlink(missing_ok=True)
@@ -1,59 +1,820 @@
+from collections.abc import Iterator, Mapping
 from pathlib import Path
+from typing import TYPE_CHECKING, TextIO
 
 import click
-import jinja2
-from jinja2 import DictLoader, Environment, FileSystemLoader
 
 from . import __version__
-from .filters import from_json, from_yaml, get_environment, to_json, to_yaml
-from .loaders import ChainLoader, DotenvLoader, EnvdirLoader, EnvLoader, JsonFileLoader
+from .startup import ImportTracer
 
+# Commands import modules on demand, temply runs on the critical path of startups
+if TYPE_CHECKING:
+    from jinja2 import BaseLoader
 
-@click.command("temply")
-@click.option("--allow-missing", help="Allow missing variables.", is_flag=True)
-@click.option("--keep-template", help="Keep original template file.", is_flag=True)
+    from .caches import ContentBytecodeCache
+    from .limits import RenderLimits
+    from .loaders import LayeredContext
+    from .memo import RenderCache, RenderManifest
+    from .render import Renderer
+    from .stats import Stats
+
+
+# Context meta key of the arguments following the command name
+COMMAND_ARGS_META = "temply.command_args"
+
+# Context meta key of the standard input read before forwarding to a server
+STDIN_META = "temply.stdin"
+
+
+class DefaultGroup(click.Group):
+    """Group implementation falling back to a default command"""
+
+    def __init__(self, *args, default_command: str, **kwargs) -> None:
+        """Init default group."""
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx: click.Context, args: list[str]) -> list[str]:
+        # Keep envtpl compatibility by routing unknown arguments to the default command
+        # Group options precede the command, some of them take a value
+        own_options = {
+            opt: not param.is_flag
+            for param in self.get_params(ctx)
+            if isinstance(param, click.Option)
+            for opt in param.opts
+        }
+        idx = 0
+        while idx < len(args):
+            name, separator, _ = args[idx].partition("=")
+            if name not in own_options:
+                break
+            idx += 2 if own_options[name] and not separator else 1
+        idx = min(idx, len(args))
+        if idx == len(args) or args[idx] not in self.commands:
+            args.insert(idx, self.default_command)
+
+        # Command line of the command, forwarded as is to a server
+        ctx.meta[COMMAND_ARGS_META] = args[idx + 1 :]
+        return super().parse_args(ctx, args)
+
+
+def context_options(func):
+    """
+    Add data source options to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    func = source_options(func)
+    return click.option(
+        "--allow-missing", help="Allow missing variables.", is_flag=True
+    )(func)
+
+
+def source_options(func):
+    """
+    Add data source options to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    options = [
+        click.option(
+            "--envdir",
+            help="Load environment variables from directory",
+            type=click.Path(
+                exists=True, readable=True, file_okay=False, path_type=Path
+            ),
+        ),
+        click.option(
+            "--envdir-max-size",
+            help="Maximum size in bytes of an envdir value.",
+            type=click.IntRange(min=0),
+        ),
+        click.option(
+            "--dotenv",
+            help="Load environment variables from dotenv file",
+            type=click.Path(exists=True, readable=True, dir_okay=False, path_type=Path),
+        ),
+        click.option(
+            "--json-file",
+            help="Load environment variables from json file",
+            type=click.Path(exists=True, readable=True, dir_okay=False, path_type=Path),
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def snapshot_option(func):
+    """
+    Add context snapshot option to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    return click.option(
+        "--context-snapshot",
+        help="Load variables from a snapshot written by `temply snapshot`, "
+        "rewritten once its data sources change.",
+        envvar="TEMPLY_CONTEXT_SNAPSHOT",
+        show_envvar=True,
+        type=click.Path(exists=True, readable=True, dir_okay=False, path_type=Path),
+    )(func)
+
+
+def _default_bytecode_cache_size() -> int:
+    from .memo import DEFAULT_BYTECODE_CACHE_SIZE
+
+    return DEFAULT_BYTECODE_CACHE_SIZE
+
+
+def cache_options(func):
+    """
+    Add template cache options to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    options = [
+        click.option(
+            "--bytecode-cache",
+            help="Cache compiled templates in directory.",
+            envvar="TEMPLY_BYTECODE_CACHE",
+            show_envvar=True,
+            type=click.Path(file_okay=False, writable=True, path_type=Path),
+        ),
+        click.option(
+            "--bytecode-cache-size",
+            help="Maximum size in bytes of the bytecode cache.",
+            envvar="TEMPLY_BYTECODE_CACHE_SIZE",
+            show_envvar=True,
+            default=_default_bytecode_cache_size,
+            show_default="64 MiB",
+            type=click.IntRange(min=0),
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def create_bytecode_cache(
+    bytecode_cache: Path | None, bytecode_cache_size: int
+) -> "ContentBytecodeCache | None":
+    """
+    Create bytecode cache if enabled.
+    Args:
+        bytecode_cache: cache directory path.
+        bytecode_cache_size: maximum size of the cache in bytes.
+
+    Returns:
+        bytecode cache or none if disabled.
+    """
+    if not bytecode_cache:
+        return None
+
+    from .caches import ContentBytecodeCache
+
+    return ContentBytecodeCache(bytecode_cache, bytecode_cache_size)
+
+
+def _default_render_cache_size() -> int:
+    from .memo import DEFAULT_RENDER_CACHE_SIZE
+
+    return DEFAULT_RENDER_CACHE_SIZE
+
+
+def render_cache_options(func):
+    """
+    Add render cache options to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    options = [
+        click.option(
+            "--render-cache",
+            "render_cache_dir",
+            help="Reuse outputs rendered from the same templates and variables, "
+            "cached in directory.",
+            envvar="TEMPLY_RENDER_CACHE",
+            show_envvar=True,
+            type=click.Path(file_okay=False, writable=True, path_type=Path),
+        ),
+        click.option(
+            "--render-cache-size",
+            help="Maximum size in bytes of the render cache.",
+            envvar="TEMPLY_RENDER_CACHE_SIZE",
+            show_envvar=True,
+            default=_default_render_cache_size,
+            show_default="256 MiB",
+            type=click.IntRange(min=0),
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def create_render_cache(
+    render_cache_dir: Path | None, render_cache_size: int
+) -> "RenderCache | None":
+    """
+    Create render cache if enabled.
+    Args:
+        render_cache_dir: cache directory path.
+        render_cache_size: maximum size of the cache in bytes.
+
+    Returns:
+        render cache or none if disabled.
+    """
+    if not render_cache_dir:
+        return None
+
+    from .memo import RenderCache
+
+    return RenderCache(render_cache_dir, render_cache_size)
+
+
+def limits_options(func):
+    """
+    Add render limits options to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    options = [
+        click.option(
+            "--timeout",
+            help="Fail renders of a template taking longer than seconds.",
+            envvar="TEMPLY_TIMEOUT",
+            show_envvar=True,
+            type=click.FloatRange(min=0, min_open=True),
+        ),
+        click.option(
+            "--max-output-bytes",
+            help="Fail renders of a template writing more than bytes.",
+            envvar="TEMPLY_MAX_OUTPUT_BYTES",
+            show_envvar=True,
+            type=click.IntRange(min=0),
+        ),
+        click.option(
+            "--max-loop-iterations",
+            help="Fail renders of a template iterating more than count times in loops "
+            "[default: 1000000 with --sandbox].",
+            envvar="TEMPLY_MAX_LOOP_ITERATIONS",
+            show_envvar=True,
+            type=click.IntRange(min=0),
+        ),
+        click.option(
+            "--sandbox",
+            help="Render in a sandboxed environment denying unsafe attributes.",
+            envvar="TEMPLY_SANDBOX",
+            show_envvar=True,
+            is_flag=True,
+        ),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+def create_render_limits(
+    timeout: float | None,
+    max_output_bytes: int | None,
+    max_loop_iterations: int | None,
+    sandbox: bool,
+) -> "RenderLimits":
+    """
+    Create render limits.
+    Args:
+        timeout: maximum render duration of a template in seconds.
+        max_output_bytes: maximum size of a rendered template.
+        max_loop_iterations: maximum loop iterations of a template.
+        sandbox: render in a sandboxed environment.
+
+    Returns:
+        render limits.
+    """
+    from .limits import RenderLimits
+
+    return RenderLimits(timeout, max_output_bytes, max_loop_iterations, sandbox)
+
+
+def precompiled_option(func):
+    """
+    Add precompiled templates option to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    return click.option(
+        "--precompiled",
+        help="Load templates compiled by `temply compile` from directory or zip file, "
+        "compile the missing ones.",
+        envvar="TEMPLY_PRECOMPILED",
+        show_envvar=True,
+        type=click.Path(path_type=Path),
+    )(func)
+
+
+def create_template_loader(directory: Path, precompiled: Path | None) -> "BaseLoader":
+    """
+    Create loader of the templates of a directory.
+    Args:
+        directory: templates directory path.
+        precompiled: precompiled templates path.
+
+    Returns:
+        template loader.
+    """
+    from jinja2 import FileSystemLoader
+
+    loader = FileSystemLoader(directory.absolute())
+    if not precompiled:
+        return loader
+
+    from .precompiled import PrecompiledLoader
+
+    return PrecompiledLoader(precompiled.absolute(), loader)
+
+
+def only_if_changed_option(func):
+    """
+    Add only if changed option to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    return click.option(
+        "--only-if-changed",
+        help="Don't rewrite output files whose content is unchanged.",
+        is_flag=True,
+    )(func)
+
+
+def deps_option(func):
+    """
+    Add makefile dependencies option to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    return click.option(
+        "--deps",
+        "deps_file",
+        help="Write makefile rules with the templates each output file depends on.",
+        type=click.Path(writable=True, dir_okay=False, path_type=Path),
+    )(func)
+
+
+def stats_option(func):
+    """
+    Add stats option to a command.
+    Args:
+        func: command function.
+
+    Returns:
+        decorated command function.
+    """
+    return click.option(
+        "--stats",
+        "stats_file",
+        help="Append durations of each phase and counters as a json line to file, "
+        "stderr if '-'.",
+        envvar="TEMPLY_STATS",
+        show_envvar=True,
+        type=click.Path(dir_okay=False, allow_dash=True, path_type=Path),
+    )(func)
+
+
+def record_stats(
+    stats: "Stats",
+    renderer: "Renderer",
+    bytecode_cache: "ContentBytecodeCache | None",
+) -> None:
+    """
+    Record template and cache counters of a run.
+    Args:
+        stats: stats of the run.
+        renderer: renderer used by the run.
+        bytecode_cache: bytecode cache used by the renderer.
+    """
+    from .filters import parse_cache_info
+    from .precompiled import PrecompiledLoader
+
+    stats.add_time("compile", renderer.load_seconds)
+    stats.count("templates_loaded", renderer.templates_loaded)
+    if isinstance(renderer.loader, PrecompiledLoader):
+        stats.count("precompiled_hits", renderer.loader.hits)
+        stats.count("precompiled_misses", renderer.loader.misses)
+    if bytecode_cache is not None:
+        stats.count("bytecode_cache_hits", bytecode_cache.hits)
+        stats.count("bytecode_cache_misses", bytecode_cache.misses)
+    for name, info in parse_cache_info().items():
+        stats.count(f"{name}_cache_hits", info.hits)
+        stats.count(f"{name}_cache_misses", info.misses)
+
+
+def load_context(
+    envdir: Path | None,
+    envdir_max_size: int | None,
+    dotenv: Path | None,
+    json_file: Path | None,
+    stats: "Stats | None" = None,
+    context_snapshot: Path | None = None,
+    keys: set[str] | None = None,
+) -> "LayeredContext":
+    """
+    Load variables from all configured data sources.
+    Args:
+        envdir: envdir path.
+        envdir_max_size: maximum size in bytes of an envdir value.
+        dotenv: dotenv file path.
+        json_file: json file path.
+        stats: stats recording the time spent by each loader.
+        context_snapshot: snapshot path, replacing the other data sources.
+        keys: only load these variables if set, snapshots decode values on access.
+
+    Returns:
+        merged variables.
+    """
+    from .loaders import (
+        ChainLoader,
+        DotenvLoader,
+        EnvdirLoader,
+        EnvLoader,
+        JsonFileLoader,
+    )
+
+    loaders = [EnvLoader(keys)]
+    snapshot_loader = None
+    if context_snapshot:
+        if envdir or dotenv or json_file:
+            raise click.UsageError(
+                "--context-snapshot can't be used with --envdir, --dotenv or --json-file"
+            )
+        from .snapshots import SnapshotLoader
+
+        snapshot_loader = SnapshotLoader(context_snapshot)
+        loaders.append(snapshot_loader)
+    if envdir:
+        loaders.append(EnvdirLoader(envdir, envdir_max_size, keys=keys))
+    if dotenv:
+        loaders.append(DotenvLoader(dotenv, keys))
+    if json_file:
+        loaders.append(JsonFileLoader(json_file, keys))
+    chain = ChainLoader(loaders)
+    ctx = chain.load()
+    if stats is not None:
+        stats.add_time("load", chain.seconds)
+        for name, seconds, variables in chain.timings:
+            stats.add_time(f"load_{name}", seconds)
+            stats.count(f"variables_{name}", variables)
+        stats.count("variables", len(ctx))
+        if snapshot_loader is not None:
+            stats.count("snapshot_stale", int(snapshot_loader.stale))
+    return ctx
+
+
+def print_version(ctx: click.Context, _: click.Parameter, value: bool) -> None:
+    """
+    Print version and serializers in use then exit.
+    Args:
+        ctx: click context.
+        _: version option.
+        value: option value.
+    """
+    if not value or ctx.resilient_parsing:
+        return
+    from .serializers import describe_serializers
+
+    click.echo(
+        f"{ctx.find_root().info_name}, version {__version__} ({describe_serializers()})"
+    )
+    ctx.exit()
+
+
+def trace_startup(ctx: click.Context, _: click.Parameter, value: bool) -> None:
+    """
+    Report import timings on stderr when the command exits.
+    Args:
+        ctx: click context.
+        _: startup trace option.
+        value: option value.
+    """
+    if not value or ctx.resilient_parsing:
+        return
+    tracer = ImportTracer()
+    tracer.install()
+    ctx.call_on_close(lambda: tracer.report(click.get_text_stream("stderr")))
+
+
+def render_template(
+    renderer: "Renderer",
+    template_name: str,
+    ctx: Mapping,
+    stats: "Stats",
+    stream: TextIO,
+    output_file: Path | None,
+    only_if_changed: bool,
+    deps_file: Path | None,
+    stats_file: Path | None,
+    bytecode_cache: "ContentBytecodeCache | None",
+    render_cache: "RenderCache | None" = None,
+    output_key: str | None = None,
+    stats_stream: TextIO | None = None,
+    baseline: "Stats | None" = None,
+) -> None:
+    """
+    Render a template to a file or a stream as rendering goes.
+    Args:
+        renderer: template renderer.
+        template_name: name of the template in the loader.
+        ctx: variables available in the template.
+        stats: stats of the run.
+        stream: output stream used without output file.
+        output_file: output file path.
+        only_if_changed: skip output file if its content is unchanged.
+        deps_file: makefile dependencies path.
+        stats_file: stats file path.
+        bytecode_cache: bytecode cache used by the renderer.
+        render_cache: render cache recording the output.
+        output_key: key of the output in the render cache, not recorded if none.
+        stats_stream: stream of stats written to "-", stderr if none.
+        baseline: counters of long lived renderers and caches before the run.
+    """
+    from .deps import write_makefile
+    from .outputs import write_file, write_stream
+
+    if deps_file:
+        write_makefile(deps_file, {output_file: renderer.dependencies(template_name)})
+    chunks = renderer.generate(template_name, ctx)
+    if render_cache is not None and output_key is not None:
+        chunks = render_cache.store(output_key, chunks)
+    if stats_file:
+        chunks = stats.measure_chunks(chunks)
+
+    # Stdout or file, written as rendering goes
+    with stats.phase("output"):
+        if output_file:
+            write_file(output_file, chunks, only_if_changed)
+        else:
+            write_stream(stream, chunks)
+
+    if stats_file:
+        # Templates are loaded while rendering and rendering while writing
+        record_stats(stats, renderer, bytecode_cache)
+        if baseline is not None:
+            stats.subtract(baseline)
+        output = stats.phases.pop("output")
+        stats.phases["render"] -= stats.phases["compile"]
+        stats.phases["write"] = (
+            output - stats.phases["render"] - stats.phases["compile"]
+        )
+        if render_cache is not None:
+            stats.count("render_cache_hits", render_cache.hits)
+            stats.count("render_cache_misses", render_cache.misses)
+        stats.write(stats_file, stats_stream)
+
+
+def write_cached_output(
+    manifest: "RenderManifest",
+    chunks: Iterator[str],
+    stats: "Stats",
+    stream: TextIO,
+    output_file: Path | None,
+    only_if_changed: bool,
+    deps_file: Path | None,
+    stats_file: Path | None,
+    render_cache: "RenderCache",
+) -> None:
+    """
+    Write an output reused from the render cache to a file or a stream.
+    Args:
+        manifest: manifest of the rendered template.
+        chunks: cached output chunks.
+        stats: stats of the run.
+        stream: output stream used without output file.
+        output_file: output file path.
+        only_if_changed: skip output file if its content is unchanged.
+        deps_file: makefile dependencies path.
+        stats_file: stats file path.
+        render_cache: render cache holding the output.
+    """
+    from .outputs import write_file, write_stream
+
+    if deps_file:
+        from .deps import TemplateDependencies, write_makefile
+
+        dependencies = TemplateDependencies()
+        dependencies.filenames = {filename: filename for filename in manifest.files}
+        write_makefile(deps_file, {output_file: dependencies})
+    if stats_file:
+        chunks = stats.measure_chunks(chunks)
+
+    with stats.phase("write"):
+        if output_file:
+            write_file(output_file, chunks, only_if_changed)
+        else:
+            write_stream(stream, chunks)
+
+    if stats_file:
+        stats.count("render_cache_hits", render_cache.hits)
+        stats.count("render_cache_misses", render_cache.misses)
+        stats.write(stats_file)
+
+
+@click.group("temply", cls=DefaultGroup, default_command="render")
 @click.option(
-    "--envdir",
-    help="Load environment variables from directory",
-    type=click.Path(exists=True, readable=True, file_okay=False, path_type=Path),
+    "--version",
+    help="Show the version and exit.",
+    is_flag=True,
+    is_eager=True,
+    expose_value=False,
+    callback=print_version,
 )
 @click.option(
-    "--dotenv",
-    help="Load environment variables from dotenv file",
-    type=click.Path(exists=True, readable=True, dir_okay=False, path_type=Path),
+    "--startup-trace",
+    help="Report startup and import timings on stderr.",
+    envvar="TEMPLY_STARTUP_TRACE",
+    is_flag=True,
+    is_eager=True,
+    expose_value=False,
+    callback=trace_startup,
 )
 @click.option(
-    "--json-file",
-    help="Load environment variables from json file",
-    type=click.Path(exists=True, readable=True, dir_okay=False, path_type=Path),
+    "--server",
+    "server_socket",
+    help="Forward render commands to a server listening on socket, "
+    "render locally if it isn't running.",
+    envvar="TEMPLY_SERVER",
+    show_envvar=True,
+    type=click.Path(dir_okay=False, path_type=Path),
 )
+@click.pass_context
+def main(ctx: click.Context, server_socket: Path | None) -> None:
+    """Render jinja2 templates on the command line with environment variables."""
+    if server_socket and ctx.invoked_subcommand == "render":
+        from .server import forward
+
+        # Parsed without processing values, defaults import the rendering stack
+        args = ctx.meta[COMMAND_ARGS_META]
+        try:
+            opts, _, _ = render.make_parser(ctx).parse_args(list(args))
+            reads_stdin = not isinstance(opts.get("input_file"), str)
+        except click.UsageError:
+            # Reported by the server
+            reads_stdin = False
+        stdin = None
+        if reads_stdin:
+            # Read before connecting, the server handles one client at a time
+            stdin = click.get_text_stream("stdin").read()
+            ctx.meta[STDIN_META] = stdin
+        exit_code = forward(server_socket, args, stdin)
+        if exit_code is not None:
+            ctx.exit(exit_code)
+
+
+@main.command("render")
+@context_options
+@snapshot_option
+@cache_options
+@render_cache_options
+@limits_options
+@precompiled_option
+@click.option("--keep-template", help="Keep original template file.", is_flag=True)
+@click.option(
+    "--only-referenced",
+    help="Only load variables the template and its inclusions reference, "
+    "everything is loaded if they use environment() or dynamic inclusions.",
+    envvar="TEMPLY_ONLY_REFERENCED",
+    show_envvar=True,
+    is_flag=True,
+)
+@only_if_changed_option
+@deps_option
+@stats_option
 @click.option(
     "-o",
     "--output-file",
     help="Output file path.",
     type=click.Path(writable=True, dir_okay=False, path_type=Path),
 )
-@click.version_option(__version__)
 @click.argument(
     "input_file",
     required=False,
     type=click.Path(exists=True, readable=True, dir_okay=False, path_type=Path),
 )
-def main(
+def render(
     allow_missing: bool,
-    keep_template: bool,
     envdir: Path | None,
+    envdir_max_size: int | None,
     dotenv: Path | None,
     json_file: Path | None,
+    context_snapshot: Path | None,
+    bytecode_cache: Path | None,
+    bytecode_cache_size: int,
+    render_cache_dir: Path | None,
+    render_cache_size: int,
+    timeout: float | None,
+    max_output_bytes: int | None,
+    max_loop_iterations: int | None,
+    sandbox: bool,
+    precompiled: Path | None,
+    keep_template: bool,
+    only_referenced: bool,
+    only_if_changed: bool,
+    deps_file: Path | None,
+    stats_file: Path | None,
     output_file: Path | None,
     input_file: Path | None,
 ) -> None:
-    """Render jinja2 templates on the command line with environment variables."""
-    # Define undefined behaviour
-    if allow_missing:
-        undefined_behaviour = jinja2.Undefined
-    else:
-        undefined_behaviour = jinja2.StrictUndefined
+    """Render a template file or stdin (default command)."""
+    from .stats import Stats
+
+    if deps_file and not output_file:
+        raise click.UsageError("--deps requires --output-file")
+
+    # Stdin is read once, its content keys the render cache
+    source = None
+    if not input_file:
+        meta = click.get_current_context().meta
+        if STDIN_META in meta:
+            # Already read to be forwarded to a server that isn't running
+            source = meta[STDIN_META]
+        else:
+            source = click.get_text_stream("stdin").read()
+    stats = Stats("render")
+    limits = create_render_limits(
+        timeout, max_output_bytes, max_loop_iterations, sandbox
+    )
+
+    # Templates and variables are checked against the render cache without jinja2
+    render_cache = create_render_cache(render_cache_dir, render_cache_size)
+    ctx = None
+    manifest = None
+    output_key = None
+    if render_cache:
+        template_key = render_cache.template_key(
+            input_file.absolute().as_posix() if input_file else source,
+            (allow_missing, limits.key),
+        )
+        with stats.phase("render_cache"):
+            manifest = render_cache.manifest(template_key)
+        if manifest:
+            ctx = load_context(
+                envdir,
+                envdir_max_size,
+                dotenv,
+                json_file,
+                stats,
+                context_snapshot,
+                set(manifest.variables),
+            )
+            output_key = manifest.output_key(ctx)
+            chunks = render_cache.get(output_key)
+            if chunks is not None:
+                render_cache.hits += 1
+                write_cached_output(
+                    manifest,
+                    chunks,
+                    stats,
+                    click.get_text_stream("stdout"),
+                    output_file,
+                    only_if_changed,
+                    deps_file,
+                    stats_file,
+                    render_cache,
+                )
+                if input_file and not keep_template:
+                    Path(input_file).unlink()
+                return
+        render_cache.misses += 1
+
+    from jinja2 import DictLoader
+
+    from .render import Renderer
 
     # Decide if we use stdin or regular file
     if input_file:
@@ -61,58 +822,727 @@ def main(
         template_name = str(input_file.name)
 
         # Set loader
-        loader = FileSystemLoader(input_file.parent.absolute())
+        loader = create_template_loader(input_file.parent, precompiled)
     else:
         # Template name
         template_name = "stdin_template"
 
         # Set loader
-        loader = DictLoader({template_name: click.get_text_stream("stdin").read()})
-
-    # Setup environment
-    env = Environment(
-        loader=loader,
-        undefined=undefined_behaviour,
-        trim_blocks=True,
-        lstrip_blocks=True,
-        keep_trailing_newline=True,
+        loader = DictLoader({template_name: source})
+
+    # Render template
+    cache = create_bytecode_cache(bytecode_cache, bytecode_cache_size)
+    renderer = Renderer(loader, allow_missing, cache, limits)
+    if ctx is None:
+        keys = None
+        if only_referenced or render_cache:
+            with stats.phase("analyze"):
+                dependencies = renderer.dependencies(template_name)
+            keys = dependencies.referenced_keys
+        ctx = load_context(
+            envdir, envdir_max_size, dotenv, json_file, stats, context_snapshot, keys
+        )
+
+        # Outputs of templates whose variables are only known at render or whose
+        # renderings differ aren't cached
+        if render_cache and keys is not None and not dependencies.nondeterministic:
+            from .memo import RenderManifest
+
+            filenames = [
+                filename
+                for filename in dependencies.filenames.values()
+                if filename is not None
+            ]
+            # Templates of stdin can't include files
+            absent = []
+            if input_file:
+                directory = input_file.parent.absolute()
+                absent = [
+                    directory.joinpath(*name.split("/")).as_posix()
+                    for name in dependencies.missing_templates
+                ]
+            manifest = RenderManifest.from_files(template_key, filenames, keys, absent)
+            if manifest:
+                render_cache.save_manifest(manifest)
+                output_key = manifest.output_key(ctx)
+    render_template(
+        renderer,
+        template_name,
+        ctx,
+        stats,
+        click.get_text_stream("stdout"),
+        output_file,
+        only_if_changed,
+        deps_file,
+        stats_file,
+        cache,
+        render_cache,
+        output_key,
     )
 
-    # Setup env
-    env.filters["from_json"] = from_json
-    env.filters["fromjson"] = from_json
-    env.filters["to_json"] = to_json
-    env.filters["tojson"] = to_json
-    env.filters["from_yaml"] = from_yaml
-    env.filters["fromyaml"] = from_yaml
-    env.filters["to_yaml"] = to_yaml
-    env.filters["toyaml"] = to_yaml
+    # Remove template
+    if input_file and not keep_template:
+        Path(input_file).unlink()
 
-    # Render template
-    template = env.get_template(template_name)
-    template.globals["environment"] = get_environment
 
-    # Compute env
-    loaders = [EnvLoader()]
+@main.command("render-dir")
+@context_options
+@snapshot_option
+@cache_options
+@limits_options
+@precompiled_option
+@click.option("--keep-template", help="Keep original template files.", is_flag=True)
+@only_if_changed_option
+@deps_option
+@stats_option
+@click.option(
+    "--state-file",
+    help="Skip outputs whose inputs are unchanged since the run recorded in file.",
+    type=click.Path(writable=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--suffix",
+    help="Suffix of template files, stripped from output file names.",
+    default=".tpl",
+    show_default=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes [default: usable cpus].",
+    type=click.IntRange(min=1),
+)
+@click.argument(
+    "src",
+    type=click.Path(exists=True, readable=True, file_okay=False, path_type=Path),
+)
+@click.argument(
+    "dst",
+    type=click.Path(writable=True, file_okay=False, path_type=Path),
+)
+def render_dir(
+    allow_missing: bool,
+    envdir: Path | None,
+    envdir_max_size: int | None,
+    dotenv: Path | None,
+    json_file: Path | None,
+    context_snapshot: Path | None,
+    bytecode_cache: Path | None,
+    bytecode_cache_size: int,
+    timeout: float | None,
+    max_output_bytes: int | None,
+    max_loop_iterations: int | None,
+    sandbox: bool,
+    precompiled: Path | None,
+    keep_template: bool,
+    only_if_changed: bool,
+    deps_file: Path | None,
+    stats_file: Path | None,
+    state_file: Path | None,
+    suffix: str,
+    jobs: int | None,
+    src: Path,
+    dst: Path,
+) -> None:
+    """Render every template of SRC directory into DST directory."""
+    from jinja2 import TemplateSyntaxError
+
+    from .deps import BuildState, write_makefile
+    from .render import Renderer
+    from .stats import Stats
+    from .workers import RenderJob, cpu_count
+
+    # Environment and variables are shared by all templates
+    stats = Stats("render-dir")
+    cache = create_bytecode_cache(bytecode_cache, bytecode_cache_size)
+    limits = create_render_limits(
+        timeout, max_output_bytes, max_loop_iterations, sandbox
+    )
+    renderer = Renderer(
+        create_template_loader(src, precompiled), allow_missing, cache, limits
+    )
+    ctx = load_context(
+        envdir, envdir_max_size, dotenv, json_file, stats, context_snapshot
+    )
+    job = RenderJob(renderer, ctx, src, dst, suffix, only_if_changed)
+    templates = job.templates()
+
+    # A template failing to parse doesn't prevent others from rendering
+    dependencies = {}
+    failures = {}
+    if deps_file or state_file:
+        for template in templates:
+            try:
+                dependencies[template] = renderer.dependencies(template.as_posix())
+            except (TemplateSyntaxError, UnicodeDecodeError, OSError) as err:
+                failures[template] = str(err)
+
+    # Skip output files rendered from the same inputs by the previous run
+    digests = {}
+    pending = [template for template in templates if template not in failures]
+    if state_file:
+        state = BuildState(state_file)
+        digests = {template: dependencies[template].digest(ctx) for template in pending}
+        pending = [
+            template
+            for template in pending
+            if not state.is_up_to_date(job.output_file(template), digests[template])
+        ]
+
+    # Render templates
+    with stats.phase("render"):
+        failures.update(job.run(pending, jobs or cpu_count()))
+    for template, error in failures.items():
+        click.echo(f"Failed to render {template.as_posix()}: {error}", err=True)
+
+    if state_file:
+        for template in templates:
+            digest = None if template in failures else digests[template]
+            state.update(job.output_file(template), digest)
+        state.save()
+    if deps_file:
+        write_makefile(
+            deps_file,
+            {
+                job.output_file(template): dependencies[template]
+                for template in templates
+                if template in dependencies
+            },
+        )
+
+    # Remove rendered templates once all done, they can include each other
+    if not keep_template:
+        for template in templates:
+            if template not in failures:
+                (src / template).unlink()
+
+    if stats_file:
+        # Templates are compiled in this process before rendering in workers
+        record_stats(stats, renderer, cache)
+        stats.phases["render"] -= stats.phases["compile"]
+        stats.count("templates", len(templates))
+        stats.count("templates_skipped", len(templates) - len(pending))
+        stats.count("templates_failed", len(failures))
+        stats.count("files_written", len(job.written))
+        stats.count("bytes_written", sum(path.stat().st_size for path in job.written))
+        stats.write(stats_file)
+
+    if failures:
+        raise click.ClickException(f"{len(failures)} template(s) failed to render")
+
+
+def load_instances(
+    contexts: Path | None, envdirs: Path | None, envdir_max_size: int | None
+) -> list[tuple[str, Mapping]]:
+    """
+    Load variables of the instances of a fan out.
+    Args:
+        contexts: json or yaml file containing an array of objects.
+        envdirs: directory containing an envdir by instance.
+        envdir_max_size: maximum size in bytes of an envdir value.
+
+    Returns:
+        name and variables of each instance.
+    """
+    if envdirs:
+        from .loaders import EnvdirLoader
+
+        directories = sorted(path for path in envdirs.iterdir() if path.is_dir())
+        return [
+            (directory.name, EnvdirLoader(directory, envdir_max_size).load())
+            for directory in directories
+        ]
+
+    from .serializers import get_serializer
+
+    format_name = "yaml" if contexts.suffix in (".yaml", ".yml") else "json"
+    try:
+        rows = get_serializer(format_name).loads(contexts.read_text(encoding="utf-8"))
+    except Exception as err:
+        raise click.FileError(contexts.as_posix(), str(err)) from err
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise click.FileError(contexts.as_posix(), "Must be an array of objects")
+    return [(str(idx), row) for idx, row in enumerate(rows)]
+
+
+@main.command("fan-out")
+@context_options
+@snapshot_option
+@cache_options
+@precompiled_option
+@limits_options
+@only_if_changed_option
+@stats_option
+@click.option(
+    "--contexts",
+    help="Render an instance by object of a json or yaml array.",
+    type=click.Path(exists=True, readable=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--envdirs",
+    help="Render an instance by envdir of a directory.",
+    type=click.Path(exists=True, readable=True, file_okay=False, path_type=Path),
+)
+@click.option(
+    "-o",
+    "--output",
+    "output_pattern",
+    help="Template of the output file path of an instance.",
+    required=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes [default: usable cpus].",
+    type=click.IntRange(min=1),
+)
+@click.argument(
+    "input_file",
+    type=click.Path(exists=True, readable=True, dir_okay=False, path_type=Path),
+)
+def fan_out(
+    allow_missing: bool,
+    envdir: Path | None,
+    envdir_max_size: int | None,
+    dotenv: Path | None,
+    json_file: Path | None,
+    context_snapshot: Path | None,
+    bytecode_cache: Path | None,
+    bytecode_cache_size: int,
+    precompiled: Path | None,
+    timeout: float | None,
+    max_output_bytes: int | None,
+    max_loop_iterations: int | None,
+    sandbox: bool,
+    only_if_changed: bool,
+    stats_file: Path | None,
+    contexts: Path | None,
+    envdirs: Path | None,
+    output_pattern: str,
+    jobs: int | None,
+    input_file: Path,
+) -> None:
+    """Render INPUT_FILE once per instance, the template is kept."""
+    from .render import Renderer
+    from .stats import Stats
+    from .workers import FanOutJob, cpu_count
+
+    if bool(contexts) == bool(envdirs):
+        raise click.UsageError("Exactly one of --contexts or --envdirs is required")
+
+    # Instance variables override the ones of data sources
+    stats = Stats("fan-out")
+    ctx = load_context(
+        envdir, envdir_max_size, dotenv, json_file, stats, context_snapshot
+    )
+    with stats.phase("load_instances"):
+        instances = load_instances(contexts, envdirs, envdir_max_size)
+
+    # Compile once, instances are rendered by workers
+    cache = create_bytecode_cache(bytecode_cache, bytecode_cache_size)
+    limits = create_render_limits(
+        timeout, max_output_bytes, max_loop_iterations, sandbox
+    )
+    renderer = Renderer(
+        create_template_loader(input_file.parent, precompiled),
+        allow_missing,
+        cache,
+        limits,
+    )
+    job = FanOutJob(
+        renderer, input_file.name, ctx, instances, output_pattern, only_if_changed
+    )
+    with stats.phase("render"):
+        failures = job.run(job.instances(), jobs or cpu_count())
+    for idx, error in failures.items():
+        click.echo(
+            f"Failed to render instance {job.instance_name(idx)}: {error}", err=True
+        )
+
+    if stats_file:
+        record_stats(stats, renderer, cache)
+        stats.phases["render"] -= stats.phases["compile"]
+        stats.count("instances", len(instances))
+        stats.count("instances_failed", len(failures))
+        stats.count("files_written", len(job.written))
+        stats.count("bytes_written", sum(path.stat().st_size for path in job.written))
+        stats.write(stats_file)
+
+    if failures:
+        raise click.ClickException(f"{len(failures)} instance(s) failed to render")
+
+
+@main.command("watch")
+@context_options
+@cache_options
+@limits_options
+@only_if_changed_option
+@click.option(
+    "--suffix",
+    help="Suffix of template files, stripped from output file names.",
+    default=".tpl",
+    show_default=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes [default: usable cpus].",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--debounce",
+    help="Seconds without changes to wait before rendering.",
+    default=0.2,
+    show_default=True,
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--exec",
+    "exec_command",
+    help="Shell command to run after output files are written.",
+)
+@click.argument(
+    "src",
+    type=click.Path(exists=True, readable=True, file_okay=False, path_type=Path),
+)
+@click.argument(
+    "dst",
+    type=click.Path(writable=True, file_okay=False, path_type=Path),
+)
+def watch(
+    allow_missing: bool,
+    envdir: Path | None,
+    envdir_max_size: int | None,
+    dotenv: Path | None,
+    json_file: Path | None,
+    bytecode_cache: Path | None,
+    bytecode_cache_size: int,
+    timeout: float | None,
+    max_output_bytes: int | None,
+    max_loop_iterations: int | None,
+    sandbox: bool,
+    only_if_changed: bool,
+    suffix: str,
+    jobs: int | None,
+    debounce: float,
+    exec_command: str | None,
+    src: Path,
+    dst: Path,
+) -> None:
+    """Render templates of SRC directory into DST directory on every change."""
+    import subprocess
+
+    from jinja2 import FileSystemLoader, TemplateSyntaxError
+
+    from .render import Renderer
+    from .watchers import create_watcher
+    from .workers import RenderJob, cpu_count
+
+    src = src.absolute()
+    dst = dst.absolute()
+    renderer = Renderer(
+        FileSystemLoader(src),
+        allow_missing,
+        create_bytecode_cache(bytecode_cache, bytecode_cache_size),
+        create_render_limits(timeout, max_output_bytes, max_loop_iterations, sandbox),
+    )
+
+    # Watch templates and data sources, files are watched through their directory
+    # to catch atomic replacements
+    data_files = [path.absolute() for path in (dotenv, json_file) if path]
+    directories = [(src, True)]
+    if envdir:
+        envdir = envdir.absolute()
+        directories.append((envdir, True))
+    directories.extend({(path.parent, False) for path in data_files})
+    watcher = create_watcher(directories)
+
+    def is_data_source(path: Path) -> bool:
+        if envdir and (path == envdir or envdir in path.parents):
+            return True
+        return any(
+            path.parent == data_file.parent
+            and (path.name == data_file.name or path.name.startswith(".."))
+            for data_file in data_files
+        )
+
+    def run(ctx: Mapping, templates: list[Path]) -> None:
+        job = RenderJob(renderer, ctx, src, dst, suffix, only_if_changed)
+        for template, error in job.run(templates, jobs or cpu_count()).items():
+            click.echo(f"Failed to render {template.as_posix()}: {error}", err=True)
+        if job.written and exec_command:
+            subprocess.run(exec_command, shell=True, check=False)
+
+    ctx = load_context(envdir, envdir_max_size, dotenv, json_file)
+    job = RenderJob(renderer, ctx, src, dst, suffix)
+    run(ctx, job.templates())
+    try:
+        while True:
+            # Wait for changes to settle
+            changed = watcher.wait()
+            while more := watcher.wait(debounce):
+                changed |= more
+
+            # Ignore our own output files
+            templates = job.templates()
+            outputs = {job.output_file(template) for template in templates}
+            changed = {
+                path
+                for path in changed
+                if path not in outputs
+                and not (path.name.startswith(".") and path.name.endswith(".tmp"))
+            }
+            if not changed:
+                continue
+
+            # Variables whose value changed, a missing variable is a change too
+            changed_keys = set()
+            if any(is_data_source(path) for path in changed):
+                try:
+                    new_ctx = load_context(envdir, envdir_max_size, dotenv, json_file)
+                except (click.ClickException, OSError) as err:
+                    click.echo(f"Failed to load data sources: {err}", err=True)
+                    continue
+                changed_keys = {
+                    key
+                    for key in ctx.keys() | new_ctx.keys()
+                    if key not in ctx or key not in new_ctx or ctx[key] != new_ctx[key]
+                }
+                ctx = new_ctx
+
+            # Only render templates affected by changed templates and variables
+            names = {
+                path.relative_to(src).as_posix()
+                for path in changed
+                if src in path.parents
+            }
+            affected = []
+            for template in templates:
+                try:
+                    dependencies = renderer.dependencies(template.as_posix())
+                except (TemplateSyntaxError, UnicodeDecodeError, OSError):
+                    # Reported by the render job, templates may be saved mid-edit
+                    affected.append(template)
+                    continue
+                if (
+                    dependencies.sources.keys() & names
+                    or (dependencies.dynamic_templates and (names or changed_keys))
+                    or (
+                        changed_keys
+                        and (
+                            dependencies.all_variables
+                            or dependencies.variables & changed_keys
+                        )
+                    )
+                ):
+                    affected.append(template)
+            templates = affected
+            run(ctx, templates)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+
+@main.command("check")
+@source_options
+@snapshot_option
+@stats_option
+@click.option(
+    "--suffix",
+    help="Suffix of template files when checking a directory.",
+    default=".tpl",
+    show_default=True,
+)
+@click.option(
+    "--list",
+    "list_variables",
+    help="Print the variables each template reads.",
+    is_flag=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Number of worker processes [default: usable cpus].",
+    type=click.IntRange(min=1),
+)
+@click.argument(
+    "src",
+    type=click.Path(exists=True, readable=True, path_type=Path),
+)
+def check(
+    envdir: Path | None,
+    envdir_max_size: int | None,
+    dotenv: Path | None,
+    json_file: Path | None,
+    context_snapshot: Path | None,
+    stats_file: Path | None,
+    suffix: str,
+    list_variables: bool,
+    jobs: int | None,
+    src: Path,
+) -> None:
+    """Report missing variables of SRC template or directory without rendering."""
+    from jinja2 import FileSystemLoader
+
+    from .render import Renderer
+    from .stats import Stats
+    from .workers import analyze_templates, cpu_count
+
+    if src.is_dir():
+        directory = src
+        templates = sorted(
+            path.relative_to(src).as_posix()
+            for path in src.rglob(f"*{suffix}")
+            if path.is_file()
+        )
+    else:
+        directory = src.parent
+        templates = [src.name]
+
+    # Templates are parsed by workers, inclusions are resolved from the directory
+    stats = Stats("check")
+    renderer = Renderer(FileSystemLoader(directory.absolute()))
+    with stats.phase("analyze"):
+        results = analyze_templates(renderer.env, templates, jobs or cpu_count())
+
+    # Only variables read by some template are loaded
+    keys = set()
+    for result in results.values():
+        referenced_keys = None if isinstance(result, str) else result.referenced_keys
+        if referenced_keys is None:
+            keys = None
+            break
+        keys |= referenced_keys
+    ctx = load_context(
+        envdir, envdir_max_size, dotenv, json_file, stats, context_snapshot, keys
+    )
+
+    failures = 0
+    for name in templates:
+        result = results[name]
+        if isinstance(result, str):
+            failures += 1
+            click.echo(f"Failed to parse {result}", err=True)
+            continue
+        if list_variables:
+            click.echo(f"{name}: {' '.join(sorted(result.variables))}")
+        missing = result.missing(ctx)
+        if missing:
+            click.echo(f"Missing variables in {name}: {', '.join(missing)}", err=True)
+        if result.unresolved_templates:
+            click.echo(
+                f"Missing templates in {name}: {', '.join(result.unresolved_templates)}",
+                err=True,
+            )
+        if missing or result.unresolved_templates:
+            failures += 1
+
+    if stats_file:
+        stats.count("templates", len(templates))
+        stats.count("templates_failed", failures)
+        stats.write(stats_file)
+
+    if failures:
+        raise click.ClickException(f"{failures} template(s) failed the check")
+
+
+@main.command("snapshot")
+@source_options
+@click.argument("output_file", type=click.Path(dir_okay=False, path_type=Path))
+def snapshot(
+    envdir: Path | None,
+    envdir_max_size: int | None,
+    dotenv: Path | None,
+    json_file: Path | None,
+    output_file: Path,
+) -> None:
+    """Write variables of data sources to OUTPUT_FILE snapshot."""
+    from .snapshots import SnapshotSource, write_snapshot
+
+    # Same precedence as rendering, the last source wins
+    sources = []
     if envdir:
-        loaders.append(EnvdirLoader(envdir))
+        sources.append(SnapshotSource("envdir", envdir.absolute(), envdir_max_size))
     if dotenv:
-        loaders.append(DotenvLoader(dotenv))
+        sources.append(SnapshotSource("dotenv", dotenv.absolute()))
     if json_file:
-        loaders.append(JsonFileLoader(json_file))
-    envs = ChainLoader(loaders).load()
+        sources.append(SnapshotSource("json_file", json_file.absolute()))
+    if not sources:
+        raise click.UsageError("At least one of --envdir, --dotenv or --json-file")
+    try:
+        write_snapshot(output_file, sources)
+    except OSError as err:
+        raise click.FileError(output_file.as_posix(), str(err)) from err
 
+
+@main.command("compile")
+@click.option(
+    "--suffix",
+    "suffixes",
+    help="Only compile files with suffix, can be repeated [default: all files].",
+    multiple=True,
+)
+@click.argument(
+    "src",
+    type=click.Path(exists=True, readable=True, file_okay=False, path_type=Path),
+)
+@click.argument("dst", type=click.Path(writable=True, path_type=Path))
+def compile_command(suffixes: tuple[str, ...], src: Path, dst: Path) -> None:
+    """Compile templates of SRC directory into DST directory or zip file."""
+    from jinja2 import FileSystemLoader, TemplateSyntaxError
+
+    from .precompiled import compile_templates
+    from .render import Renderer
+
+    # Compiled code depends on environment options, not on the undefined behaviour
+    renderer = Renderer(FileSystemLoader(src.absolute()))
     try:
-        rendering = template.render(**envs)
-    except jinja2.UndefinedError as err:
-        raise Exception(err) from err
+        compile_templates(
+            renderer.env,
+            dst,
+            (lambda name: name.endswith(suffixes)) if suffixes else None,
+        )
+    except TemplateSyntaxError as err:
+        raise click.ClickException(
+            f"Failed to compile {err.name}:{err.lineno}: {err.message}"
+        ) from err
+    except UnicodeDecodeError as err:
+        raise click.ClickException(
+            f"Failed to compile a template, not utf-8 (see --suffix): {err}"
+        ) from err
+    except OSError as err:
+        raise click.FileError(dst.as_posix(), str(err)) from err
 
-    # Remove template
-    if input_file and not keep_template:
-        Path(input_file).unlink()
 
-    # Stdout or file
-    if output_file:
-        Path(output_file).write_text(rendering, encoding="utf-8")
-    else:
-        click.echo(rendering)
+@main.command("serve")
+@cache_options
+@click.option(
+    "--socket",
+    "socket_path",
+    help="Unix socket to listen on.",
+    required=True,
+    type=click.Path(dir_okay=False, path_type=Path),
+)
+def serve(
+    bytecode_cache: Path | None,
+    bytecode_cache_size: int,
+    socket_path: Path,
+) -> None:
+    """Render templates for clients forwarding their render commands."""
+    import signal
+    import sys
+
+    from .server import RenderServer
+
+    # Remove the socket on termination
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server = RenderServer(
+        socket_path, create_bytecode_cache(bytecode_cache, bytecode_cache_size)
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
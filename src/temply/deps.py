@@ -0,0 +1,249 @@
+import hashlib
+import json
+from collections.abc import Iterator, Mapping
+from pathlib import Path
+
+import jinja2
+from jinja2 import Environment, meta, nodes
+
+from .outputs import write_file
+
+# Globals used by templates to read the whole context
+ENVIRONMENT_GLOBALS = {"environment", "nested_environment"}
+
+# Filters and globals whose result changes from one rendering to the next
+NONDETERMINISTIC_FILTERS = {"random"}
+NONDETERMINISTIC_GLOBALS = {"lipsum"}
+
+# Filters and tests guarding a variable against being undefined
+GUARD_FILTERS = {"default", "d"}
+GUARD_TESTS = {"defined", "undefined"}
+
+STATE_VERSION = 1
+
+
+class TemplateDependencies:
+    """Dependencies of a template"""
+
+    def __init__(self) -> None:
+        """Init template dependencies."""
+        # Sources and file names of the template and all the templates it references
+        self.sources: dict[str, str] = {}
+        self.filenames: dict[str, str | None] = {}
+        # Context variables read by the templates
+        self.variables: set[str] = set()
+        # Variables guarded by a default filter or a defined test in every template
+        self.optional_variables: set[str] = set()
+        # Referenced templates not found, optional inclusions may appear later
+        self.missing_templates: set[str] = set()
+        # Required references resolving to no template, candidates joined by "or"
+        self.unresolved_templates: list[str] = []
+        # Some template names are only known at runtime
+        self.dynamic_templates = False
+        # The whole context is read
+        self.all_variables = False
+        # Renderings of the same inputs may differ
+        self.nondeterministic = False
+
+    @property
+    def referenced_keys(self) -> set[str] | None:
+        """Variables read by the templates, none if they can't be known before."""
+        if self.dynamic_templates or self.all_variables:
+            return None
+        return self.variables
+
+    def missing(self, ctx: Mapping) -> list[str]:
+        """
+        List variables read by the templates but missing in a context.
+        Args:
+            ctx: variables available in the template.
+
+        Returns:
+            sorted names of missing variables.
+        """
+        return sorted(
+            name for name in self.variables - self.optional_variables if name not in ctx
+        )
+
+    def digest(self, ctx: Mapping) -> str | None:
+        """
+        Compute a digest of everything the rendering depends on.
+        Args:
+            ctx: variables available in the template.
+
+        Returns:
+            digest or none if dependencies can't be known before rendering.
+        """
+        if self.dynamic_templates or self.nondeterministic:
+            return None
+
+        digest = hashlib.sha256()
+        for name in sorted(self.sources):
+            digest.update(f"{name}\0{self.sources[name]}\0".encode())
+        names = ctx.keys() if self.all_variables else self.variables
+        for name in sorted(names):
+            if name in ctx:
+                value = json.dumps(ctx[name], sort_keys=True, default=repr)
+                digest.update(f"{name}\0{value}\0".encode())
+            else:
+                digest.update(f"{name}\1\0".encode())
+        return digest.hexdigest()
+
+
+def compute_dependencies(env: Environment, template_name: str) -> TemplateDependencies:
+    """
+    Compute dependencies of a template by walking its syntax tree and the ones
+    of included, imported or extended templates.
+    Args:
+        env: jinja2 environment.
+        template_name: name of the template in the loader.
+
+    Returns:
+        template dependencies.
+    """
+    dependencies = TemplateDependencies()
+    required = set()
+    references = []
+    pending = [template_name]
+    while pending:
+        name = pending.pop()
+        if name in dependencies.sources or name in dependencies.missing_templates:
+            continue
+        try:
+            source, filename, _ = env.loader.get_source(env, name)
+        except jinja2.TemplateNotFound:
+            dependencies.missing_templates.add(name)
+            continue
+        dependencies.sources[name] = source
+        dependencies.filenames[name] = filename
+
+        ast = env.parse(source, name, filename)
+        for candidates, ignore_missing in _referenced_templates(ast):
+            if candidates is None:
+                dependencies.dynamic_templates = True
+            else:
+                pending.extend(candidates)
+                if not ignore_missing:
+                    references.append(candidates)
+        # Globals are never reported as undeclared variables
+        for node in ast.find_all((nodes.Name, nodes.Filter)):
+            if isinstance(node, nodes.Filter):
+                if node.name in NONDETERMINISTIC_FILTERS:
+                    dependencies.nondeterministic = True
+            elif node.name in ENVIRONMENT_GLOBALS:
+                dependencies.all_variables = True
+            elif node.name in NONDETERMINISTIC_GLOBALS:
+                dependencies.nondeterministic = True
+        guarded = _guarded_variables(ast)
+        for variable in meta.find_undeclared_variables(ast):
+            if variable not in env.globals:
+                dependencies.variables.add(variable)
+                if variable not in guarded:
+                    required.add(variable)
+    dependencies.optional_variables = dependencies.variables - required
+
+    # The first candidate found is used, inclusions may ignore missing templates
+    for candidates in references:
+        if not any(name in dependencies.sources for name in candidates):
+            reference = " or ".join(candidates)
+            if reference not in dependencies.unresolved_templates:
+                dependencies.unresolved_templates.append(reference)
+    return dependencies
+
+
+def _referenced_templates(
+    ast: nodes.Template,
+) -> Iterator[tuple[list[str] | None, bool]]:
+    """Candidate names of every referenced template, none if only known at runtime."""
+    for node in ast.find_all(
+        (nodes.Extends, nodes.Include, nodes.Import, nodes.FromImport)
+    ):
+        ignore_missing = isinstance(node, nodes.Include) and node.ignore_missing
+        if isinstance(node.template, (nodes.Tuple, nodes.List)):
+            items = node.template.items
+        else:
+            items = [node.template]
+        names = [item.value for item in items if isinstance(item, nodes.Const)]
+        if len(names) == len(items) and all(isinstance(name, str) for name in names):
+            yield names, ignore_missing
+        else:
+            yield None, ignore_missing
+
+
+def _guarded_variables(ast: nodes.Template) -> set[str]:
+    names = set()
+    for node in ast.find_all((nodes.Filter, nodes.Test)):
+        guards = GUARD_FILTERS if isinstance(node, nodes.Filter) else GUARD_TESTS
+        if node.name in guards and isinstance(node.node, nodes.Name):
+            names.add(node.node.name)
+    return names
+
+
+def _escape_make(path: str) -> str:
+    return path.replace("$", "$$").replace(" ", "\\ ").replace("#", "\\#")
+
+
+def write_makefile(path: Path, targets: dict[Path, TemplateDependencies]) -> None:
+    """
+    Write dependencies of output files as makefile rules.
+    Args:
+        path: makefile path.
+        targets: dependencies by output file.
+    """
+    rules = []
+    for output_file, dependencies in targets.items():
+        prerequisites = " ".join(
+            _escape_make(filename)
+            for filename in dependencies.filenames.values()
+            if filename is not None
+        )
+        rules.append(f"{_escape_make(output_file.as_posix())}: {prerequisites}\n")
+    write_file(path, rules)
+
+
+class BuildState:
+    """Digests of the inputs of output files rendered by a previous run"""
+
+    def __init__(self, path: Path) -> None:
+        """Init build state."""
+        self.__path = path
+        self.__digests: dict[str, str] = {}
+        try:
+            state = json.loads(path.read_text(encoding="utf-8"))
+            if state.get("version") == STATE_VERSION:
+                self.__digests = state["outputs"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def is_up_to_date(self, output_file: Path, digest: str | None) -> bool:
+        """
+        Check if an output file was rendered from the same inputs.
+        Args:
+            output_file: output file path.
+            digest: digest of the inputs.
+
+        Returns:
+            true if output file doesn't need to be rendered.
+        """
+        return (
+            digest is not None
+            and self.__digests.get(output_file.as_posix()) == digest
+            and output_file.exists()
+        )
+
+    def update(self, output_file: Path, digest: str | None) -> None:
+        """
+        Record inputs of an output file.
+        Args:
+            output_file: output file path.
+            digest: digest of the inputs, none to forget the output file.
+        """
+        if digest is None:
+            self.__digests.pop(output_file.as_posix(), None)
+        else:
+            self.__digests[output_file.as_posix()] = digest
+
+    def save(self) -> None:
+        """Persist build state."""
+        state = {"version": STATE_VERSION, "outputs": self.__digests}
+        write_file(self.__path, [json.dumps(state, indent=2, sort_keys=True)])
@@ -1,13 +1,79 @@
-import json
+from bisect import bisect_left
+from collections.abc import Mapping
+from functools import lru_cache
 
-import yaml
 from jinja2 import pass_context, pass_eval_context
 
+from .serializers import get_serializer
+
+# Number of parsed values kept by each parse filter
+PARSE_CACHE_SIZE = 256
+
+
+def _immutable(*_, **__):
+    raise TypeError("Parsed values are shared and can't be modified, copy them first")
+
+
+class FrozenDict(dict):
+    """Dict shared between call sites of a parse filter"""
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+class FrozenList(list):
+    """List shared between call sites of a parse filter"""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+def _load(format_name, value):
+    return _freeze(get_serializer(format_name).loads(value))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_json(value):
+    return _load("json", value)
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_yaml(value):
+    return _load("yaml", value)
+
+
+def parse_cache_info() -> dict:
+    """
+    Get hits and misses of the parse filters caches.
+    Returns:
+        cache statistics by filter.
+    """
+    return {
+        "from_json": _parse_json.cache_info(),
+        "from_yaml": _parse_yaml.cache_info(),
+    }
+
 
 @pass_eval_context
 def from_json(_, value):
     """
-    Parse json value.
+    Parse json value, parsed values are cached and can't be modified.
     Args:
         _: any.
         value: value to parse.
@@ -15,7 +81,11 @@ def from_json(_, value):
     Returns:
         parsed value.
     """
-    return json.loads(value)
+    try:
+        return _parse_json(value)
+    except TypeError:
+        # Unhashable value
+        return _load("json", value)
 
 
 @pass_eval_context
@@ -29,13 +99,13 @@ def to_json(_, value):
     Returns:
         converted value.
     """
-    return json.dumps(value).strip()
+    return get_serializer("json").dumps(value).strip()
 
 
 @pass_eval_context
 def from_yaml(_, value):
     """
-    Parse yaml value.
+    Parse yaml value, parsed values are cached and can't be modified.
     Args:
         _: any.
         value: value to parse.
@@ -43,7 +113,11 @@ def from_yaml(_, value):
     Returns:
         parsed value.
     """
-    return yaml.safe_load(value)
+    try:
+        return _parse_yaml(value)
+    except TypeError:
+        # Unhashable value
+        return _load("yaml", value)
 
 
 @pass_eval_context
@@ -57,7 +131,78 @@ def to_yaml(_, value):
     Returns:
         converted value.
     """
-    return yaml.safe_dump(value).strip()
+    return get_serializer("yaml").dumps(value).strip()
+
+
+class _Node(dict):
+    """Node of a nested view being built"""
+
+
+def _freeze_nodes(node: _Node) -> FrozenDict:
+    return FrozenDict(
+        (key, _freeze_nodes(value) if isinstance(value, _Node) else value)
+        for key, value in node.items()
+    )
+
+
+class PrefixIndex:
+    """Sorted variable names for prefix lookups"""
+
+    def __init__(self, variables: Mapping) -> None:
+        """Init prefix index."""
+        self.__variables = variables
+        self.__names = sorted(variables)
+        self.__nested: dict[tuple[str, str], FrozenDict] = {}
+
+    def names(self, prefix: str) -> list[str]:
+        """
+        Find variable names starting with a prefix.
+        Args:
+            prefix: variable name prefix.
+
+        Returns:
+            sorted variable names.
+        """
+        start = end = bisect_left(self.__names, prefix)
+        while end < len(self.__names) and self.__names[end].startswith(prefix):
+            end += 1
+        return self.__names[start:end]
+
+    def nested(self, prefix: str, separator: str) -> FrozenDict:
+        """
+        Build a nested view of variables starting with a prefix, computed once.
+        Args:
+            prefix: variable name prefix.
+            separator: separator of nested names.
+
+        Returns:
+            nested variables.
+        """
+        key = (prefix, separator)
+        if key not in self.__nested:
+            root = _Node()
+            for name in self.names(prefix):
+                value = self.__variables[name]
+                if callable(value):
+                    continue
+                *parents, leaf = name[len(prefix) :].split(separator)
+                node = root
+                for part in parents:
+                    child = node.get(part)
+                    if not isinstance(child, _Node):
+                        child = node[part] = _Node()
+                    node = child
+                # Names are sorted, a nested variable replaces a variable of the same path
+                if not isinstance(node.get(leaf), _Node):
+                    node[leaf] = value
+            self.__nested[key] = _freeze_nodes(root)
+        return self.__nested[key]
+
+
+def _prefix_index(variables: Mapping) -> PrefixIndex:
+    # Variables of a render carry their index, other mappings are indexed on each call
+    index = getattr(variables, "prefix_index", None)
+    return index if isinstance(index, PrefixIndex) else PrefixIndex(variables)
 
 
 @pass_context
@@ -71,6 +216,31 @@ def get_environment(ctx, prefix=""):
     Returns:
         generator with all environment variables with a prefix.
     """
-    for key, value in sorted(ctx.items()):
-        if not callable(value) and key.startswith(prefix):
+    # Variables set by the template shadow the ones of the render
+    variables = ctx.parent
+    names = _prefix_index(variables).names(prefix)
+    if ctx.vars:
+        names = sorted(
+            set(names).union(key for key in ctx.vars if key.startswith(prefix))
+        )
+    for key in names:
+        value = ctx.vars[key] if key in ctx.vars else variables[key]
+        if not callable(value):
             yield key[len(prefix) :], value
+
+
+@pass_context
+def get_nested_environment(ctx, prefix="", separator="__"):
+    """
+    Nest environment variables with a prefix by splitting their names.
+    Args:
+        ctx: context.
+        prefix: environment variable prefix.
+        separator: separator of nested names.
+
+    Returns:
+        nested environment variables, shared between calls and not modifiable.
+    """
+    if any(key.startswith(prefix) for key in ctx.vars):
+        return PrefixIndex(ctx.get_all()).nested(prefix, separator)
+    return _prefix_index(ctx.parent).nested(prefix, separator)
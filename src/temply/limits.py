@@ -0,0 +1,122 @@
+import time
+import traceback
+from collections.abc import Iterable
+
+import click
+
+# Loop iterations allowed by default in a sandboxed environment
+SANDBOX_MAX_LOOP_ITERATIONS = 1_000_000
+
+# Filter wrapping the iterable of every template loop
+LOOP_FILTER = "temply_loop"
+
+
+class RenderLimitExceeded(click.ClickException):
+    """Render limit exceeded by a template"""
+
+    def locate(self) -> None:
+        """Add the template line being rendered to the message."""
+        location = None
+        for frame, lineno in traceback.walk_tb(self.__traceback__):
+            # Frames rewritten by jinja2 to point to template lines
+            if "__jinja_exception__" in frame.f_globals:
+                location = f"{frame.f_code.co_filename}:{lineno}"
+        if location:
+            self.message = f"{self.message} at {location}"
+
+
+class RenderLimits:
+    """Time, output size and loop iterations budgets of a render"""
+
+    def __init__(
+        self,
+        timeout: float | None = None,
+        max_output_bytes: int | None = None,
+        max_loop_iterations: int | None = None,
+        sandbox: bool = False,
+    ) -> None:
+        """
+        Init render limits.
+        Args:
+            timeout: maximum render duration in seconds.
+            max_output_bytes: maximum size of a rendered template.
+            max_loop_iterations: maximum iterations of all the loops of a render.
+            sandbox: render in a sandboxed environment.
+        """
+        if sandbox and max_loop_iterations is None:
+            max_loop_iterations = SANDBOX_MAX_LOOP_ITERATIONS
+        self.timeout = timeout
+        self.max_output_bytes = max_output_bytes
+        self.max_loop_iterations = max_loop_iterations
+        self.sandbox = sandbox
+        self.__deadline = 0.0
+        self.__output_bytes = 0
+        self.__loop_iterations = 0
+
+    @property
+    def key(self) -> tuple:
+        """Limits as a hashable key."""
+        return (
+            self.timeout,
+            self.max_output_bytes,
+            self.max_loop_iterations,
+            self.sandbox,
+        )
+
+    @property
+    def checks_chunks(self) -> bool:
+        """Rendered chunks are checked."""
+        return self.timeout is not None or self.max_output_bytes is not None
+
+    def start(self) -> None:
+        """Start the budgets of a render."""
+        if self.timeout is not None:
+            self.__deadline = time.monotonic() + self.timeout
+        self.__output_bytes = 0
+        self.__loop_iterations = 0
+
+    def check_chunk(self, chunk: str) -> RenderLimitExceeded | None:
+        """
+        Check budgets before writing a rendered chunk.
+        Args:
+            chunk: rendered chunk.
+
+        Returns:
+            error to raise in the template or none if within budgets.
+        """
+        if self.timeout is not None and time.monotonic() > self.__deadline:
+            return RenderLimitExceeded(f"Render timeout of {self.timeout}s exceeded")
+        if self.max_output_bytes is not None:
+            self.__output_bytes += len(chunk.encode("utf-8"))
+            if self.__output_bytes > self.max_output_bytes:
+                return RenderLimitExceeded(
+                    f"Output size limit of {self.max_output_bytes} bytes exceeded"
+                )
+        return None
+
+    def loop(self, iterable: Iterable) -> Iterable:
+        """
+        Check budgets on every iteration of a template loop.
+        Args:
+            iterable: loop iterable.
+
+        Returns:
+            checked iterable, the iterable itself without time and iterations limits.
+        """
+        if self.timeout is None and self.max_loop_iterations is None:
+            return iterable
+        return self.__checked(iterable)
+
+    def __checked(self, iterable: Iterable) -> Iterable:
+        for item in iterable:
+            self.__loop_iterations += 1
+            if (
+                self.max_loop_iterations is not None
+                and self.__loop_iterations > self.max_loop_iterations
+            ):
+                raise RenderLimitExceeded(
+                    f"Loop iterations limit of {self.max_loop_iterations} exceeded"
+                )
+            if self.timeout is not None and time.monotonic() > self.__deadline:
+                raise RenderLimitExceeded(f"Render timeout of {self.timeout}s exceeded")
+            yield item
@@ -1,101 +1,448 @@
+import codecs
 import json
+import mmap
 import os
+import re
+import time
 from abc import ABC, abstractmethod
+from collections import ChainMap
+from collections.abc import Iterator, Mapping
+from functools import cache
 from pathlib import Path
+from typing import BinaryIO
 
 import click
 
+# Envdir files are read by a pool of threads above this number of files
+ENVDIR_CONCURRENCY_THRESHOLD = 64
+ENVDIR_MAX_WORKERS = 16
+
+# Dotenv files are mapped in memory above this size
+DOTENV_MMAP_THRESHOLD = 1024 * 1024
+_DOTENV_LINE = r"""
+    [ \t]*(?:\#[^\r\n]*)?(?:\r?\n|\Z)
+    | [ \t]*(?:export[ \t]+)?(?P<key>[^\s=\#'"]+)[ \t]*=[ \t]*
+      (?:
+        '(?P<single>[^']*)'
+        | "(?P<double>(?:[^"\\]|\\.)*)"
+        | (?P<value>[^\r\n]*)
+      )
+      [ \t]*(?:\#[^\r\n]*)?(?:\r?\n|\Z)
+    | (?P<error>[^\r\n]+)(?:\r?\n|\Z)
+    """
+# Content without these tokens only has plain assignments
+_DOTENV_SPECIAL_TOKENS = ("#", "'", '"', "\r", "\f", "\v")
+_DOTENV_COMMENT = re.compile(r"[ \t]+\#.*")
+_DOTENV_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+_DOTENV_ESCAPES = {
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    '"': '"',
+    "\\": "\\",
+    "$": "$",
+}
+
+# Json files are decoded by chunks, a chunk grows while an element doesn't fit in it
+JSON_CHUNK_SIZE = 1024 * 1024
+JSON_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_SEPARATOR = re.compile(r"[ \t\n\r]*,[ \t\n\r]*")
+
 
 class Loader(ABC):
     """Abstract loader"""
 
+    # Name reported in stats
+    name = "loader"
+
+    # Loader mostly waiting on file reads, run concurrently with other ones
+    io_bound = False
+
     @abstractmethod
-    def load(self) -> dict:
+    def load(self) -> Mapping:
         """
         Load from data source.
         """
         return {}
 
 
+def _select(ctx: Mapping, keys: set[str] | None) -> Mapping:
+    if keys is None:
+        return ctx
+    return {key: ctx[key] for key in keys if key in ctx}
+
+
+class LayeredContext(ChainMap):
+    """Layered variables, a layer overrides the layers after it"""
+
+
 class ChainLoader(Loader):
     """Chain loader implementation"""
 
+    name = "chain"
+
     def __init__(self, loaders: list[Loader]) -> None:
         """Init chain loader."""
         self.__loaders = loaders
+        # Name, duration in seconds and number of variables of each loader
+        self.timings: list[tuple[str, float, int]] = []
+        # Duration in seconds of the whole chain, loaders overlap
+        self.seconds = 0.0
 
-    def load(self) -> dict:
-        ctx = {}
-        for loader in self.__loaders:
-            ctx = {**ctx, **loader.load()}
-        return ctx
+    @staticmethod
+    def __timed_load(loader: Loader) -> tuple[Mapping, float]:
+        start = time.perf_counter()
+        layer = loader.load()
+        return layer, time.perf_counter() - start
+
+    def load(self) -> LayeredContext:
+        start = time.perf_counter()
+        io_bound = [loader for loader in self.__loaders if loader.io_bound]
+        if len(io_bound) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # Other loaders run meanwhile, results are taken in precedence order
+            with ThreadPoolExecutor(max_workers=len(io_bound)) as executor:
+                futures = {
+                    loader: executor.submit(self.__timed_load, loader)
+                    for loader in io_bound
+                }
+                done = {
+                    loader: self.__timed_load(loader)
+                    for loader in self.__loaders
+                    if loader not in futures
+                }
+                results = [
+                    done[loader] if loader in done else futures[loader].result()
+                    for loader in self.__loaders
+                ]
+        else:
+            results = [self.__timed_load(loader) for loader in self.__loaders]
+        self.seconds = time.perf_counter() - start
+        self.timings = [
+            (loader.name, seconds, len(layer))
+            for loader, (layer, seconds) in zip(self.__loaders, results, strict=True)
+        ]
+
+        # Layers are looked up lazily instead of being merged, last loader wins
+        return LayeredContext(*reversed([layer for layer, _ in results]))
 
 
 class EnvLoader(Loader):
     """Environment loader implementation"""
 
-    def load(self) -> dict:
-        ctx = {}
-        for key, value in os.environ.items():
-            ctx[key] = value
-        return ctx
+    name = "env"
+
+    def __init__(self, keys: set[str] | None = None) -> None:
+        """
+        Init environment loader.
+        Args:
+            keys: only load these variables if set.
+        """
+        self.__keys = keys
+
+    def load(self) -> Mapping:
+        # Values are decoded on access
+        return _select(os.environ, self.__keys)
 
 
 class EnvdirLoader(Loader):
     """Environment directory loader implementation"""
 
-    def __init__(self, path: Path) -> None:
-        """Init envdir loader."""
+    name = "envdir"
+    io_bound = True
+
+    def __init__(
+        self,
+        path: Path,
+        max_value_size: int | None = None,
+        max_workers: int = ENVDIR_MAX_WORKERS,
+        keys: set[str] | None = None,
+    ) -> None:
+        """
+        Init envdir loader.
+        Args:
+            path: envdir path.
+            max_value_size: maximum size in bytes of a value.
+            max_workers: maximum number of threads reading files.
+            keys: only read files of these variables if set.
+        """
         self.__path = path
+        self.__max_value_size = max_value_size
+        self.__max_workers = max_workers
+        self.__keys = keys
+
+    def __files(self) -> list[tuple[str, str]]:
+        """List files like a top-down walk, symlinks to directories aren't followed."""
+        files = []
+        pending = [self.__path.as_posix()]
+        while pending:
+            directories = []
+            with os.scandir(pending.pop()) as it:
+                for entry in sorted(it, key=lambda entry: entry.name):
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            directories.append(entry.path)
+                    else:
+                        files.append((entry.name, entry.path))
+            pending.extend(reversed(directories))
+        return files
+
+    def __read(self, path: str) -> str:
+        try:
+            with open(path, "rb") as file_descriptor:
+                if self.__max_value_size is None:
+                    data = file_descriptor.read()
+                else:
+                    data = file_descriptor.read(self.__max_value_size + 1)
+        except OSError as err:
+            raise click.FileError(path, str(err)) from err
+        if self.__max_value_size is not None and len(data) > self.__max_value_size:
+            raise click.FileError(path, f"Value exceeds {self.__max_value_size} bytes")
+        return data.strip(b"\n\t ").replace(b"\x00", b"\n").decode("utf-8")
+
+    def __read_all(self, paths: list[str]) -> list[str]:
+        return [self.__read(path) for path in paths]
 
     def load(self) -> dict:
+        files = self.__files()
+        if self.__keys is not None:
+            files = [(name, path) for name, path in files if name in self.__keys]
+
+        # Read files concurrently by batches, values are applied in walk order
+        paths = [path for _, path in files]
+        if len(paths) < ENVDIR_CONCURRENCY_THRESHOLD or self.__max_workers <= 1:
+            values = self.__read_all(paths)
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            size = -(-len(paths) // self.__max_workers)
+            batches = [paths[idx : idx + size] for idx in range(0, len(paths), size)]
+            with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+                values = [
+                    value
+                    for batch in executor.map(self.__read_all, batches)
+                    for value in batch
+                ]
+
         ctx = {}
-        for root, _, files in os.walk(self.__path.as_posix(), followlinks=False):
-            for file in files:
-                with open(
-                    os.path.join(root, file), "r", encoding="utf-8"
-                ) as file_descriptor:
-                    value = file_descriptor.read().strip("\n\t ").replace("\x00", "\n")
-                    if len(value) > 0:
-                        ctx[file] = value
-                    else:
-                        del ctx[file]
+        for (name, _), value in zip(files, values, strict=True):
+            if len(value) > 0:
+                ctx[name] = value
+            else:
+                # Empty file unsets the variable
+                ctx.pop(name, None)
         return ctx
 
 
+@cache
+def _dotenv_line() -> re.Pattern:
+    # Only compiled for files using more than plain assignments
+    return re.compile(_DOTENV_LINE, re.VERBOSE | re.DOTALL | re.ASCII)
+
+
+def _unescape_dotenv(match: re.Match) -> str:
+    return _DOTENV_ESCAPES.get(match.group(1), match.group(0))
+
+
+def _parse_dotenv(data: bytes, keys: set[str] | None = None) -> dict:
+    """
+    Parse dotenv content decoded once.
+    Args:
+        data: dotenv content.
+        keys: only unquote and unescape values of these variables if set.
+
+    Returns:
+        parsed variables.
+
+    Raises:
+        ValueError: if a line isn't a valid assignment.
+    """
+    text = str(data, "utf-8")
+
+    # Fast path for plain assignments, the common case of generated files
+    if not any(token in text for token in _DOTENV_SPECIAL_TOKENS):
+        ctx = {}
+        for line in text.split("\n"):
+            key, separator, value = line.partition("=")
+            if not separator or " " in key or "\t" in key or not key:
+                key = key.strip(" \t")
+                if key.startswith(("export ", "export\t")):
+                    key = key[6:].lstrip(" \t")
+                if not separator or not key or " " in key or "\t" in key:
+                    if separator or line.strip(" \t"):
+                        number = text.split("\n").index(line) + 1
+                        raise ValueError(f"Invalid line {number}")
+                    continue
+            if keys is None or key in keys:
+                ctx[key] = value.strip(" \t")
+        return ctx
+
+    ctx = {}
+    for match in _dotenv_line().finditer(text):
+        key = match.group("key")
+        if key is None:
+            if match.group("error"):
+                line = text.count("\n", 0, match.start()) + 1
+                raise ValueError(f"Invalid line {line}")
+            continue
+        if keys is not None and key not in keys:
+            # Lines are still validated
+            continue
+
+        value = match.group("value")
+        if value is not None:
+            # Unquoted value, a comment must be preceded by a whitespace
+            if "#" in value:
+                value = _DOTENV_COMMENT.sub("", value)
+            value = value.strip(" \t")
+        elif (value := match.group("single")) is None:
+            value = match.group("double")
+            if "\\" in value:
+                value = _DOTENV_ESCAPE.sub(_unescape_dotenv, value)
+        ctx[key] = value
+    return ctx
+
+
 class DotenvLoader(Loader):
     """Environment file loader implementation"""
 
-    def __init__(self, path: Path) -> None:
-        """Init dotenv loader."""
+    name = "dotenv"
+    io_bound = True
+
+    def __init__(self, path: Path, keys: set[str] | None = None) -> None:
+        """
+        Init dotenv loader.
+        Args:
+            path: dotenv file path.
+            keys: only load these variables if set.
+        """
         self.__path = path
+        self.__keys = keys
 
     def load(self) -> dict:
-        ctx = {}
-
         # Check dotfile is a regular file
         if not self.__path.is_file():
             raise click.FileError(str(self.__path.absolute()), "Must be a regular file")
 
-        # Process
+        # Process, large files are mapped instead of being read in memory
         try:
-            value = self.__path.read_text(encoding="utf-8")
-            lines = value.splitlines()
-            for line in lines:
-                key, value = line.split("=", 1)
-                ctx[key] = value
-        except OSError as err:
+            with open(self.__path, "rb") as file_descriptor:
+                size = os.fstat(file_descriptor.fileno()).st_size
+                if size < DOTENV_MMAP_THRESHOLD:
+                    return _parse_dotenv(file_descriptor.read(), self.__keys)
+                with mmap.mmap(
+                    file_descriptor.fileno(), 0, access=mmap.ACCESS_READ
+                ) as data:
+                    return _parse_dotenv(data, self.__keys)
+        except (OSError, ValueError) as err:
             raise click.FileError(str(self.__path.absolute()), str(err))
 
-        return ctx
+
+def _iter_json_array(file_descriptor: BinaryIO) -> Iterator:
+    """
+    Decode elements of a json array incrementally.
+    Args:
+        file_descriptor: binary file containing a json array.
+
+    Returns:
+        generator of decoded elements.
+
+    Raises:
+        ValueError: if content isn't a valid json array.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+    chunk_size = JSON_CHUNK_SIZE
+
+    def read() -> None:
+        nonlocal buffer, pos, eof
+        data = file_descriptor.read(chunk_size)
+        eof = not data
+        buffer = buffer[pos:] + text_decoder.decode(data, final=eof)
+        pos = 0
+
+    def next_char() -> str:
+        nonlocal pos
+        while True:
+            pos = _JSON_WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if eof:
+                raise ValueError("Unexpected end of json array")
+            read()
+
+    def check_end() -> None:
+        nonlocal pos
+        pos += 1
+        while True:
+            pos = _JSON_WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                raise ValueError("Unexpected data after json array")
+            if eof:
+                return
+            read()
+
+    if next_char() != "[":
+        raise ValueError("Must be a json array")
+    pos += 1
+    if next_char() == "]":
+        check_end()
+        return
+
+    scan_once = decoder.scan_once
+    while True:
+        try:
+            value, end = scan_once(buffer, pos)
+        except (StopIteration, json.JSONDecodeError):
+            value, end = None, None
+        if end is None or (end == len(buffer) and not eof):
+            # Element is truncated or may continue in next chunk
+            if eof:
+                raise ValueError("Invalid json element")
+            chunk_size = min(chunk_size * 2, JSON_MAX_CHUNK_SIZE)
+            read()
+            continue
+
+        chunk_size = JSON_CHUNK_SIZE
+        yield value
+
+        # Fast path when next element is already buffered
+        match = _JSON_SEPARATOR.match(buffer, end)
+        if match and match.end() < len(buffer):
+            pos = match.end()
+            continue
+
+        pos = end
+        separator = next_char()
+        if separator == "]":
+            check_end()
+            return
+        if separator != ",":
+            raise ValueError("Expected ',' or ']' after json element")
+        pos += 1
+        next_char()
 
 
 class JsonFileLoader(Loader):
     """Environment json file loader implementation"""
 
-    def __init__(self, path: Path) -> None:
-        """Init json file loader."""
+    name = "json_file"
+    io_bound = True
+
+    def __init__(self, path: Path, keys: set[str] | None = None) -> None:
+        """
+        Init json file loader.
+        Args:
+            path: json file path.
+            keys: only load these variables if set.
+        """
         self.__path = path
+        self.__keys = keys
 
     def load(self) -> dict:
         ctx = {}
@@ -104,13 +451,19 @@ class JsonFileLoader(Loader):
         if not self.__path.is_file():
             raise click.FileError(str(self.__path.absolute()), "Must be a regular file")
 
-        # Process
+        # Process elements as they are decoded to keep memory flat
         try:
-            values = json.loads(self.__path.read_text(encoding="utf-8"))
-            for val in values:
-                if val.get("key"):
-                    ctx[val.get("key")] = val.get("value")
-        except OSError as err:
+            with open(self.__path, "rb") as file_descriptor:
+                for val in _iter_json_array(file_descriptor):
+                    if not isinstance(val, dict):
+                        raise click.FileError(
+                            str(self.__path.absolute()),
+                            "Must be a json array of objects",
+                        )
+                    key = val.get("key")
+                    if key and (self.__keys is None or key in self.__keys):
+                        ctx[key] = val.get("value")
+        except (OSError, ValueError) as err:
             raise click.FileError(str(self.__path.absolute()), str(err))
 
         return ctx
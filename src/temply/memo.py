@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import tempfile
+from collections.abc import Iterable, Iterator, Mapping
+from pathlib import Path
+
+from . import __version__
+
+# Defaults of the cache options, resolved without importing jinja2
+DEFAULT_BYTECODE_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_RENDER_CACHE_SIZE = 256 * 1024 * 1024
+
+# Bumped when the layout of manifests or the keys of outputs change
+RENDER_CACHE_VERSION = 2
+
+# Size of the blocks read from a cached output
+READ_SIZE = 64 * 1024
+
+_MANIFEST_SUFFIX = ".manifest"
+_OUTPUT_SUFFIX = ".output"
+
+
+def _file_digest(path: str) -> str | None:
+    try:
+        with open(path, "rb") as file_descriptor:
+            return hashlib.file_digest(file_descriptor, "sha256").hexdigest()
+    except OSError:
+        return None
+
+
+def evict_entries(directory: Path, suffixes: tuple[str, ...], max_size: int) -> None:
+    """
+    Remove least recently used entries of a cache directory until it fits its size.
+    Args:
+        directory: cache directory path.
+        suffixes: suffixes of entry files.
+        max_size: maximum size of the entries in bytes.
+    """
+    entries = []
+    total_size = 0
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.name.endswith(suffixes):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        # Another process may have evicted it already
+        Path(path).unlink(missing_ok=True)
+        total_size -= size
+
+
+class RenderManifest:
+    """Template files and variables a rendered output depends on"""
+
+    def __init__(
+        self,
+        key: str,
+        files: dict[str, str],
+        variables: list[str],
+        absent: list[str] | None = None,
+    ) -> None:
+        """
+        Init render manifest.
+        Args:
+            key: key of the template and render options.
+            files: content digest by template file path.
+            variables: names of the variables read by the templates.
+            absent: paths of referenced template files that don't exist.
+        """
+        self.key = key
+        self.files = files
+        self.variables = variables
+        self.absent = absent or []
+
+    @classmethod
+    def from_files(
+        cls,
+        key: str,
+        filenames: Iterable[str],
+        variables: Iterable[str],
+        absent: Iterable[str] = (),
+    ) -> "RenderManifest | None":
+        """
+        Create the manifest of template files as they are now.
+        Args:
+            key: key of the template and render options.
+            filenames: template file paths.
+            variables: names of the variables read by the templates.
+            absent: paths of referenced template files that don't exist.
+
+        Returns:
+            manifest or none if a template file can't be read.
+        """
+        files = {}
+        for filename in filenames:
+            filename = os.path.abspath(filename)
+            digest = _file_digest(filename)
+            if digest is None:
+                return None
+            files[filename] = digest
+        absent = sorted(os.path.abspath(filename) for filename in absent)
+        if any(os.path.exists(filename) for filename in absent):
+            return None
+        return cls(key, files, sorted(variables), absent)
+
+    def is_fresh(self) -> bool:
+        """
+        Check template files are unchanged since the manifest was written.
+        Returns:
+            true if every template file has the same content and absent ones are
+            still missing.
+        """
+        return all(
+            _file_digest(filename) == digest for filename, digest in self.files.items()
+        ) and not any(os.path.exists(filename) for filename in self.absent)
+
+    def output_key(self, ctx: Mapping) -> str:
+        """
+        Compute the key of the output rendered from templates and variables.
+        Args:
+            ctx: variables available in the template.
+
+        Returns:
+            output key.
+        """
+        digest = hashlib.sha256(f"{self.key}\0".encode())
+        for filename in sorted(self.files):
+            digest.update(f"{filename}\0{self.files[filename]}\0".encode())
+        for name in self.variables:
+            if name in ctx:
+                value = json.dumps(ctx[name], sort_keys=True, default=repr)
+                digest.update(f"{name}\0{value}\0".encode())
+            else:
+                digest.update(f"{name}\1\0".encode())
+        return digest.hexdigest()
+
+    def to_dict(self) -> dict:
+        """
+        Convert manifest to a json serializable dict.
+        Returns:
+            manifest description.
+        """
+        return {
+            "version": RENDER_CACHE_VERSION,
+            "files": self.files,
+            "variables": self.variables,
+            "absent": self.absent,
+        }
+
+
+class RenderCache:
+    """Content addressed cache of rendered outputs"""
+
+    def __init__(
+        self, directory: Path, max_size: int = DEFAULT_RENDER_CACHE_SIZE
+    ) -> None:
+        """Init render cache."""
+        self.__directory = directory
+        self.__max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def template_key(template: str, options: tuple) -> str:
+        """
+        Compute the key of a template rendered with options.
+        Args:
+            template: absolute path of a template file or source of a template.
+            options: render options changing the output.
+
+        Returns:
+            template key.
+        """
+        return hashlib.sha256(
+            f"{RENDER_CACHE_VERSION}\0{__version__}\0{template}\0{options!r}".encode()
+        ).hexdigest()
+
+    def __commit(self, tmp_path: Path, path: Path) -> None:
+        # Concurrent processes never observe a partially written entry
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            return
+        evict_entries(
+            self.__directory, (_MANIFEST_SUFFIX, _OUTPUT_SUFFIX), self.__max_size
+        )
+
+    def manifest(self, key: str) -> RenderManifest | None:
+        """
+        Get the manifest of a template if its files are unchanged.
+        Args:
+            key: template key.
+
+        Returns:
+            manifest or none if missing or stale.
+        """
+        try:
+            manifest = json.loads(
+                (self.__directory / f"{key}{_MANIFEST_SUFFIX}").read_bytes()
+            )
+            if manifest.get("version") != RENDER_CACHE_VERSION:
+                return None
+            manifest = RenderManifest(
+                key, manifest["files"], manifest["variables"], manifest["absent"]
+            )
+        except (OSError, ValueError, KeyError, AttributeError):
+            return None
+        return manifest if manifest.is_fresh() else None
+
+    def save_manifest(self, manifest: RenderManifest) -> None:
+        """
+        Record the template files and variables of a template.
+        Args:
+            manifest: render manifest.
+        """
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=self.__directory, prefix=".", suffix=".tmp", delete=False
+            ) as file_descriptor:
+                tmp_path = Path(file_descriptor.name)
+                try:
+                    file_descriptor.write(
+                        json.dumps(manifest.to_dict(), sort_keys=True).encode()
+                    )
+                except OSError:
+                    file_descriptor.close()
+                    tmp_path.unlink(missing_ok=True)
+                    return
+        except OSError:
+            return
+        self.__commit(tmp_path, self.__directory / f"{manifest.key}{_MANIFEST_SUFFIX}")
+
+    def get(self, output_key: str) -> Iterator[str] | None:
+        """
+        Get a rendered output.
+        Args:
+            output_key: output key.
+
+        Returns:
+            generator of output chunks or none if missing.
+        """
+        path = self.__directory / f"{output_key}{_OUTPUT_SUFFIX}"
+        try:
+            file_descriptor = open(path, encoding="utf-8", newline="")  # noqa: SIM115
+            # Mark entry as recently used for eviction
+            os.utime(path)
+        except OSError:
+            return None
+        return self.__read(file_descriptor)
+
+    @staticmethod
+    def __read(file_descriptor) -> Iterator[str]:
+        with file_descriptor:
+            while chunk := file_descriptor.read(READ_SIZE):
+                yield chunk
+
+    def store(self, output_key: str, chunks: Iterable[str]) -> Iterator[str]:
+        """
+        Record an output as it is rendered, only kept once rendering succeeds.
+        Args:
+            output_key: output key.
+            chunks: rendered chunks.
+
+        Returns:
+            generator of rendered chunks.
+        """
+        try:
+            file_descriptor = tempfile.NamedTemporaryFile(  # noqa: SIM115
+                dir=self.__directory, prefix=".", suffix=".tmp", delete=False
+            )
+        except OSError:
+            yield from chunks
+            return
+
+        # Rendering goes on even if the cache can't be written
+        tmp_path = Path(file_descriptor.name)
+        cached = True
+        try:
+            with file_descriptor:
+                for chunk in chunks:
+                    if cached:
+                        try:
+                            file_descriptor.write(chunk.encode("utf-8"))
+                        except OSError:
+                            cached = False
+                    yield chunk
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        if cached:
+            self.__commit(tmp_path, self.__directory / f"{output_key}{_OUTPUT_SUFFIX}")
+        else:
+            tmp_path.unlink(missing_ok=True)
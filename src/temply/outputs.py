@@ -0,0 +1,227 @@
+import os
+import stat
+import tempfile
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from pathlib import Path
+from typing import BinaryIO, TextIO
+
+# Size of write buffers, rendered chunks are usually tiny
+BUFFER_SIZE = 64 * 1024
+
+# Number of rendered chunks joined before writing
+BATCH_CHUNKS = 4096
+
+# Staged files are flushed by a pool of threads above this number of files
+FSYNC_CONCURRENCY_THRESHOLD = 8
+FSYNC_MAX_WORKERS = 16
+
+
+def _batch(chunks: Iterable[str]) -> Iterator[str]:
+    """Join tiny rendered chunks into blocks to limit write calls."""
+    iterator = iter(chunks)
+    while block := list(islice(iterator, BATCH_CHUNKS)):
+        yield "".join(block)
+
+
+def _fsync(path: Path) -> None:
+    with open(path, "rb") as file_descriptor:
+        os.fsync(file_descriptor.fileno())
+
+
+def _default_mode() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class StagedFile:
+    """Rendered file waiting to replace its target"""
+
+    def __init__(self, tmp_path: Path, path: Path) -> None:
+        """Init staged file."""
+        self.tmp_path = tmp_path
+        self.path = path
+
+    def discard(self) -> None:
+        """Remove the temporary file."""
+        self.tmp_path.unlink(missing_ok=True)
+
+
+def _create_staged_file(path: Path) -> tuple[BinaryIO, StagedFile]:
+    file_descriptor = tempfile.NamedTemporaryFile(  # noqa: SIM115
+        mode="wb",
+        dir=path.parent,
+        prefix=f".{path.name}.",
+        suffix=".tmp",
+        buffering=BUFFER_SIZE,
+        delete=False,
+    )
+    return file_descriptor, StagedFile(Path(file_descriptor.name), path)
+
+
+def _copy_prefix(source: BinaryIO, target: BinaryIO, size: int) -> None:
+    source.seek(0)
+    while size:
+        data = source.read(min(BUFFER_SIZE, size))
+        if not data:
+            raise OSError(f"{source.name} was truncated while rendering")
+        target.write(data)
+        size -= len(data)
+
+
+def stage_file(
+    path: Path, chunks: Iterable[str], only_if_changed: bool = False
+) -> StagedFile | None:
+    """
+    Write rendered chunks to a temporary file next to the output file.
+    With only_if_changed, chunks are compared with the output file as they are
+    rendered and the temporary file is only created once they differ.
+    Args:
+        path: output file path.
+        chunks: rendered chunks.
+        only_if_changed: skip output files whose content is unchanged.
+
+    Returns:
+        staged file or none if output file is unchanged.
+    """
+    # Replace the target of a symlink rather than the symlink itself
+    if path.is_symlink():
+        path = path.resolve()
+
+    existing = None
+    if only_if_changed:
+        try:
+            existing = open(path, "rb")  # noqa: SIM115
+        except OSError:
+            pass
+    file_descriptor = None
+    staged = None
+    try:
+        matched = 0
+        for block in _batch(chunks):
+            data = block.encode("utf-8")
+            if file_descriptor is None:
+                if existing is not None and existing.read(len(data)) == data:
+                    matched += len(data)
+                    continue
+                file_descriptor, staged = _create_staged_file(path)
+                if matched:
+                    _copy_prefix(existing, file_descriptor, matched)
+            file_descriptor.write(data)
+
+        if file_descriptor is None:
+            # Unchanged unless the output file is longer
+            if existing is not None and not existing.read(1):
+                return None
+            file_descriptor, staged = _create_staged_file(path)
+            if matched:
+                _copy_prefix(existing, file_descriptor, matched)
+        file_descriptor.close()
+    except BaseException:
+        # Don't leave a partially rendered file behind
+        if staged is not None:
+            file_descriptor.close()
+            staged.discard()
+        raise
+    finally:
+        if existing is not None:
+            existing.close()
+
+    # Keep permissions of the replaced file
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        st = None
+    try:
+        if st is None:
+            os.chmod(staged.tmp_path, _default_mode())
+        else:
+            os.chmod(staged.tmp_path, stat.S_IMODE(st.st_mode))
+            if (st.st_uid, st.st_gid) != (os.getuid(), os.getgid()):
+                os.chown(staged.tmp_path, st.st_uid, st.st_gid)
+    except PermissionError:
+        pass
+    return staged
+
+
+def commit_files(staged_files: list[StagedFile]) -> None:
+    """
+    Make staged files durable then move them in place atomically.
+    Many files are flushed concurrently, only the output files are synced.
+    Args:
+        staged_files: staged files.
+    """
+    if not staged_files:
+        return
+
+    # Flush data before renaming, readers must never see an empty file after a crash
+    paths = [staged.tmp_path for staged in staged_files]
+    if len(paths) < FSYNC_CONCURRENCY_THRESHOLD:
+        for path in paths:
+            _fsync(path)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(
+            max_workers=min(FSYNC_MAX_WORKERS, len(paths))
+        ) as executor:
+            # Consumed to raise the first error
+            list(executor.map(_fsync, paths))
+
+    for staged in staged_files:
+        os.replace(staged.tmp_path, staged.path)
+
+    # Persist renames
+    for directory in {staged.path.parent for staged in staged_files}:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def write_file(
+    path: Path, chunks: Iterable[str], only_if_changed: bool = False
+) -> bool:
+    """
+    Write rendered chunks to a file atomically as they are produced.
+    Args:
+        path: output file path.
+        chunks: rendered chunks.
+        only_if_changed: skip output file if its content is unchanged.
+
+    Returns:
+        true if output file has been written.
+    """
+    # Devices and pipes can't be replaced
+    if path.exists() and not path.is_file():
+        with open(
+            path, "w", encoding="utf-8", buffering=BUFFER_SIZE
+        ) as file_descriptor:
+            file_descriptor.writelines(_batch(chunks))
+        return True
+
+    staged = stage_file(path, chunks, only_if_changed)
+    if staged is None:
+        return False
+    commit_files([staged])
+    return True
+
+
+def write_stream(stream: TextIO, chunks: Iterable[str]) -> None:
+    """
+    Write rendered chunks to a stream as they are produced.
+    A trailing newline is added like a regular echo.
+    Args:
+        stream: output stream.
+        chunks: rendered chunks.
+    """
+    stream.writelines(_batch(chunks))
+    stream.write("\n")
+    stream.flush()
@@ -0,0 +1,133 @@
+import compileall
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+from collections.abc import Callable
+from pathlib import Path
+
+from jinja2 import BaseLoader, Environment, ModuleLoader, TemplateNotFound
+
+# Checksums of the sources by template name, written next to the modules
+CHECKSUMS_FILE = "checksums.json"
+
+
+def _checksum(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def _read_checksums(path: Path) -> dict[str, str]:
+    try:
+        if path.suffix == ".zip":
+            with zipfile.ZipFile(path) as archive:
+                data = archive.read(CHECKSUMS_FILE)
+        else:
+            data = (path / CHECKSUMS_FILE).read_bytes()
+        checksums = json.loads(data)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return {}
+    return checksums if isinstance(checksums, dict) else {}
+
+
+class PrecompiledLoader(BaseLoader):
+    """Loader of precompiled templates falling back to template sources"""
+
+    def __init__(self, path: Path, loader: BaseLoader) -> None:
+        """
+        Init precompiled loader.
+        Args:
+            path: directory or zip file of modules written by compile_templates.
+            loader: loader of template sources.
+        """
+        self.__modules = ModuleLoader(path)
+        self.__checksums = _read_checksums(path)
+        self.__loader = loader
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def has_source_access(self) -> bool:
+        return self.__loader.has_source_access
+
+    def get_source(self, environment: Environment, template: str):
+        # Sources are still needed to compute dependencies
+        return self.__loader.get_source(environment, template)
+
+    def list_templates(self) -> list[str]:
+        return self.__loader.list_templates()
+
+    def load(self, environment: Environment, name: str, globals=None):
+        # Modules are used as is once their sources are gone
+        try:
+            source, _, _ = self.__loader.get_source(environment, name)
+        except TemplateNotFound:
+            fresh = True
+        else:
+            fresh = self.__checksums.get(name) == _checksum(source)
+        if fresh:
+            try:
+                template = self.__modules.load(environment, name, globals)
+            except TemplateNotFound:
+                pass
+            else:
+                self.hits += 1
+                return template
+        self.misses += 1
+        return self.__loader.load(environment, name, globals)
+
+
+def compile_templates(
+    environment: Environment,
+    target: Path,
+    filter_func: Callable[[str], bool] | None = None,
+) -> None:
+    """
+    Compile templates of an environment into python modules.
+    Args:
+        environment: environment configured like the one rendering the templates.
+        target: zip file if its name ends with .zip, directory otherwise.
+        filter_func: filter on template names.
+    """
+    # Stale modules are detected at load time by the checksum of their source
+    checksums = json.dumps(
+        {
+            name: _checksum(environment.loader.get_source(environment, name)[0])
+            for name in environment.list_templates(filter_func=filter_func)
+        },
+        sort_keys=True,
+    )
+    if target.suffix != ".zip":
+        environment.compile_templates(
+            target,
+            filter_func=filter_func,
+            zip=None,
+            ignore_errors=False,
+        )
+        (target / CHECKSUMS_FILE).write_text(checksums, encoding="utf-8")
+        # Python bytecode of a directory is loaded without compiling modules
+        compileall.compile_dir(target, quiet=1)
+        return
+
+    # Replace the archive once complete so that a failed build never ships
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        dir=target.parent, prefix=".", suffix=".tmp", delete=False
+    ) as file_descriptor:
+        tmp_path = Path(file_descriptor.name)
+    try:
+        environment.compile_templates(
+            tmp_path,
+            filter_func=filter_func,
+            zip="deflated",
+            ignore_errors=False,
+        )
+        with zipfile.ZipFile(tmp_path, "a") as archive:
+            archive.writestr(CHECKSUMS_FILE, checksums)
+        # Temporary files are only readable by their owner
+        umask = os.umask(0)
+        os.umask(umask)
+        tmp_path.chmod(0o666 & ~umask)
+        os.replace(tmp_path, target)
+    finally:
+        tmp_path.unlink(missing_ok=True)
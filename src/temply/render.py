@@ -0,0 +1,207 @@
+import time
+from collections import ChainMap
+from collections.abc import Iterator, Mapping
+from functools import cached_property
+
+import jinja2
+from jinja2 import BaseLoader, BytecodeCache, Environment, Template, nodes
+from jinja2.sandbox import SandboxedEnvironment
+
+from .deps import TemplateDependencies, compute_dependencies
+from .filters import (
+    PrefixIndex,
+    from_json,
+    from_yaml,
+    get_environment,
+    get_nested_environment,
+    to_json,
+    to_yaml,
+)
+from .limits import LOOP_FILTER, RenderLimitExceeded, RenderLimits
+
+
+class _Environment(Environment):
+    """Environment checking render limits in template loops"""
+
+    def _generate(self, source: nodes.Template, name, filename, defer_init=False):
+        # Loops of every template go through the filter, limits are set at render
+        for node in list(source.find_all(nodes.For)):
+            node.iter = nodes.Filter(
+                node.iter, LOOP_FILTER, [], [], None, None, lineno=node.iter.lineno
+            )
+        return super()._generate(source, name, filename, defer_init)
+
+
+class _SandboxedEnvironment(_Environment, SandboxedEnvironment):
+    """Sandboxed environment checking render limits in template loops"""
+
+
+class _RenderVariables(ChainMap):
+    """Variables of a single render"""
+
+    @cached_property
+    def prefix_index(self) -> PrefixIndex:
+        """Index of variable names built on first lookup by prefix."""
+        return PrefixIndex(self)
+
+
+class _TrackingLoader(BaseLoader):
+    """Loader counting loaded templates and the time spent loading them"""
+
+    def __init__(self, loader: BaseLoader) -> None:
+        """Init tracking loader."""
+        self.__loader = loader
+        self.loaded = 0
+        self.seconds = 0.0
+
+    @property
+    def has_source_access(self) -> bool:
+        return self.__loader.has_source_access
+
+    def get_source(self, environment: Environment, template: str):
+        return self.__loader.get_source(environment, template)
+
+    def list_templates(self) -> list[str]:
+        return self.__loader.list_templates()
+
+    def load(self, environment: Environment, name: str, globals=None):
+        # Includes parse and compile or bytecode cache lookup
+        start = time.perf_counter()
+        try:
+            return self.__loader.load(environment, name, globals)
+        finally:
+            self.loaded += 1
+            self.seconds += time.perf_counter() - start
+
+
+class Renderer:
+    """Template renderer implementation"""
+
+    def __init__(
+        self,
+        loader: BaseLoader,
+        allow_missing: bool = False,
+        bytecode_cache: BytecodeCache | None = None,
+        limits: RenderLimits | None = None,
+    ) -> None:
+        """Init renderer."""
+        # Define undefined behaviour
+        if allow_missing:
+            undefined_behaviour = jinja2.Undefined
+        else:
+            undefined_behaviour = jinja2.StrictUndefined
+
+        # Setup environment
+        self.__source_loader = loader
+        self.__loader = _TrackingLoader(loader)
+        self.__limits = limits or RenderLimits()
+        environment_class = (
+            _SandboxedEnvironment if self.__limits.sandbox else _Environment
+        )
+        self.__env = environment_class(
+            loader=self.__loader,
+            undefined=undefined_behaviour,
+            trim_blocks=True,
+            lstrip_blocks=True,
+            keep_trailing_newline=True,
+            bytecode_cache=bytecode_cache,
+        )
+
+        # Setup filters
+        self.__env.filters["from_json"] = from_json
+        self.__env.filters["fromjson"] = from_json
+        self.__env.filters["to_json"] = to_json
+        self.__env.filters["tojson"] = to_json
+        self.__env.filters["from_yaml"] = from_yaml
+        self.__env.filters["fromyaml"] = from_yaml
+        self.__env.filters["to_yaml"] = to_yaml
+        self.__env.filters["toyaml"] = to_yaml
+        self.__env.filters[LOOP_FILTER] = self.__limits.loop
+
+        # Setup globals
+        self.__env.globals["environment"] = get_environment
+        self.__env.globals["nested_environment"] = get_nested_environment
+
+    @property
+    def env(self) -> Environment:
+        """Jinja2 environment used to render templates."""
+        return self.__env
+
+    @property
+    def loader(self) -> BaseLoader:
+        """Loader of the templates."""
+        return self.__source_loader
+
+    @property
+    def templates_loaded(self) -> int:
+        """Number of templates loaded, included ones too."""
+        return self.__loader.loaded
+
+    @property
+    def load_seconds(self) -> float:
+        """Time spent loading and compiling templates."""
+        return self.__loader.seconds
+
+    def dependencies(self, template_name: str) -> TemplateDependencies:
+        """
+        Compute templates and variables a template depends on.
+        Args:
+            template_name: name of the template in the loader.
+
+        Returns:
+            template dependencies.
+        """
+        return compute_dependencies(self.__env, template_name)
+
+    def generate(self, template_name: str | Template, ctx: Mapping) -> Iterator[str]:
+        """
+        Render a template chunk by chunk.
+        Args:
+            template_name: name of the template in the loader or compiled template.
+            ctx: variables available in the template.
+
+        Returns:
+            generator of rendered chunks.
+        """
+        template = self.__env.get_template(template_name)
+
+        # Share variables with the template context instead of copying them
+        if isinstance(ctx, ChainMap):
+            layers = _RenderVariables(*ctx.maps, template.globals)
+        else:
+            layers = _RenderVariables(ctx, template.globals)
+        context = template.new_context(layers, shared=True)
+        limits = self.__limits
+        limits.start()
+        chunks = template.root_render_func(context)
+        try:
+            try:
+                if limits.checks_chunks:
+                    for chunk in chunks:
+                        error = limits.check_chunk(chunk)
+                        if error is not None:
+                            # Raised at the template line producing the chunk
+                            chunks.throw(error)
+                        yield chunk
+                else:
+                    yield from chunks
+            except Exception:  # noqa: BLE001
+                # Rewrite traceback to point to template lines like jinja2 does
+                yield self.__env.handle_exception()
+        except jinja2.UndefinedError as err:
+            raise Exception(err) from err
+        except RenderLimitExceeded as err:
+            err.locate()
+            raise
+
+    def render(self, template_name: str | Template, ctx: Mapping) -> str:
+        """
+        Render a template.
+        Args:
+            template_name: name of the template in the loader or compiled template.
+            ctx: variables available in the template.
+
+        Returns:
+            rendered template.
+        """
+        return "".join(self.generate(template_name, ctx))
@@ -0,0 +1,196 @@
+import json
+from abc import ABC, abstractmethod
+from functools import cache
+
+
+class Serializer(ABC):
+    """Abstract serializer"""
+
+    # Name reported in diagnostics
+    name = ""
+
+    @classmethod
+    def available(cls) -> bool:
+        """
+        Check if the serializer can be used.
+        Returns:
+            true if its implementation is installed.
+        """
+        return True
+
+    @abstractmethod
+    def loads(self, value):
+        """
+        Parse a value.
+        Args:
+            value: value to parse.
+
+        Returns:
+            parsed value.
+        """
+
+    @abstractmethod
+    def dumps(self, value) -> str:
+        """
+        Convert any value.
+        Args:
+            value: value to convert.
+
+        Returns:
+            converted value.
+        """
+
+
+class JsonSerializer(Serializer):
+    """Standard library json serializer implementation"""
+
+    name = "json"
+
+    def loads(self, value):
+        return json.loads(value)
+
+    def dumps(self, value) -> str:
+        return json.dumps(value)
+
+
+class OrjsonSerializer(JsonSerializer):
+    """Orjson serializer implementation, only used to parse"""
+
+    name = "orjson"
+
+    @classmethod
+    def available(cls) -> bool:
+        try:
+            import orjson  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self) -> None:
+        """Init orjson serializer."""
+        import orjson
+
+        self.__loads = orjson.loads
+
+    def loads(self, value):
+        try:
+            return self.__loads(value)
+        except (ValueError, TypeError):
+            # Orjson is stricter, let the standard library parse or report errors
+            return json.loads(value)
+
+
+@cache
+def _safe_dumper() -> type:
+    import yaml
+
+    class SafeDumper(yaml.SafeDumper):
+        """Safe dumper implementation"""
+
+    # Subclasses of dict and list, like cached parsed values, are dumped as is
+    SafeDumper.add_multi_representer(dict, yaml.SafeDumper.represent_dict)
+    SafeDumper.add_multi_representer(list, yaml.SafeDumper.represent_list)
+    SafeDumper.add_multi_representer(frozenset, yaml.SafeDumper.represent_set)
+    return SafeDumper
+
+
+class YamlSerializer(Serializer):
+    """Pure python yaml serializer implementation"""
+
+    name = "pyyaml"
+    loader_name = "SafeLoader"
+
+    def __init__(self) -> None:
+        """Init yaml serializer."""
+        # Yaml is only imported by templates using it
+        import yaml
+
+        self.__yaml = yaml
+        self.__loader = getattr(yaml, self.loader_name)
+        self.__dumper = _safe_dumper()
+
+    def loads(self, value):
+        return self.__yaml.load(value, Loader=self.__loader)
+
+    def dumps(self, value) -> str:
+        return self.__yaml.dump(value, Dumper=self.__dumper)
+
+
+class LibyamlSerializer(YamlSerializer):
+    """Libyaml serializer implementation, only used to parse"""
+
+    # Libyaml emitter wraps lines and quotes keys differently, dumping stays in python
+    name = "libyaml"
+    loader_name = "CSafeLoader"
+
+    @classmethod
+    def available(cls) -> bool:
+        import yaml
+
+        return yaml.__with_libyaml__
+
+
+# Serializers by format, the first available one is used
+_SERIALIZERS: dict[str, list[type[Serializer]]] = {
+    "json": [OrjsonSerializer, JsonSerializer],
+    "yaml": [LibyamlSerializer, YamlSerializer],
+}
+
+
+def register_serializer(format_name: str, serializer: type[Serializer]) -> None:
+    """
+    Register a serializer preferred over the ones already registered for a format.
+    Output must be identical to the one of the standard serializer of the format.
+    Args:
+        format_name: serialization format.
+        serializer: serializer class.
+    """
+    _SERIALIZERS.setdefault(format_name, []).insert(0, serializer)
+    get_serializer.cache_clear()
+
+
+def available_serializers(format_name: str) -> list[Serializer]:
+    """
+    Instantiate available serializers of a format.
+    Args:
+        format_name: serialization format.
+
+    Returns:
+        serializers by order of preference.
+    """
+    return [
+        serializer()
+        for serializer in _SERIALIZERS.get(format_name, [])
+        if serializer.available()
+    ]
+
+
+@cache
+def get_serializer(format_name: str) -> Serializer:
+    """
+    Get the fastest available serializer of a format.
+    Args:
+        format_name: serialization format.
+
+    Returns:
+        a serializer.
+
+    Raises:
+        KeyError: if no serializer is available for the format.
+    """
+    serializers = available_serializers(format_name)
+    if not serializers:
+        raise KeyError(format_name)
+    return serializers[0]
+
+
+def describe_serializers() -> str:
+    """
+    Describe serializers in use.
+    Returns:
+        serializer name by format.
+    """
+    return ", ".join(
+        f"{format_name}={get_serializer(format_name).name}"
+        for format_name in sorted(_SERIALIZERS)
+    )
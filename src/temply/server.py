@@ -0,0 +1,398 @@
+import json
+import os
+import socket
+import struct
+import sys
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import click
+
+# Clients only forward commands, the rendering stack is imported by the server
+if TYPE_CHECKING:
+    from jinja2 import BytecodeCache
+
+    from .limits import RenderLimits
+    from .loaders import LayeredContext, Loader
+    from .render import Renderer
+    from .stats import Stats
+    from .watchers import Watcher
+
+# Frames sent by the server: kind and payload size followed by the payload
+FRAME_HEADER = struct.Struct("!cI")
+FRAME_STDOUT = b"o"
+FRAME_STDERR = b"e"
+FRAME_EXIT = b"x"
+
+# Size of socket reads
+RECV_SIZE = 64 * 1024
+
+# Seconds a client may stay silent, clients are served one at a time
+CLIENT_TIMEOUT = 10.0
+
+
+class _FrameStream:
+    """Text stream sending writes as frames of a kind"""
+
+    def __init__(self, connection: socket.socket, kind: bytes) -> None:
+        """Init frame stream."""
+        self.__connection = connection
+        self.__kind = kind
+
+    def write(self, data: str) -> int:
+        payload = data.encode("utf-8")
+        if payload:
+            self.__connection.sendall(FRAME_HEADER.pack(self.__kind, len(payload)))
+            self.__connection.sendall(payload)
+        return len(data)
+
+    def writelines(self, lines: Iterator[str]) -> None:
+        for line in lines:
+            self.write(line)
+
+    def flush(self) -> None:
+        """Frames are sent as they are written."""
+
+
+class SourceCache:
+    """Data sources kept loaded until their files change"""
+
+    def __init__(self) -> None:
+        """Init source cache."""
+        self.__sources: dict[tuple, tuple[Mapping, Watcher]] = {}
+
+    def load(
+        self, key: tuple, loader: "Loader", path: Path, stats: "Stats | None" = None
+    ) -> Mapping:
+        """
+        Load a data source unless it is loaded and unchanged.
+        Args:
+            key: data source key, including its path and loader options.
+            loader: loader of the data source.
+            path: file or directory loaded.
+            stats: stats recording the time spent loading and variables.
+
+        Returns:
+            loaded variables.
+        """
+        from .watchers import create_watcher
+
+        entry = self.__sources.get(key)
+        if entry is not None:
+            layer, watcher = entry
+            if not self.__changed(watcher, path):
+                if stats is not None:
+                    stats.count(f"variables_{loader.name}", len(layer))
+                return layer
+            watcher.close()
+            del self.__sources[key]
+
+        # Watch before loading to catch changes made while loading, files are
+        # watched through their directory to catch atomic replacements
+        if path.is_dir():
+            watcher = create_watcher([(path, True)])
+        else:
+            watcher = create_watcher([(path.parent, False)])
+        try:
+            if stats is None:
+                layer = loader.load()
+            else:
+                with stats.phase(f"load_{loader.name}"):
+                    layer = loader.load()
+        except BaseException:
+            watcher.close()
+            raise
+        self.__sources[key] = (layer, watcher)
+        if stats is not None:
+            stats.count(f"variables_{loader.name}", len(layer))
+        return layer
+
+    @staticmethod
+    def __changed(watcher: "Watcher", path: Path) -> bool:
+        changed = watcher.wait(0)
+        if path.is_dir():
+            return bool(changed)
+        # Kubernetes mounts swap a ..data symlink
+        return any(
+            changed_path.name == path.name or changed_path.name.startswith("..")
+            for changed_path in changed
+        )
+
+    def close(self) -> None:
+        """Release watchers."""
+        for _, watcher in self.__sources.values():
+            watcher.close()
+        self.__sources.clear()
+
+
+@contextmanager
+def _client_process(cwd: str, env: dict[str, str]) -> Iterator[None]:
+    """Run in the working directory and environment of a client."""
+    previous_cwd = os.getcwd()
+    previous_env = dict(os.environ)
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(previous_env)
+        os.chdir(previous_cwd)
+
+
+class RenderServer:
+    """Render server keeping environments, templates and data sources warm"""
+
+    def __init__(
+        self, path: Path, bytecode_cache: "BytecodeCache | None" = None
+    ) -> None:
+        """
+        Init render server.
+        Args:
+            path: unix socket path.
+            bytecode_cache: bytecode cache shared by renderers.
+        """
+        self.__path = path
+        self.__bytecode_cache = bytecode_cache
+        self.__renderers: dict[tuple, Renderer] = {}
+        self.__sources = SourceCache()
+
+        # Replace the socket of a server that isn't running anymore
+        if path.is_socket():
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(path.as_posix())
+                except ConnectionRefusedError:
+                    path.unlink()
+                else:
+                    raise click.FileError(path.as_posix(), "A server is running")
+
+        # Only the owner can render through the server
+        self.__socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            self.__socket.bind(path.as_posix())
+        finally:
+            os.umask(umask)
+        self.__socket.listen()
+
+    def serve_forever(self) -> None:
+        """Handle clients one at a time, they share the process state."""
+        while True:
+            connection, _ = self.__socket.accept()
+            with connection:
+                try:
+                    connection.settimeout(CLIENT_TIMEOUT)
+                    self.__handle(connection)
+                except OSError:
+                    # Client is gone or too slow
+                    pass
+                except Exception as err:  # noqa: BLE001
+                    # A client never stops the server
+                    click.echo(f"Error: Failed to handle a client: {err}", err=True)
+
+    def close(self) -> None:
+        """Stop listening and release resources."""
+        self.__socket.close()
+        self.__path.unlink(missing_ok=True)
+        self.__sources.close()
+
+    def __handle(self, connection: socket.socket) -> None:
+        data = bytearray()
+        while chunk := connection.recv(RECV_SIZE):
+            data += chunk
+        # Liveness probes connect without sending anything
+        if not data:
+            return
+
+        stdout = _FrameStream(connection, FRAME_STDOUT)
+        stderr = _FrameStream(connection, FRAME_STDERR)
+        exit_code = 0
+        try:
+            request = json.loads(data)
+        except ValueError as err:
+            stderr.write(f"Error: Invalid request: {err}\n")
+            connection.sendall(FRAME_HEADER.pack(FRAME_EXIT, 2))
+            return
+        try:
+            with _client_process(request["cwd"], request["env"]):
+                self.__render(
+                    request["args"], request["env"], request["stdin"], stdout, stderr
+                )
+        except click.exceptions.Exit as err:
+            exit_code = err.exit_code
+        except click.ClickException as err:
+            stderr.write(f"Error: {err.format_message()}\n")
+            exit_code = err.exit_code
+        except Exception as err:  # noqa: BLE001
+            stderr.write(f"Error: {err}\n")
+            exit_code = 1
+        connection.sendall(FRAME_HEADER.pack(FRAME_EXIT, exit_code & 0xFF))
+
+    def __renderer(
+        self, directory: Path, allow_missing: bool, limits: "RenderLimits"
+    ) -> "Renderer":
+        from jinja2 import FileSystemLoader
+
+        from .render import Renderer
+
+        key = (directory, allow_missing, limits.key)
+        if key not in self.__renderers:
+            self.__renderers[key] = Renderer(
+                FileSystemLoader(directory),
+                allow_missing,
+                self.__bytecode_cache,
+                limits,
+            )
+        return self.__renderers[key]
+
+    def __context(
+        self, env: dict[str, str], params: dict, stats: "Stats"
+    ) -> "LayeredContext":
+        from .loaders import DotenvLoader, EnvdirLoader, JsonFileLoader, LayeredContext
+
+        layers = [env]
+        if params["context_snapshot"]:
+            from .snapshots import SnapshotLoader
+
+            # Snapshots are mapped and checked for changes on every load
+            with stats.phase("load_snapshot"):
+                layers.append(SnapshotLoader(params["context_snapshot"]).load())
+        if params["envdir"]:
+            envdir = params["envdir"].absolute()
+            key = ("envdir", envdir, params["envdir_max_size"])
+            loader = EnvdirLoader(envdir, params["envdir_max_size"])
+            layers.append(self.__sources.load(key, loader, envdir, stats))
+        if params["dotenv"]:
+            dotenv = params["dotenv"].absolute()
+            loader = DotenvLoader(dotenv)
+            layers.append(
+                self.__sources.load(("dotenv", dotenv), loader, dotenv, stats)
+            )
+        if params["json_file"]:
+            json_file = params["json_file"].absolute()
+            loader = JsonFileLoader(json_file)
+            layers.append(
+                self.__sources.load(("json_file", json_file), loader, json_file, stats)
+            )
+        ctx = LayeredContext(*reversed(layers))
+        stats.count("variables", len(ctx))
+        return ctx
+
+    def __render(
+        self,
+        args: list[str],
+        env: dict[str, str],
+        stdin: str | None,
+        stdout: _FrameStream,
+        stderr: _FrameStream,
+    ) -> None:
+        from jinja2 import DictLoader
+
+        from .cli import create_render_limits, record_stats, render, render_template
+        from .render import Renderer
+        from .stats import Stats
+
+        # Options are parsed like a local render, cache ones are ignored
+        # and sources are kept loaded in full whatever --only-referenced
+        with render.make_context("render", list(args)) as ctx:
+            params = ctx.params
+        input_file = params["input_file"]
+        if params["deps_file"] and not params["output_file"]:
+            raise click.UsageError("--deps requires --output-file")
+        if params["context_snapshot"] and (
+            params["envdir"] or params["dotenv"] or params["json_file"]
+        ):
+            raise click.UsageError(
+                "--context-snapshot can't be used with --envdir, --dotenv or --json-file"
+            )
+
+        limits = create_render_limits(
+            params["timeout"],
+            params["max_output_bytes"],
+            params["max_loop_iterations"],
+            params["sandbox"],
+        )
+        if input_file:
+            template_name = input_file.name
+            renderer = self.__renderer(
+                input_file.parent.absolute(), params["allow_missing"], limits
+            )
+        else:
+            template_name = "stdin_template"
+            renderer = Renderer(
+                DictLoader({template_name: stdin or ""}),
+                params["allow_missing"],
+                self.__bytecode_cache,
+                limits,
+            )
+
+        # Renderers and caches outlive requests, their counters are reported as deltas
+        baseline = Stats("render")
+        record_stats(baseline, renderer, self.__bytecode_cache)
+        stats = Stats("render")
+        render_template(
+            renderer,
+            template_name,
+            self.__context(env, params, stats),
+            stats,
+            stdout,
+            params["output_file"],
+            params["only_if_changed"],
+            params["deps_file"],
+            params["stats_file"],
+            self.__bytecode_cache,
+            stats_stream=stderr,
+            baseline=baseline,
+        )
+        if input_file and not params["keep_template"]:
+            input_file.unlink()
+
+
+def forward(path: Path, args: list[str], stdin: str | None) -> int | None:
+    """
+    Forward a render command to a server and stream its output.
+    Args:
+        path: unix socket path of the server.
+        args: arguments of the render command.
+        stdin: standard input read beforehand, the server never waits on it.
+
+    Returns:
+        exit code of the command or none if no server is running.
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with connection:
+        try:
+            connection.connect(path.as_posix())
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+
+        request = {
+            "args": args,
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+            "stdin": stdin,
+        }
+        connection.sendall(json.dumps(request).encode("utf-8"))
+        connection.shutdown(socket.SHUT_WR)
+
+        # Stream output back as it is rendered
+        outputs = {FRAME_STDOUT: sys.stdout.buffer, FRAME_STDERR: sys.stderr.buffer}
+        reader = connection.makefile("rb")
+        while header := reader.read(FRAME_HEADER.size):
+            if len(header) < FRAME_HEADER.size:
+                break
+            kind, size = FRAME_HEADER.unpack(header)
+            if kind == FRAME_EXIT:
+                for output in outputs.values():
+                    output.flush()
+                return size
+            outputs[kind].write(reader.read(size))
+            if kind == FRAME_STDERR:
+                outputs[kind].flush()
+
+    click.echo("Error: Server closed the connection", err=True)
+    return 1
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from collections.abc import Iterator, Mapping
+from pathlib import Path
+
+import click
+
+from .loaders import (
+    ChainLoader,
+    DotenvLoader,
+    EnvdirLoader,
+    JsonFileLoader,
+    Loader,
+)
+
+# Magic, number of variables, offset of the index and size of the sources
+SNAPSHOT_MAGIC = b"TPLSNAP1"
+_HEADER = struct.Struct("<8sIQI")
+# Offset and size of a key, offset and size of its value, sorted by key
+_ENTRY = struct.Struct("<QIQI")
+# Values are strings or json documents
+_STRING_VALUE = b"s"
+_JSON_VALUE = b"j"
+
+
+class SnapshotSource:
+    """Data source materialized in a snapshot"""
+
+    def __init__(self, kind: str, path: Path, max_size: int | None = None) -> None:
+        """
+        Init snapshot source.
+        Args:
+            kind: loader name, envdir, dotenv or json_file.
+            path: absolute path of the data source.
+            max_size: maximum size in bytes of an envdir value.
+        """
+        self.kind = kind
+        self.path = path
+        self.max_size = max_size
+
+    def loader(self) -> Loader:
+        """
+        Create the loader of the data source.
+        Returns:
+            data source loader.
+        """
+        if self.kind == "envdir":
+            return EnvdirLoader(self.path, self.max_size)
+        if self.kind == "dotenv":
+            return DotenvLoader(self.path)
+        return JsonFileLoader(self.path)
+
+    def fingerprint(self) -> str:
+        """
+        Fingerprint files of the data source by inode, modification time and size.
+        Returns:
+            fingerprint, empty if the data source is missing.
+        """
+        digest = hashlib.sha256()
+        try:
+            if self.kind != "envdir":
+                st = self.path.stat()
+                digest.update(f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}".encode())
+                return digest.hexdigest()
+            for root, directories, files in os.walk(self.path):
+                directories.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    st = os.stat(path)
+                    digest.update(
+                        f"{path}\0{st.st_ino}:{st.st_mtime_ns}:{st.st_size}\0".encode()
+                    )
+        except OSError:
+            return ""
+        return digest.hexdigest()
+
+    def to_dict(self) -> dict:
+        """
+        Convert source to a json serializable dict.
+        Returns:
+            source description.
+        """
+        return {
+            "kind": self.kind,
+            "path": self.path.as_posix(),
+            "max_size": self.max_size,
+        }
+
+
+class Snapshot(Mapping):
+    """Variables of a snapshot file, values are decoded on access"""
+
+    def __init__(self, path: Path) -> None:
+        """
+        Init snapshot.
+        Args:
+            path: snapshot file path.
+
+        Raises:
+            click.FileError: if the file isn't a snapshot.
+        """
+        try:
+            with open(path, "rb") as file_descriptor:
+                self.__data = mmap.mmap(
+                    file_descriptor.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        except (OSError, ValueError) as err:
+            raise click.FileError(path.as_posix(), str(err)) from err
+        if len(self.__data) < _HEADER.size:
+            raise click.FileError(path.as_posix(), "Not a context snapshot")
+        magic, self.__count, self.__index, sources_size = _HEADER.unpack_from(
+            self.__data
+        )
+        if magic != SNAPSHOT_MAGIC:
+            raise click.FileError(path.as_posix(), "Not a context snapshot")
+        sources = json.loads(self.__data[_HEADER.size : _HEADER.size + sources_size])
+        # Sources with their fingerprints when the snapshot was written
+        self.sources = [
+            (
+                SnapshotSource(
+                    source["kind"], Path(source["path"]), source["max_size"]
+                ),
+                source["fingerprint"],
+            )
+            for source in sources
+        ]
+        self.__values: dict[str, object] = {}
+
+    def is_fresh(self) -> bool:
+        """
+        Check data sources are unchanged since the snapshot was written.
+        Returns:
+            true if the snapshot is up to date.
+        """
+        return all(
+            source.fingerprint() == fingerprint for source, fingerprint in self.sources
+        )
+
+    def __entry(self, idx: int) -> tuple[int, int, int, int]:
+        return _ENTRY.unpack_from(self.__data, self.__index + idx * _ENTRY.size)
+
+    def __getitem__(self, key: str):
+        if key in self.__values:
+            return self.__values[key]
+
+        # Binary search on encoded keys, utf-8 preserves code point order
+        target = key.encode("utf-8", "surrogateescape")
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset, key_size, value_offset, value_size = self.__entry(middle)
+            current = self.__data[key_offset : key_offset + key_size]
+            if current < target:
+                low = middle + 1
+            elif current > target:
+                high = middle
+            else:
+                value = self.__decode(value_offset, value_size)
+                self.__values[key] = value
+                return value
+        raise KeyError(key)
+
+    def __decode(self, offset: int, size: int):
+        kind = self.__data[offset : offset + 1]
+        data = self.__data[offset + 1 : offset + size]
+        if kind == _STRING_VALUE:
+            return data.decode("utf-8")
+        return json.loads(data)
+
+    def __iter__(self) -> Iterator[str]:
+        for idx in range(self.__count):
+            key_offset, key_size, _, _ = self.__entry(idx)
+            yield self.__data[key_offset : key_offset + key_size].decode("utf-8")
+
+    def __len__(self) -> int:
+        return self.__count
+
+
+def write_snapshot(path: Path, sources: list[SnapshotSource]) -> None:
+    """
+    Load data sources and write their merged variables to a snapshot file.
+    Args:
+        path: snapshot file path, replaced atomically.
+        sources: data sources in precedence order, the last one wins.
+    """
+    # Fingerprint before loading so that a change while loading invalidates it
+    descriptions = [
+        {**source.to_dict(), "fingerprint": source.fingerprint()} for source in sources
+    ]
+    ctx = ChainLoader([source.loader() for source in sources]).load()
+    header_sources = json.dumps(descriptions).encode("utf-8")
+
+    # Keys and values, then the index of their offsets sorted by key
+    entries = []
+    blocks = []
+    offset = _HEADER.size + len(header_sources)
+    for key in sorted(ctx):
+        value = ctx[key]
+        encoded_key = key.encode("utf-8")
+        if isinstance(value, str):
+            encoded_value = _STRING_VALUE + value.encode("utf-8")
+        else:
+            encoded_value = _JSON_VALUE + json.dumps(value).encode("utf-8")
+        entries.append(
+            (offset, len(encoded_key), offset + len(encoded_key), len(encoded_value))
+        )
+        blocks.extend((encoded_key, encoded_value))
+        offset += len(encoded_key) + len(encoded_value)
+
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=".", suffix=".tmp", delete=False
+    ) as file_descriptor:
+        tmp_path = Path(file_descriptor.name)
+        try:
+            file_descriptor.write(
+                _HEADER.pack(SNAPSHOT_MAGIC, len(entries), offset, len(header_sources))
+            )
+            file_descriptor.write(header_sources)
+            file_descriptor.writelines(blocks)
+            file_descriptor.writelines(_ENTRY.pack(*entry) for entry in entries)
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            raise
+    try:
+        # Temporary files are only readable by their owner
+        umask = os.umask(0)
+        os.umask(umask)
+        tmp_path.chmod(0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+class SnapshotLoader(Loader):
+    """Snapshot loader implementation, rewriting the snapshot once stale"""
+
+    name = "snapshot"
+
+    def __init__(self, path: Path) -> None:
+        """Init snapshot loader."""
+        self.__path = path
+        # Data sources changed since the snapshot was written
+        self.stale = False
+
+    def load(self) -> Mapping:
+        snapshot = Snapshot(self.__path)
+        if snapshot.is_fresh():
+            return snapshot
+
+        self.stale = True
+        sources = [source for source, _ in snapshot.sources]
+        try:
+            write_snapshot(self.__path, sources)
+        except OSError:
+            # Read-only or shared snapshot, sources are still readable
+            return ChainLoader([source.loader() for source in sources]).load()
+        return Snapshot(self.__path)
@@ -0,0 +1,73 @@
+import builtins
+import sys
+import time
+from importlib.util import resolve_name
+from typing import TextIO
+
+# Reference point of startup timings, imported by the command line module
+STARTED_AT = time.perf_counter()
+
+# Number of imports shown in a startup trace
+STARTUP_TRACE_LIMIT = 25
+
+
+class ImportTracer:
+    """Import timings recorder"""
+
+    def __init__(self) -> None:
+        """Init import tracer."""
+        self.__import = builtins.__import__
+        self.__children: list[float] = []
+        self.__traced_at = 0.0
+        # Module name, cumulative and self durations in seconds
+        self.timings: list[tuple[str, float, float]] = []
+
+    def install(self) -> None:
+        """Record imports from now on."""
+        self.__traced_at = time.perf_counter()
+        builtins.__import__ = self.__traced_import
+
+    def uninstall(self) -> None:
+        """Stop recording imports."""
+        builtins.__import__ = self.__import
+
+    def __traced_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module_name = name
+        if level:
+            try:
+                module_name = resolve_name(
+                    "." * level + name, (globals or {}).get("__package__")
+                )
+            except (ImportError, ValueError):
+                pass
+        if module_name in sys.modules:
+            return self.__import(name, globals, locals, fromlist, level)
+
+        self.__children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.__import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.__children.pop()
+            if self.__children:
+                self.__children[-1] += elapsed
+            self.timings.append((module_name, elapsed, elapsed - children))
+
+    def report(self, stream: TextIO) -> None:
+        """
+        Write startup timings.
+        Args:
+            stream: output stream.
+        """
+        now = time.perf_counter()
+        stream.write("Startup trace (ms):\n")
+        stream.write(f"{(self.__traced_at - STARTED_AT) * 1000:8.2f}  command line\n")
+        stream.write(f"{(now - STARTED_AT) * 1000:8.2f}  total\n")
+        stream.write("Imports (cumulative ms, self ms):\n")
+        timings = sorted(self.timings, key=lambda timing: timing[1], reverse=True)
+        stream.writelines(
+            f"{cumulative * 1000:8.2f}  {own * 1000:8.2f}  {name}\n"
+            for name, cumulative, own in timings[:STARTUP_TRACE_LIMIT]
+        )
+        stream.flush()
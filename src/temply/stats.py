@@ -0,0 +1,110 @@
+import json
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TextIO
+
+import click
+
+
+class Stats:
+    """Durations of the phases of a run and counters"""
+
+    def __init__(self, command: str) -> None:
+        """Init stats."""
+        self.__command = command
+        self.__started_at = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        """
+        Add time spent in a phase.
+        Args:
+            phase: phase name.
+            seconds: duration in seconds.
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def count(self, counter: str, value: int = 1) -> None:
+        """
+        Increment a counter.
+        Args:
+            counter: counter name.
+            value: increment.
+        """
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def subtract(self, baseline: "Stats") -> None:
+        """
+        Turn cumulative durations and counters into deltas since a baseline.
+        Args:
+            baseline: stats recorded before the run.
+        """
+        for phase, seconds in baseline.phases.items():
+            self.add_time(phase, -seconds)
+        for counter, value in baseline.counters.items():
+            self.count(counter, -value)
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """
+        Time a phase.
+        Args:
+            phase: phase name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def measure_chunks(self, chunks: Iterable[str]) -> Iterator[str]:
+        """
+        Time the production of rendered chunks and count their bytes.
+        Args:
+            chunks: rendered chunks.
+
+        Returns:
+            generator of rendered chunks.
+        """
+        iterator = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.add_time("render", time.perf_counter() - start)
+            self.count("bytes_written", len(chunk.encode("utf-8")))
+            yield chunk
+
+    def to_dict(self) -> dict:
+        """
+        Convert stats to a json serializable dict.
+        Returns:
+            stats with durations in seconds.
+        """
+        phases = dict(self.phases)
+        phases["total"] = time.perf_counter() - self.__started_at
+        return {
+            "command": self.__command,
+            "phases": {name: round(seconds, 6) for name, seconds in phases.items()},
+            "counters": self.counters,
+        }
+
+    def write(self, path: Path, stream: TextIO | None = None) -> None:
+        """
+        Write stats as a json line, appended to the file.
+        Args:
+            path: output file path, stream if "-".
+            stream: stream written to, stderr if none.
+        """
+        line = json.dumps(self.to_dict(), sort_keys=True)
+        if path.as_posix() == "-":
+            click.echo(line, file=stream, err=True)
+            return
+        with open(path, "a", encoding="utf-8") as file_descriptor:
+            file_descriptor.write(f"{line}\n")
@@ -0,0 +1,206 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+# Inotify events, see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_EVENT_HEADER = struct.Struct("iIII")
+IN_WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_ATTRIB
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+
+class Watcher(ABC):
+    """Abstract file system watcher"""
+
+    def __init__(self, directories: list[tuple[Path, bool]]) -> None:
+        """
+        Init watcher.
+        Args:
+            directories: directories to watch with a flag to watch them recursively.
+        """
+        self.directories = directories
+
+    @abstractmethod
+    def wait(self, timeout: float | None = None) -> set[Path]:
+        """
+        Wait for changes.
+        Args:
+            timeout: maximum time to wait in seconds, forever if none.
+
+        Returns:
+            changed paths, empty on timeout.
+        """
+        return set()
+
+    def close(self) -> None:
+        """Release watcher resources."""
+
+
+class InotifyWatcher(Watcher):
+    """Linux inotify watcher implementation"""
+
+    def __init__(self, directories: list[tuple[Path, bool]]) -> None:
+        """Init inotify watcher."""
+        super().__init__(directories)
+        self.__libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.__fd = self.__libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.__fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.__watches: dict[int, tuple[Path, bool]] = {}
+        for directory, recursive in directories:
+            self.__add_watch(directory, recursive)
+
+    def __add_watch(self, directory: Path, recursive: bool) -> None:
+        wd = self.__libc.inotify_add_watch(
+            self.__fd, os.fsencode(directory), IN_WATCH_MASK
+        )
+        if wd < 0:
+            return
+        self.__watches[wd] = (directory, recursive)
+        if recursive:
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            self.__add_watch(Path(entry.path), recursive)
+            except OSError:
+                pass
+
+    def wait(self, timeout: float | None = None) -> set[Path]:
+        readable, _, _ = select.select([self.__fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.__fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = IN_EVENT_HEADER.unpack_from(data, offset)
+                offset += IN_EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    # Events are lost, report every watched directory
+                    changed.update(directory for directory, _ in self.directories)
+                    continue
+                if mask & IN_IGNORED:
+                    self.__watches.pop(wd, None)
+                    continue
+                if wd not in self.__watches:
+                    continue
+
+                directory, recursive = self.__watches[wd]
+                path = directory / name if name else directory
+                changed.add(path)
+                if recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.__add_watch(path, recursive)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.__fd)
+
+
+class PollingWatcher(Watcher):
+    """Polling watcher implementation for platforms without inotify"""
+
+    def __init__(
+        self, directories: list[tuple[Path, bool]], interval: float = 1.0
+    ) -> None:
+        """Init polling watcher."""
+        super().__init__(directories)
+        self.__interval = interval
+        self.__snapshot = self.__scan()
+
+    def __scan(self) -> dict[Path, tuple[int, int, int]]:
+        snapshot = {}
+        for directory, recursive in self.directories:
+            stack = [directory]
+            while stack:
+                try:
+                    with os.scandir(stack.pop()) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                if recursive:
+                                    stack.append(Path(entry.path))
+                                continue
+                            try:
+                                st = entry.stat()
+                            except OSError:
+                                continue
+                            snapshot[Path(entry.path)] = (
+                                st.st_ino,
+                                st.st_mtime_ns,
+                                st.st_size,
+                            )
+                except OSError:
+                    continue
+        return snapshot
+
+    def wait(self, timeout: float | None = None) -> set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.__scan()
+            changed = {
+                path
+                for path in snapshot.keys() | self.__snapshot.keys()
+                if snapshot.get(path) != self.__snapshot.get(path)
+            }
+            self.__snapshot = snapshot
+            if changed:
+                return changed
+
+            if deadline is None:
+                time.sleep(self.__interval)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return set()
+                time.sleep(min(self.__interval, remaining))
+
+
+def create_watcher(directories: list[tuple[Path, bool]]) -> Watcher:
+    """
+    Create the most efficient watcher available on the platform.
+    Args:
+        directories: directories to watch with a flag to watch them recursively.
+
+    Returns:
+        a watcher.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directories)
+        except (OSError, AttributeError, TypeError):
+            pass
+    return PollingWatcher(directories)
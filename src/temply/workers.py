@@ -0,0 +1,360 @@
+import multiprocessing
+import os
+from abc import ABC, abstractmethod
+from collections import ChainMap
+from collections.abc import Hashable, Iterable, Mapping
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import jinja2
+from jinja2 import Environment
+
+from .deps import TemplateDependencies, compute_dependencies
+from .loaders import LayeredContext
+from .outputs import StagedFile, commit_files, stage_file
+from .render import Renderer
+
+# Batch job and analyzed environment inherited by forked workers
+_JOB: "BatchJob | None" = None
+_ENV: Environment | None = None
+
+
+def cpu_count() -> int:
+    """
+    Compute the number of cpus usable by the process.
+    Cgroup cpu quota is honored when the process is running in a container.
+
+    Returns:
+        number of usable cpus.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        count = len(os.sched_getaffinity(0))
+    else:
+        count = os.cpu_count() or 1
+
+    # Cgroup v2 then v1
+    quota, period = None, None
+    try:
+        quota, period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+    except (OSError, ValueError):
+        try:
+            quota = Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text().strip()
+            period = Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text().strip()
+        except OSError:
+            pass
+
+    if quota and period and quota not in ("max", "-1"):
+        try:
+            count = min(count, max(1, -(-int(quota) // int(period))))
+        except (ValueError, ZeroDivisionError):
+            pass
+    return max(1, count)
+
+
+class BatchJob(ABC):
+    """Abstract batch of renders sharing a renderer"""
+
+    written: list[Path]
+
+    @abstractmethod
+    def compile(self, item: Hashable) -> None:
+        """
+        Compile what an item needs ahead of rendering.
+        Args:
+            item: item of the batch.
+        """
+
+    @abstractmethod
+    def render(self, item: Hashable) -> StagedFile | None:
+        """
+        Render an item next to its output file.
+        Args:
+            item: item of the batch.
+
+        Returns:
+            staged output file or none if output file is unchanged.
+        """
+
+    def run(self, items: list, jobs: int) -> dict:
+        """
+        Render items, a failure doesn't prevent other items from rendering.
+        Outputs are moved in place once all items are rendered.
+        Args:
+            items: items of the batch.
+            jobs: number of worker processes.
+
+        Returns:
+            error message by failed item.
+        """
+        failures = {}
+        staged_files = []
+
+        # Compile once in the parent process, workers inherit compiled templates
+        pending = []
+        for item in items:
+            try:
+                self.compile(item)
+                pending.append(item)
+            except Exception as err:  # noqa: BLE001
+                failures[item] = str(err)
+
+        jobs = min(jobs, len(pending))
+        if jobs <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+            results = (_render(self, item) for item in pending)
+            self.__collect(pending, results, failures, staged_files)
+        else:
+            global _JOB
+            _JOB = self
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+                ) as executor:
+                    results = executor.map(
+                        _render_in_worker,
+                        pending,
+                        chunksize=max(1, len(pending) // (jobs * 4)),
+                    )
+                    self.__collect(pending, results, failures, staged_files)
+            finally:
+                _JOB = None
+
+        commit_files(staged_files)
+        self.written = [staged.path for staged in staged_files]
+        return failures
+
+    @staticmethod
+    def __collect(
+        items: list,
+        results: Iterable[tuple[StagedFile | None, str | None]],
+        failures: dict,
+        staged_files: list[StagedFile],
+    ) -> None:
+        for item, (staged, error) in zip(items, results, strict=True):
+            if error is not None:
+                failures[item] = error
+            elif staged is not None:
+                staged_files.append(staged)
+
+
+class RenderJob(BatchJob):
+    """Batch render job implementation"""
+
+    def __init__(
+        self,
+        renderer: Renderer,
+        ctx: Mapping,
+        src: Path,
+        dst: Path,
+        suffix: str,
+        only_if_changed: bool = False,
+    ) -> None:
+        """Init render job."""
+        self.__renderer = renderer
+        self.__ctx = ctx
+        self.__src = src
+        self.__dst = dst
+        self.__suffix = suffix
+        self.__only_if_changed = only_if_changed
+        self.written: list[Path] = []
+
+    def templates(self) -> list[Path]:
+        """
+        Collect templates of the source directory.
+        Returns:
+            template paths relative to source directory.
+        """
+        return sorted(
+            path.relative_to(self.__src)
+            for path in self.__src.rglob(f"*{self.__suffix}")
+            if path.is_file()
+        )
+
+    def output_file(self, template: Path) -> Path:
+        """
+        Compute output file of a template.
+        Args:
+            template: template path relative to source directory.
+
+        Returns:
+            output file path.
+        """
+        return self.__dst / template.parent / template.name.removesuffix(self.__suffix)
+
+    def compile(self, template: Path) -> None:
+        """
+        Compile a template ahead of rendering.
+        Args:
+            template: template path relative to source directory.
+        """
+        self.__renderer.env.get_template(template.as_posix())
+
+    def render(self, template: Path) -> StagedFile | None:
+        """
+        Render a template next to its output file.
+        Args:
+            template: template path relative to source directory.
+
+        Returns:
+            staged output file or none if output file is unchanged.
+        """
+        output_file = self.output_file(template)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        return stage_file(
+            output_file,
+            self.__renderer.generate(template.as_posix(), self.__ctx),
+            self.__only_if_changed,
+        )
+
+
+class FanOutJob(BatchJob):
+    """Job rendering a template once per context"""
+
+    def __init__(
+        self,
+        renderer: Renderer,
+        template_name: str,
+        ctx: Mapping,
+        instances: list[tuple[str, Mapping]],
+        output_pattern: str,
+        only_if_changed: bool = False,
+    ) -> None:
+        """
+        Init fan out job.
+        Args:
+            renderer: template renderer.
+            template_name: name of the template in the loader.
+            ctx: variables shared by all instances.
+            instances: name and variables of each instance, overriding shared ones.
+            output_pattern: template of the output file path of an instance.
+            only_if_changed: skip output files whose content is unchanged.
+        """
+        self.__renderer = renderer
+        self.__template_name = template_name
+        self.__shared = list(ctx.maps) if isinstance(ctx, ChainMap) else [ctx]
+        self.__instances = instances
+        self.__only_if_changed = only_if_changed
+        self.__output_template = renderer.env.from_string(output_pattern)
+        self.__output_files: dict[int, Path] = {}
+        self.__instances_by_output: dict[Path, int] = {}
+        self.written: list[Path] = []
+
+    def instances(self) -> list[int]:
+        """
+        List instances to render.
+        Returns:
+            instance indexes.
+        """
+        return list(range(len(self.__instances)))
+
+    def instance_name(self, idx: int) -> str:
+        """
+        Get the name of an instance.
+        Args:
+            idx: instance index.
+
+        Returns:
+            instance name.
+        """
+        return self.__instances[idx][0]
+
+    def context(self, idx: int) -> LayeredContext:
+        """
+        Compute variables of an instance.
+        Args:
+            idx: instance index.
+
+        Returns:
+            instance variables over shared ones, then the instance description.
+        """
+        name, variables = self.__instances[idx]
+        return LayeredContext(
+            variables, *self.__shared, {"fan_out": {"index": idx, "name": name}}
+        )
+
+    def output_file(self, idx: int) -> Path:
+        """
+        Get the output file of a compiled instance.
+        Args:
+            idx: instance index.
+
+        Returns:
+            output file path.
+        """
+        return self.__output_files[idx]
+
+    def compile(self, item: int) -> None:
+        self.__renderer.env.get_template(self.__template_name)
+        path = Path(self.__renderer.render(self.__output_template, self.context(item)))
+        if path in self.__instances_by_output:
+            other = self.instance_name(self.__instances_by_output[path])
+            raise ValueError(
+                f"Output file {path.as_posix()} is already rendered by instance {other}"
+            )
+        self.__instances_by_output[path] = item
+        self.__output_files[item] = path
+
+    def render(self, item: int) -> StagedFile | None:
+        output_file = self.output_file(item)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        return stage_file(
+            output_file,
+            self.__renderer.generate(self.__template_name, self.context(item)),
+            self.__only_if_changed,
+        )
+
+
+def _render(job: BatchJob, item: Hashable) -> tuple[StagedFile | None, str | None]:
+    try:
+        return job.render(item), None
+    except Exception as err:  # noqa: BLE001
+        return None, str(err)
+
+
+def _render_in_worker(item: Hashable) -> tuple[StagedFile | None, str | None]:
+    return _render(_JOB, item)
+
+
+def _analyze(env: Environment, name: str) -> TemplateDependencies | str:
+    try:
+        return compute_dependencies(env, name)
+    except jinja2.TemplateSyntaxError as err:
+        return f"{err.name}:{err.lineno}: {err.message}"
+    except UnicodeDecodeError as err:
+        return f"{name}: not utf-8, {err}"
+
+
+def _analyze_in_worker(name: str) -> TemplateDependencies | str:
+    return _analyze(_ENV, name)
+
+
+def analyze_templates(
+    env: Environment, names: list[str], jobs: int
+) -> dict[str, TemplateDependencies | str]:
+    """
+    Compute dependencies of templates by parsing them, without rendering.
+    Args:
+        env: jinja2 environment.
+        names: names of the templates in the loader.
+        jobs: number of worker processes.
+
+    Returns:
+        dependencies or syntax error message by template name.
+    """
+    jobs = min(jobs, len(names))
+    if jobs <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return {name: _analyze(env, name) for name in names}
+
+    global _ENV
+    _ENV = env
+    try:
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            results = executor.map(
+                _analyze_in_worker,
+                names,
+                chunksize=max(1, len(names) // (jobs * 4)),
+            )
+            return dict(zip(names, results, strict=True))
+    finally:
+        _ENV = None
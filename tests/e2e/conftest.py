@@ -1,3 +1,6 @@
+import time
+from collections.abc import Callable
+
 import pytest
 from click.testing import CliRunner
 
@@ -5,3 +8,12 @@ from click.testing import CliRunner
 @pytest.fixture
 def runner() -> CliRunner:
     return CliRunner()
+
+
+def wait_for(predicate: Callable[[], bool], timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
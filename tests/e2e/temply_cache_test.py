@@ -0,0 +1,218 @@
+import json
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from temply.cli import main
+from tests.conftest import PROJECT_TESTS_FIXTURES_DIR
+
+
+def test_bytecode_cache(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "include.tpl").as_posix()
+    cache_path = tmp_path / "cache"
+    for _ in range(2):
+        result = runner.invoke(
+            main,
+            args=["--keep-template", "--bytecode-cache", cache_path.as_posix(), path],
+            env={"simple": "1"},
+        )
+        assert result.exit_code == 0
+        assert result.output == "Hello world: 1\n"
+    assert len(list(cache_path.glob("*.cache"))) == 2
+
+
+def test_bytecode_cache_envvar(runner: CliRunner, tmp_path: Path) -> None:
+    cache_path = tmp_path / "cache"
+    result = runner.invoke(
+        main,
+        input="Hello {{ name }} !",
+        env={"name": "world", "TEMPLY_BYTECODE_CACHE": cache_path.as_posix()},
+    )
+    assert result.exit_code == 0
+    assert result.output == "Hello world !\n"
+    assert len(list(cache_path.glob("*.cache"))) == 1
+
+
+def test_bytecode_cache_eviction(runner: CliRunner, tmp_path: Path) -> None:
+    cache_path = tmp_path / "cache"
+    result = runner.invoke(
+        main,
+        args=[
+            "--bytecode-cache",
+            cache_path.as_posix(),
+            "--bytecode-cache-size",
+            "0",
+        ],
+        input="Hello {{ name }} !",
+        env={"name": "world"},
+    )
+    assert result.exit_code == 0
+    assert not list(cache_path.iterdir())
+
+
+def test_precompiled(runner: CliRunner, tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "main.tpl").write_text("{% include 'base.tpl' %} !")
+    (src / "base.tpl").write_text("Hello {{ name }}")
+    for target in ("templates.zip", "templates"):
+        result = runner.invoke(
+            main, args=["compile", src.as_posix(), (tmp_path / target).as_posix()]
+        )
+        assert result.exit_code == 0
+    assert list((tmp_path / "templates").glob("*.py"))
+
+    # Included templates are loaded from modules once their sources are gone
+    (src / "base.tpl").unlink()
+    for target in ("templates.zip", "templates"):
+        result = runner.invoke(
+            main,
+            args=[
+                "--keep-template",
+                "--precompiled",
+                (tmp_path / target).as_posix(),
+                (src / "main.tpl").as_posix(),
+            ],
+            env={"name": "world"},
+        )
+        assert result.exit_code == 0
+        assert result.output == "Hello world !\n"
+
+    # Modules of changed sources are stale
+    (src / "main.tpl").write_text("{% include 'base.tpl' %} ?")
+    stats_file = tmp_path / "stats.json"
+    for target in ("templates.zip", "templates"):
+        result = runner.invoke(
+            main,
+            args=[
+                "--keep-template",
+                "--precompiled",
+                (tmp_path / target).as_posix(),
+                "--stats",
+                stats_file.as_posix(),
+                (src / "main.tpl").as_posix(),
+            ],
+            env={"name": "world"},
+        )
+        assert result.exit_code == 0
+        assert result.output == "Hello world ?\n"
+        counters = json.loads(stats_file.read_text().splitlines()[-1])["counters"]
+        assert counters["precompiled_hits"] == 1
+        assert counters["precompiled_misses"] == 1
+
+    # Templates are compiled from sources without precompiled ones
+    result = runner.invoke(
+        main,
+        args=["--precompiled", (tmp_path / "missing").as_posix()],
+        input="Hello {{ name }}",
+        env={"name": "world"},
+    )
+    assert result.exit_code == 0
+    assert result.output == "Hello world\n"
+
+
+def test_compile_error(runner: CliRunner, tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "main.tpl").write_text("{% if %}")
+    target = tmp_path / "templates.zip"
+    result = runner.invoke(main, args=["compile", src.as_posix(), target.as_posix()])
+    assert result.exit_code == 1
+    assert "main.tpl:1" in result.stderr
+    assert not target.exists()
+    assert list(tmp_path.iterdir()) == [src]
+
+
+def test_render_cache(runner: CliRunner, tmp_path: Path) -> None:
+    (tmp_path / "include.tpl").write_text("{{ name }}")
+    template = tmp_path / "template.tpl"
+    template.write_text("Hello {% include 'include.tpl' %} !")
+    cache_path = tmp_path / "cache"
+    stats_file = tmp_path / "stats.json"
+
+    def render(name: str) -> dict:
+        result = runner.invoke(
+            main,
+            args=[
+                "--keep-template",
+                "--render-cache",
+                cache_path.as_posix(),
+                "--stats",
+                stats_file.as_posix(),
+                template.as_posix(),
+            ],
+            env={"name": name, "unused": name},
+        )
+        assert result.exit_code == 0
+        assert result.output == f"Hello {name} !\n"
+        return json.loads(stats_file.read_text().splitlines()[-1])["counters"]
+
+    assert render("world")["render_cache_misses"] == 1
+    assert render("world")["render_cache_hits"] == 1
+    assert render("you")["render_cache_misses"] == 1
+
+    # An included template change invalidates outputs
+    (tmp_path / "include.tpl").write_text("{{ name | upper }}")
+    result = runner.invoke(
+        main,
+        args=[
+            "--keep-template",
+            "--render-cache",
+            cache_path.as_posix(),
+            template.as_posix(),
+        ],
+        env={"name": "world"},
+    )
+    assert result.output == "Hello WORLD !\n"
+
+
+def test_render_cache_nondeterministic(runner: CliRunner, tmp_path: Path) -> None:
+    (tmp_path / "include.tpl").write_text("{{ lipsum(1, False, 5, 10) }}")
+    cache_path = tmp_path / "cache"
+    stats_file = tmp_path / "stats.json"
+    for source in ("{{ [1, 2] | random }}", "{% include 'include.tpl' %}"):
+        template = tmp_path / "template.tpl"
+        template.write_text(source)
+        for _ in range(2):
+            result = runner.invoke(
+                main,
+                args=[
+                    "--keep-template",
+                    "--render-cache",
+                    cache_path.as_posix(),
+                    "--stats",
+                    stats_file.as_posix(),
+                    template.as_posix(),
+                ],
+            )
+            assert result.exit_code == 0
+            counters = json.loads(stats_file.read_text().splitlines()[-1])["counters"]
+            assert counters["render_cache_misses"] == 1
+            assert counters.get("render_cache_hits", 0) == 0
+
+
+def test_render_cache_missing_include(runner: CliRunner, tmp_path: Path) -> None:
+    template = tmp_path / "template.tpl"
+    template.write_text("A{% include 'optional.tpl' ignore missing %}")
+    args = ["--keep-template", "--render-cache", (tmp_path / "cache").as_posix()]
+    for _ in range(2):
+        result = runner.invoke(main, args=[*args, template.as_posix()], env={})
+        assert result.output == "A\n"
+
+    # An optional inclusion created later invalidates outputs
+    (tmp_path / "optional.tpl").write_text("INCLUDED")
+    result = runner.invoke(main, args=[*args, template.as_posix()], env={})
+    assert result.output == "AINCLUDED\n"
+
+
+def test_render_cache_eviction(runner: CliRunner, tmp_path: Path) -> None:
+    cache_path = tmp_path / "cache"
+    result = runner.invoke(
+        main,
+        args=["--render-cache", cache_path.as_posix(), "--render-cache-size", "0"],
+        input="Hello {{ name }} !",
+        env={"name": "world"},
+    )
+    assert result.exit_code == 0
+    assert result.output == "Hello world !\n"
+    assert not list(cache_path.iterdir())
@@ -0,0 +1,313 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from temply.cli import main
+from tests.conftest import PROJECT_TESTS_FIXTURES_DIR
+
+
+def test_render_dir(runner: CliRunner, tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    (src / "nested").mkdir(parents=True)
+    for name in ["simple.tpl", "include.tpl", "dotenv"]:
+        shutil.copy(PROJECT_TESTS_FIXTURES_DIR / name, src / name)
+    (src / "nested" / "nested.conf.tpl").write_text("{% include 'simple.tpl' %}")
+    result = runner.invoke(
+        main,
+        args=["render-dir", src.as_posix(), dst.as_posix()],
+        env={"simple": "1"},
+    )
+    assert result.exit_code == 0
+    assert (dst / "simple").read_text() == "Hello world: 1"
+    assert (dst / "include").read_text() == "Hello world: 1"
+    assert (dst / "nested" / "nested.conf").read_text() == "Hello world: 1"
+    assert not list(src.rglob("*.tpl"))
+    assert (src / "dotenv").exists()
+
+
+def test_render_dir_keep_template(runner: CliRunner, tmp_path: Path) -> None:
+    (tmp_path / "hello.txt.tpl").write_text("Hello {{ name }} !")
+    result = runner.invoke(
+        main,
+        args=[
+            "render-dir",
+            "--keep-template",
+            tmp_path.as_posix(),
+            tmp_path.as_posix(),
+        ],
+        env={"name": "world"},
+    )
+    assert result.exit_code == 0
+    assert (tmp_path / "hello.txt").read_text() == "Hello world !"
+    assert (tmp_path / "hello.txt.tpl").exists()
+
+
+def test_render_dir_missing_env(runner: CliRunner, tmp_path: Path) -> None:
+    (tmp_path / "hello.txt.tpl").write_text("Hello {{ name }} !")
+    result = runner.invoke(
+        main, args=["render-dir", tmp_path.as_posix(), tmp_path.as_posix()], env={}
+    )
+    assert result.exit_code == 1
+    assert (tmp_path / "hello.txt.tpl").exists()
+
+
+def test_render_dir_jobs(runner: CliRunner, tmp_path: Path) -> None:
+    for idx in range(8):
+        (tmp_path / f"{idx}.txt.tpl").write_text(f"{idx}: {{{{ name }}}}")
+    (tmp_path / "broken.txt.tpl").write_text("{{ missing }}")
+    result = runner.invoke(
+        main,
+        args=["render-dir", "-j", "2", tmp_path.as_posix(), tmp_path.as_posix()],
+        env={"name": "world"},
+    )
+    assert result.exit_code == 1
+    assert "Failed to render broken.txt.tpl" in result.stderr
+    for idx in range(8):
+        assert (tmp_path / f"{idx}.txt").read_text() == f"{idx}: world"
+        assert not (tmp_path / f"{idx}.txt.tpl").exists()
+    assert (tmp_path / "broken.txt.tpl").exists()
+    assert not (tmp_path / "broken.txt").exists()
+
+
+def test_render_dir_only_if_changed(runner: CliRunner, tmp_path: Path) -> None:
+    (tmp_path / "same.txt.tpl").write_text("{{ name }}")
+    (tmp_path / "other.txt.tpl").write_text("{{ name }}!")
+    (tmp_path / "same.txt").write_text("world")
+    (tmp_path / "other.txt").write_text("world")
+    os.utime(tmp_path / "same.txt", ns=(0, 0))
+    result = runner.invoke(
+        main,
+        args=[
+            "render-dir",
+            "--only-if-changed",
+            tmp_path.as_posix(),
+            tmp_path.as_posix(),
+        ],
+        env={"name": "world"},
+    )
+    assert result.exit_code == 0
+    assert (tmp_path / "same.txt").stat().st_mtime_ns == 0
+    assert (tmp_path / "other.txt").read_text() == "world!"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["other.txt", "same.txt"]
+
+
+def test_render_dir_deps(runner: CliRunner, tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    src.mkdir()
+    (src / "base.tpl").write_text("{{ name }}")
+    (src / "main.txt.tpl").write_text("{% include 'base.tpl' %}")
+    deps = tmp_path / "deps.mk"
+    result = runner.invoke(
+        main,
+        args=[
+            "render-dir",
+            "--keep-template",
+            "--deps",
+            deps.as_posix(),
+            src.as_posix(),
+            dst.as_posix(),
+        ],
+        env={"name": "world"},
+    )
+    assert result.exit_code == 0
+    rules = deps.read_text().splitlines()
+    assert f"{dst / 'base'}: {src / 'base.tpl'}" in rules
+    assert f"{dst / 'main.txt'}: {src / 'main.txt.tpl'} {src / 'base.tpl'}" in rules
+
+
+def test_render_dir_state_file(runner: CliRunner, tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    src.mkdir()
+    (src / "base.tpl").write_text("{{ name }}")
+    (src / "main.txt.tpl").write_text("{% include 'base.tpl' %}")
+    (src / "other.txt.tpl").write_text("{{ other }}")
+    args = [
+        "render-dir",
+        "--keep-template",
+        "--state-file",
+        (tmp_path / "state.json").as_posix(),
+        src.as_posix(),
+        dst.as_posix(),
+    ]
+    result = runner.invoke(main, args=args, env={"name": "foo", "other": "bar"})
+    assert result.exit_code == 0
+    assert (dst / "main.txt").read_text() == "foo"
+    os.utime(dst / "main.txt", ns=(0, 0))
+    os.utime(dst / "other.txt", ns=(0, 0))
+
+    # Unrelated variable change doesn't render main template
+    result = runner.invoke(main, args=args, env={"name": "foo", "other": "baz"})
+    assert result.exit_code == 0
+    assert (dst / "main.txt").stat().st_mtime_ns == 0
+    assert (dst / "other.txt").read_text() == "baz"
+
+    # Included template change renders main template
+    (src / "base.tpl").write_text("{{ name }}!")
+    result = runner.invoke(main, args=args, env={"name": "foo", "other": "baz"})
+    assert result.exit_code == 0
+    assert (dst / "main.txt").read_text() == "foo!"
+
+
+def test_render_dir_state_file_syntax_error(runner: CliRunner, tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    src.mkdir()
+    (src / "a.tpl").write_text("{{ name }}")
+    (src / "b.tpl").write_text("{% if %}")
+    result = runner.invoke(
+        main,
+        args=[
+            "render-dir",
+            "--state-file",
+            (tmp_path / "state.json").as_posix(),
+            "--deps",
+            (tmp_path / "deps.mk").as_posix(),
+            src.as_posix(),
+            dst.as_posix(),
+        ],
+        env={"name": "foo"},
+    )
+    assert result.exit_code == 1
+    assert (dst / "a").read_text() == "foo"
+    assert not (dst / "b").exists()
+    assert "Failed to render b.tpl:" in result.stderr
+    assert "b.tpl" not in (tmp_path / "deps.mk").read_text()
+    assert (src / "b.tpl").exists()
+
+
+def test_render_dir_stats(runner: CliRunner, tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    stats = tmp_path / "stats.json"
+    src.mkdir()
+    (src / "base.tpl").write_text("{{ name }}")
+    (src / "main.txt.tpl").write_text("{% include 'base.tpl' %}")
+    args = ["render-dir", "--keep-template", "--stats", stats.as_posix()]
+    result = runner.invoke(
+        main, args=[*args, src.as_posix(), dst.as_posix()], env={"name": "foo"}
+    )
+    assert result.exit_code == 0
+    report = json.loads(stats.read_text())
+    assert report["command"] == "render-dir"
+    assert {"load_env", "compile", "render", "total"} <= report["phases"].keys()
+    assert report["counters"]["templates"] == 2
+    assert report["counters"]["files_written"] == 2
+    assert report["counters"]["bytes_written"] == 6
+
+
+def test_fan_out(runner: CliRunner, tmp_path: Path) -> None:
+    template = tmp_path / "tenant.conf.tpl"
+    template.write_text("{{ fan_out.name }}: {{ tenant }} {{ region }}")
+    contexts = tmp_path / "contexts.json"
+    contexts.write_text(json.dumps([{"tenant": "a"}, {"tenant": "b", "region": "us"}]))
+    result = runner.invoke(
+        main,
+        args=[
+            "fan-out",
+            "--contexts",
+            contexts.as_posix(),
+            "-o",
+            f"{tmp_path.as_posix()}/out/{{{{ tenant }}}}.conf",
+            template.as_posix(),
+        ],
+        env={"region": "eu"},
+    )
+    assert result.exit_code == 0
+    assert (tmp_path / "out" / "a.conf").read_text() == "0: a eu"
+    assert (tmp_path / "out" / "b.conf").read_text() == "1: b us"
+    assert template.exists()
+
+
+def test_fan_out_envdirs(runner: CliRunner, tmp_path: Path) -> None:
+    template = tmp_path / "tenant.conf.tpl"
+    template.write_text("{{ tenant }}")
+    for name in ["a", "b"]:
+        (tmp_path / "tenants" / name).mkdir(parents=True)
+        (tmp_path / "tenants" / name / "tenant").write_text(name.upper())
+    result = runner.invoke(
+        main,
+        args=[
+            "fan-out",
+            "--envdirs",
+            (tmp_path / "tenants").as_posix(),
+            "-o",
+            f"{tmp_path.as_posix()}/{{{{ fan_out.name }}}}.conf",
+            template.as_posix(),
+        ],
+        env={},
+    )
+    assert result.exit_code == 0
+    assert (tmp_path / "a.conf").read_text() == "A"
+    assert (tmp_path / "b.conf").read_text() == "B"
+
+
+def test_fan_out_duplicate_output(runner: CliRunner, tmp_path: Path) -> None:
+    template = tmp_path / "tenant.conf.tpl"
+    template.write_text("{{ tenant }}")
+    contexts = tmp_path / "contexts.json"
+    contexts.write_text(json.dumps([{"tenant": "a"}, {"tenant": "a"}]))
+    result = runner.invoke(
+        main,
+        args=[
+            "fan-out",
+            "--contexts",
+            contexts.as_posix(),
+            "-o",
+            f"{tmp_path.as_posix()}/{{{{ tenant }}}}.conf",
+            template.as_posix(),
+        ],
+        env={},
+    )
+    assert result.exit_code == 1
+    assert "is already rendered by instance 0" in result.output
+    assert (tmp_path / "a.conf").read_text() == "a"
+
+
+def test_check(runner: CliRunner, tmp_path: Path) -> None:
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "include.tpl").write_text("{{ included }}")
+    (tmp_path / "a.conf.tpl").write_text(
+        "{% include 'nested/include.tpl' %}{{ name }}{{ optional | default('') }}"
+    )
+    (tmp_path / "b.conf.tpl").write_text("{{ name }}{{ other }}")
+    (tmp_path / "broken.tpl").write_text("{{ name")
+    result = runner.invoke(
+        main, args=["check", "--list", tmp_path.as_posix()], env={"name": "1"}
+    )
+    assert result.exit_code == 1
+    assert "a.conf.tpl: included name optional" in result.stdout
+    assert "Missing variables in a.conf.tpl: included" in result.stderr
+    assert "Missing variables in b.conf.tpl: other" in result.stderr
+    assert "Failed to parse broken.tpl:1:" in result.stderr
+    assert "Missing variables in nested/include.tpl: included" in result.stderr
+    assert (tmp_path / "a.conf.tpl").exists()
+
+    (tmp_path / "broken.tpl").unlink()
+    result = runner.invoke(
+        main,
+        args=["check", "-j", "2", tmp_path.as_posix()],
+        env={"name": "1", "included": "2", "other": "3"},
+    )
+    assert result.exit_code == 0
+
+
+def test_check_missing_templates(runner: CliRunner, tmp_path: Path) -> None:
+    (tmp_path / "a.tpl").write_text("{% include 'missing.tpl' %}")
+    (tmp_path / "b.tpl").write_text(
+        "{% include 'missing.tpl' ignore missing %}"
+        "{% include ['other.tpl', 'c.tpl'] %}{% from 'c.tpl' import x %}"
+    )
+    (tmp_path / "c.tpl").write_text("{% macro x() %}{% endmacro %}")
+    (tmp_path / "d.tpl").write_text("{% extends ['base.tpl', 'other.tpl'] %}")
+    result = runner.invoke(main, args=["check", tmp_path.as_posix()])
+    assert result.exit_code == 1
+    assert "Missing templates in a.tpl: missing.tpl" in result.stderr
+    assert "Missing templates in d.tpl: base.tpl or other.tpl" in result.stderr
+    assert "b.tpl" not in result.stderr
+    assert "2 template(s) failed the check" in result.stderr
@@ -1,8 +1,12 @@
+import json
+import os
 from pathlib import Path
 
+import pytest
 from click.testing import CliRunner
 
 from temply.cli import main
+from temply.filters import parse_cache_info
 from tests.conftest import PROJECT_TESTS_FIXTURES_DIR
 
 
@@ -166,3 +170,394 @@ def test_wrong_dotenv_template(runner: CliRunner) -> None:
     )
     assert "does not exist" in result.output
     assert result.exit_code == 2
+
+
+def test_only_if_changed(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "simple.tpl").as_posix()
+    output = tmp_path / "output"
+    output.write_text("Hello world: 1")
+    output.chmod(0o640)
+    os.utime(output, ns=(0, 0))
+
+    args = ["--keep-template", "--only-if-changed", "-o", output.as_posix(), path]
+    result = runner.invoke(main, args=args, env={"simple": "1"})
+    assert result.exit_code == 0
+    assert output.stat().st_mtime_ns == 0
+
+    result = runner.invoke(main, args=args, env={"simple": "2"})
+    assert result.exit_code == 0
+    assert output.read_text() == "Hello world: 2"
+    assert output.stat().st_mtime_ns != 0
+    assert output.stat().st_mode & 0o777 == 0o640
+    assert [p.name for p in tmp_path.iterdir()] == ["output"]
+
+
+def test_only_if_changed_streamed(
+    runner: CliRunner, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    output = tmp_path / "output"
+    template = "{% for i in range(10000) %}{{ i }}\n{% endfor %}{{ tail }}"
+    lines = "".join(f"{i}\n" for i in range(10000))
+    args = ["--only-if-changed", "-o", output.as_posix()]
+    for existing, tail in (
+        (f"{lines}end", "end"),
+        (f"{lines}end", "END"),
+        (f"{lines}end and more", "end"),
+        (lines, "end"),
+        (f"0\n{lines}end", "end"),
+    ):
+        output.write_text(existing)
+        os.utime(output, ns=(0, 0))
+        result = runner.invoke(main, args=args, input=template, env={"tail": tail})
+        assert result.exit_code == 0
+        assert output.read_text() == f"{lines}{tail}"
+        assert (output.stat().st_mtime_ns == 0) == (existing == f"{lines}{tail}")
+        assert [p.name for p in tmp_path.iterdir()] == ["output"]
+
+    # Unchanged outputs are compared without writing anything
+    def named_temporary_file(*_, **__) -> None:
+        raise PermissionError("Read-only file system")
+
+    monkeypatch.setattr("tempfile.NamedTemporaryFile", named_temporary_file)
+    result = runner.invoke(main, args=args, input=template, env={"tail": "end"})
+    assert result.exit_code == 0
+
+
+def test_envdir_large_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "envs.tpl").as_posix()
+    envdir = tmp_path / "envdir"
+    (envdir / "nested").mkdir(parents=True)
+    for idx in range(100):
+        (envdir / f"VAR_{idx}").write_text(f"value-{idx}\n")
+    (envdir / "MY_FOO").write_text("foo\x00bar\n")
+    (envdir / "MY_EMPTY").write_text("")
+    (envdir / "nested" / "MY_BAR").write_text(" nested ")
+    result = runner.invoke(
+        main,
+        args=["--keep-template", "--envdir", envdir.as_posix(), path],
+        env={"MY_BAR": "bar"},
+    )
+    assert result.exit_code == 0
+    assert result.output == "BAR = nested\nFOO = foo\nbar\n\n"
+
+
+def test_envdir_max_size_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "envs.tpl").as_posix()
+    envdir = tmp_path / "envdir"
+    envdir.mkdir()
+    (envdir / "MY_FOO").write_text("x" * 11)
+    args = ["--keep-template", "--envdir", envdir.as_posix(), path]
+    result = runner.invoke(main, args=[*args, "--envdir-max-size", "10"], env={})
+    assert result.exit_code == 1
+    assert "exceeds 10 bytes" in result.output
+    result = runner.invoke(main, args=[*args, "--envdir-max-size", "11"], env={})
+    assert result.exit_code == 0
+
+
+def test_json_file_large_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "envs.tpl").as_posix()
+    json_path = tmp_path / "envs.json"
+    values = [{"key": f"VAR_{idx}", "value": "x" * idx} for idx in range(5000)]
+    values.append({"key": "MY_FOO", "value": "foo"})
+    json_path.write_text(json.dumps(values, indent=2))
+    result = runner.invoke(
+        main, args=["--keep-template", "--json-file", json_path.as_posix(), path]
+    )
+    assert result.exit_code == 0
+    assert result.output == "FOO = foo\n\n"
+
+
+def test_wrong_json_file_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "envs.tpl").as_posix()
+    json_path = tmp_path / "envs.json"
+    json_path.write_text('[{"key": "MY_FOO", "value": "foo"}')
+    result = runner.invoke(
+        main, args=["--keep-template", "--json-file", json_path.as_posix(), path]
+    )
+    assert result.exit_code == 1
+    assert "Unexpected end of json array" in result.output
+
+
+def test_dotenv_syntax_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "envs.tpl").as_posix()
+    dotenv_path = tmp_path / "dotenv"
+    dotenv_path.write_text(
+        "# Comment\n"
+        "\n"
+        "export MY_EXPORTED=exported\n"
+        "MY_SPACED = spaced # comment\n"
+        "MY_HASH=a#b\n"
+        "MY_SINGLE='single \\n # quoted'\n"
+        'MY_DOUBLE="double\\tquoted" # comment\n'
+        'MY_MULTILINE="multi\n'
+        'line"\n'
+    )
+    result = runner.invoke(
+        main,
+        args=["--keep-template", "--dotenv", dotenv_path.as_posix(), path],
+        env={},
+    )
+    assert result.exit_code == 0
+    assert result.output == (
+        "DOUBLE = double\tquoted\n"
+        "EXPORTED = exported\n"
+        "HASH = a#b\n"
+        "MULTILINE = multi\nline\n"
+        "SINGLE = single \\n # quoted\n"
+        "SPACED = spaced\n\n"
+    )
+
+
+def test_invalid_dotenv_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "envs.tpl").as_posix()
+    dotenv_path = tmp_path / "dotenv"
+    dotenv_path.write_text("MY_FOO=foo\nMY_BAR\n")
+    result = runner.invoke(
+        main,
+        args=["--keep-template", "--dotenv", dotenv_path.as_posix(), path],
+        env={},
+    )
+    assert result.exit_code == 1
+    assert "Invalid line 2" in result.output
+
+
+def test_yaml_parse_cache_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = tmp_path / "template.tpl"
+    path.write_text(
+        "{% for _ in range(3) %}{{ (yaml_var | fromyaml).obj.key }}{% endfor %}"
+    )
+    before = parse_cache_info()["from_yaml"]
+    result = runner.invoke(
+        main,
+        args=["--keep-template", path.as_posix()],
+        env={"yaml_var": "obj:\n  key: cached-val\n"},
+    )
+    after = parse_cache_info()["from_yaml"]
+    assert result.exit_code == 0
+    assert result.output == "cached-val" * 3 + "\n"
+    assert after.hits - before.hits >= 2
+
+
+def test_yaml_parse_immutable_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = tmp_path / "template.tpl"
+    path.write_text("{{ (yaml_var | fromyaml).arr.append('new') }}")
+    result = runner.invoke(
+        main,
+        args=["--keep-template", path.as_posix()],
+        env={"yaml_var": "arr:\n  - str\n"},
+    )
+    assert result.exit_code == 1
+    assert isinstance(result.exception, TypeError)
+
+
+def test_nested_envs_template(runner: CliRunner) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "nested.tpl").as_posix()
+    result = runner.invoke(
+        main,
+        args=["--keep-template", path],
+        env={
+            "APP__DB": "ignored",
+            "APP__DB__HOST": "localhost",
+            "APP__DB__PORT": "5432",
+            "APP__NAME": "app",
+            "OTHER__NAME": "other",
+        },
+    )
+    assert result.exit_code == 0
+    assert result.output == (
+        "localhost:5432\napp\nDB:\n  HOST: localhost\n  PORT: '5432'\nNAME: app\n\n"
+    )
+
+
+def test_envs_shadowed_template(runner: CliRunner, tmp_path: Path) -> None:
+    path = tmp_path / "template.tpl"
+    path.write_text(
+        "{% set MY_FOO = 'shadowed' %}{% set MY_BAZ = 'baz' %}"
+        "{% for key, value in environment('MY_') %}{{ key }}={{ value }} {% endfor %}"
+    )
+    result = runner.invoke(
+        main,
+        args=["--keep-template", path.as_posix()],
+        env={"MY_FOO": "foo", "MY_BAR": "bar"},
+    )
+    assert result.exit_code == 0
+    assert result.output == "BAR=bar BAZ=baz FOO=shadowed \n"
+
+
+def test_stats(runner: CliRunner, tmp_path: Path) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "include.tpl").as_posix()
+    stats = tmp_path / "stats.json"
+    for _ in range(2):
+        result = runner.invoke(
+            main,
+            args=["--keep-template", "--stats", stats.as_posix(), path],
+            env={"simple": "1"},
+        )
+        assert result.exit_code == 0
+        assert result.output == "Hello world: 1\n"
+    reports = [json.loads(line) for line in stats.read_text().splitlines()]
+    assert len(reports) == 2
+    assert reports[0]["command"] == "render"
+    assert {"load_env", "compile", "render", "write", "total"} <= reports[0][
+        "phases"
+    ].keys()
+    assert reports[0]["counters"]["templates_loaded"] == 2
+    assert reports[0]["counters"]["bytes_written"] == len("Hello world: 1")
+    assert reports[0]["counters"]["variables"] >= 1
+
+
+def test_all_sources_precedence(runner: CliRunner, tmp_path: Path) -> None:
+    envdir = tmp_path / "envdir"
+    envdir.mkdir()
+    for name in ("FROM_ENVDIR", "FROM_DOTENV", "FROM_JSON"):
+        (envdir / name).write_text("envdir")
+    dotenv = tmp_path / "dotenv"
+    dotenv.write_text("FROM_DOTENV=dotenv\nFROM_JSON=dotenv\n")
+    json_path = tmp_path / "data.json"
+    json_path.write_text(json.dumps([{"key": "FROM_JSON", "value": "json"}]))
+    stats = tmp_path / "stats.json"
+    result = runner.invoke(
+        main,
+        args=[
+            "--envdir",
+            envdir.as_posix(),
+            "--dotenv",
+            dotenv.as_posix(),
+            "--json-file",
+            json_path.as_posix(),
+            "--stats",
+            stats.as_posix(),
+        ],
+        input="{{ FROM_ENV }} {{ FROM_ENVDIR }} {{ FROM_DOTENV }} {{ FROM_JSON }}",
+        env={"FROM_ENV": "env", "FROM_ENVDIR": "env"},
+    )
+    assert result.exit_code == 0
+    assert result.output == "env envdir dotenv json\n"
+    report = json.loads(stats.read_text())
+    assert {"load", "load_envdir", "load_dotenv", "load_json_file"} <= report[
+        "phases"
+    ].keys()
+    assert report["counters"]["variables_json_file"] == 1
+
+
+def test_context_snapshot(runner: CliRunner, tmp_path: Path) -> None:
+    envdir = tmp_path / "envdir"
+    envdir.mkdir()
+    (envdir / "MY_FOO").write_text("envdir")
+    (envdir / "MY_BAR").write_text("envdir")
+    dotenv = tmp_path / "dotenv"
+    dotenv.write_text("MY_BAR=dotenv\n")
+    json_path = tmp_path / "data.json"
+    json_path.write_text(json.dumps([{"key": "MY_JSON", "value": {"a": [1, 2]}}]))
+    snapshot = tmp_path / "snapshot"
+    result = runner.invoke(
+        main,
+        args=[
+            "snapshot",
+            "--envdir",
+            envdir.as_posix(),
+            "--dotenv",
+            dotenv.as_posix(),
+            "--json-file",
+            json_path.as_posix(),
+            snapshot.as_posix(),
+        ],
+    )
+    assert result.exit_code == 0
+
+    template = "{{ MY_FOO }} {{ MY_BAR }} {{ MY_JSON.a[1] }} {{ MY_ENV }}"
+    args = ["--context-snapshot", snapshot.as_posix()]
+    result = runner.invoke(main, args=args, input=template, env={"MY_ENV": "env"})
+    assert result.exit_code == 0
+    assert result.output == "envdir dotenv 2 env\n"
+
+    # Snapshot is rewritten once a data source changes
+    (envdir / "MY_FOO").write_text("changed")
+    result = runner.invoke(main, args=args, input=template, env={"MY_ENV": "env"})
+    assert result.exit_code == 0
+    assert result.output == "changed dotenv 2 env\n"
+    result = runner.invoke(
+        main,
+        args=[*args, "--allow-missing"],
+        input="{% for key, value in environment('MY_') %}{{ key }} {% endfor %}",
+        env={"MY_ENV": "env"},
+    )
+    assert result.output == "BAR ENV FOO JSON \n"
+
+    result = runner.invoke(
+        main, args=[*args, "--dotenv", dotenv.as_posix()], input=template
+    )
+    assert result.exit_code == 2
+    result = runner.invoke(
+        main, args=["--context-snapshot", dotenv.as_posix()], input=template
+    )
+    assert result.exit_code == 1
+    assert "Not a context snapshot" in result.stderr
+
+
+def test_only_referenced(runner: CliRunner, tmp_path: Path) -> None:
+    template = tmp_path / "template.tpl"
+    template.write_text("{{ FOO }}")
+    dotenv = tmp_path / ".env"
+    dotenv.write_text("FOO=dotenv\nBAR=unused\n")
+    stats_file = tmp_path / "stats.json"
+    result = runner.invoke(
+        main,
+        args=[
+            "--only-referenced",
+            "--keep-template",
+            "--dotenv",
+            dotenv.as_posix(),
+            "--stats",
+            stats_file.as_posix(),
+            template.as_posix(),
+        ],
+        env={"OTHER": "unused"},
+    )
+    assert result.exit_code == 0
+    assert result.stdout == "dotenv\n"
+    stats = json.loads(stats_file.read_text())
+    assert stats["counters"]["variables_dotenv"] == 1
+    assert stats["counters"]["variables_env"] == 0
+
+    # The whole context is loaded for environment()
+    template.write_text("{{ environment('BA') | list | length }}")
+    result = runner.invoke(
+        main,
+        args=["--only-referenced", "--dotenv", dotenv.as_posix(), template.as_posix()],
+        env={},
+    )
+    assert result.exit_code == 0
+    assert result.stdout == "1\n"
+
+
+def test_context_snapshot_read_only(
+    runner: CliRunner, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    dotenv = tmp_path / "dotenv"
+    dotenv.write_text("FOO=before\n")
+    snapshot = tmp_path / "snapshot"
+    args = ["snapshot", "--dotenv", dotenv.as_posix(), snapshot.as_posix()]
+    assert runner.invoke(main, args=args).exit_code == 0
+
+    # A stale snapshot that can't be rewritten falls back to its data sources
+    def write_snapshot(*_) -> None:
+        raise PermissionError("Read-only file system")
+
+    monkeypatch.setattr("temply.snapshots.write_snapshot", write_snapshot)
+    dotenv.write_text("FOO=after\n")
+    stats_file = tmp_path / "stats.json"
+    result = runner.invoke(
+        main,
+        args=[
+            "--context-snapshot",
+            snapshot.as_posix(),
+            "--stats",
+            stats_file.as_posix(),
+        ],
+        input="{{ FOO }}",
+        env={},
+    )
+    assert result.exit_code == 0
+    assert result.output == "after\n"
+    assert json.loads(stats_file.read_text())["counters"]["snapshot_stale"] == 1
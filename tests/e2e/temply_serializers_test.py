@@ -0,0 +1,54 @@
+import json
+
+import pytest
+import yaml
+from click.testing import CliRunner
+
+from temply.cli import main
+from temply.serializers import available_serializers, describe_serializers
+from tests.conftest import PROJECT_TESTS_FIXTURES_DIR
+
+DOCUMENTS = [
+    "foo: bar",
+    "42",
+    "- a\n- b: [1, 2.5, .inf, null, true]\n",
+    "date: 2020-01-02\nanchor: &a {x: 1}\nalias: *a\n",
+    "text: |\n  multi\n  line\nfolded: >\n  long\n  text\n",
+    '\'\': empty\n"\\xE9\\u2028\\0": "\\U0001F600 quoted"\n',
+    "obj:\n  key-one: val\n  key-two: " + "long value " * 20 + "\n",
+]
+
+
+def test_version_serializers(runner: CliRunner) -> None:
+    result = runner.invoke(main, args=["--version"])
+    assert result.exit_code == 0
+    assert describe_serializers() in result.output
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_yaml_serializers_identical(document: str) -> None:
+    value = yaml.safe_load(document)
+    for serializer in available_serializers("yaml"):
+        assert serializer.loads(document) == value
+        assert serializer.dumps(value) == yaml.safe_dump(value)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_json_serializers_identical(document: str) -> None:
+    value = json.loads(json.dumps(yaml.safe_load(document), default=str))
+    for serializer in available_serializers("json"):
+        assert serializer.loads(json.dumps(value)) == value
+        assert serializer.dumps(value) == json.dumps(value)
+    for serializer in available_serializers("json"):
+        assert serializer.loads("[NaN, 1e400]")[1] == float("inf")
+
+
+def test_yaml_filters_identical(runner: CliRunner) -> None:
+    path = (PROJECT_TESTS_FIXTURES_DIR / "yaml.tpl").as_posix()
+    document = DOCUMENTS[-1]
+    result = runner.invoke(
+        main, args=["--keep-template", path], env={"yaml_var": document}
+    )
+    assert result.exit_code == 0
+    expected = yaml.safe_dump(yaml.safe_load(document)).strip()
+    assert result.output == f"{expected}\n{expected}\n\n"
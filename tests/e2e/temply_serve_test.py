@@ -0,0 +1,139 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+from tests.conftest import PROJECT_ROOT_DIR
+from tests.e2e.conftest import wait_for
+
+TEMPLY = (PROJECT_ROOT_DIR / "bin" / "temply").as_posix()
+
+
+def client(
+    socket_path: Path, args: list[str], stdin: str = ""
+) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, TEMPLY, *args],
+        check=False,
+        cwd=socket_path.parent,
+        input=stdin,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "TEMPLY_SERVER": socket_path.as_posix(), "NAME": "world"},
+    )
+
+
+def test_serve(tmp_path: Path) -> None:
+    socket_path = tmp_path / "temply.sock"
+    template = tmp_path / "main.tpl"
+    template.write_text("{% include 'base.tpl' %} {{ FOO }}")
+    (tmp_path / "base.tpl").write_text("Hello {{ NAME }}")
+    dotenv = tmp_path / "dotenv"
+    dotenv.write_text("FOO=foo")
+
+    process = subprocess.Popen(
+        [sys.executable, TEMPLY, "serve", "--socket", socket_path]
+    )
+    try:
+        assert wait_for(socket_path.is_socket)
+        assert socket_path.stat().st_mode & 0o777 == 0o600
+
+        result = client(socket_path, [], stdin="Hello {{ NAME }}")
+        assert result.returncode == 0
+        assert result.stdout == "Hello world\n"
+
+        args = ["--keep-template", "--dotenv", "dotenv", "main.tpl"]
+        result = client(socket_path, args)
+        assert result.returncode == 0
+        assert result.stdout == "Hello world foo\n"
+
+        # Data sources are reloaded once changed
+        dotenv.write_text("FOO=bar")
+        assert wait_for(lambda: client(socket_path, args).stdout == "Hello world bar\n")
+
+        result = client(socket_path, ["--keep-template", "missing.tpl"])
+        assert result.returncode == 2
+        result = client(socket_path, [], stdin="{{ UNKNOWN }}")
+        assert result.returncode == 1
+        assert "Error:" in result.stderr
+
+        result = client(socket_path, ["--dotenv", "dotenv", "-o", "output", "main.tpl"])
+        assert result.returncode == 0
+        assert (tmp_path / "output").read_text() == "Hello world bar"
+        assert not template.exists()
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    assert not socket_path.exists()
+
+
+def test_serve_stats(tmp_path: Path) -> None:
+    socket_path = tmp_path / "temply.sock"
+    (tmp_path / "main.tpl").write_text("""{{ ('"' ~ NAME ~ '"') | from_json }}""")
+    process = subprocess.Popen(
+        [sys.executable, TEMPLY, "serve", "--socket", socket_path],
+        stderr=subprocess.PIPE,
+    )
+    try:
+        assert wait_for(socket_path.is_socket)
+        args = ["--keep-template", "--stats", "-", "main.tpl"]
+        counters = []
+        for _ in range(2):
+            result = client(socket_path, args)
+            assert result.returncode == 0
+            counters.append(json.loads(result.stderr.splitlines()[-1])["counters"])
+        assert counters[0]["templates_loaded"] == 1
+        assert counters[1]["templates_loaded"] == 0
+        assert counters[1]["from_json_cache_hits"] == 1
+        assert counters[1]["from_json_cache_misses"] == 0
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    assert b"counters" not in process.stderr.read()
+
+
+def test_serve_fallback(tmp_path: Path) -> None:
+    result = client(tmp_path / "temply.sock", [], stdin="Hello {{ NAME }}")
+    assert result.returncode == 0
+    assert result.stdout == "Hello world\n"
+
+
+def test_serve_bad_requests(tmp_path: Path) -> None:
+    socket_path = tmp_path / "temply.sock"
+    process = subprocess.Popen(
+        [sys.executable, TEMPLY, "serve", "--socket", socket_path]
+    )
+    try:
+        assert wait_for(socket_path.is_socket)
+
+        # Liveness probe
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path.as_posix())
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path.as_posix())
+            connection.sendall(b"{not json")
+            connection.shutdown(socket.SHUT_WR)
+            response = connection.makefile("rb").read()
+        assert b"Invalid request" in response
+        assert response.endswith(b"x\x00\x00\x00\x02")
+
+        # A second server probes the running one
+        result = subprocess.run(
+            [sys.executable, TEMPLY, "serve", "--socket", socket_path],
+            check=False,
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 1
+        assert "A server is running" in result.stderr
+
+        result = client(socket_path, [], stdin="Hello {{ NAME }}")
+        assert result.returncode == 0
+        assert result.stdout == "Hello world\n"
+        assert process.poll() is None
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
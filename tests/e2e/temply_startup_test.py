@@ -0,0 +1,61 @@
+import subprocess
+import sys
+import time
+
+from tests.conftest import PROJECT_ROOT_DIR
+
+# Cold start budgets in seconds on top of the interpreter startup
+VERSION_BUDGET = 0.1
+RENDER_BUDGET = 0.15
+
+
+def cold_start(args: list[str], stdin: str | None = None) -> float:
+    durations = []
+    for _ in range(5):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args],
+            input=stdin,
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def test_cli_lazy_imports() -> None:
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, temply.cli; print(sorted({'jinja2', 'yaml'} & sys.modules.keys()))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert result.stdout == "[]\n"
+
+
+def test_cold_start_budget() -> None:
+    temply = (PROJECT_ROOT_DIR / "bin" / "temply").as_posix()
+    interpreter = cold_start(["-c", "pass"])
+    assert cold_start([temply, "--version"]) - interpreter < VERSION_BUDGET
+    assert cold_start([temply], stdin="{{ HOME }}") - interpreter < RENDER_BUDGET
+
+
+def test_startup_trace() -> None:
+    result = subprocess.run(
+        [
+            sys.executable,
+            (PROJECT_ROOT_DIR / "bin" / "temply").as_posix(),
+            "--startup-trace",
+        ],
+        input="{{ HOME }}",
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert "Startup trace (ms):" in result.stderr
+    assert "jinja2" in result.stderr
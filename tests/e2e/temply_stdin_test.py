@@ -27,3 +27,48 @@ def test_output_file(runner: CliRunner) -> None:
     assert result.output == ""
     assert Path("/tmp/output").read_text() == "Hello world !"
     Path("/tmp/output").unlink()
+
+
+def test_timeout(runner: CliRunner) -> None:
+    result = runner.invoke(
+        main,
+        input="start\n{% for i in range(10**9) %}{% endfor %}",
+        args=["--timeout", "0.1"],
+    )
+    assert result.exit_code == 1
+    assert "Render timeout of 0.1s exceeded at <template>:2" in result.stderr
+
+
+def test_max_output_bytes(runner: CliRunner, tmp_path: Path) -> None:
+    output = tmp_path / "output"
+    result = runner.invoke(
+        main,
+        input="{% for i in range(1000) %}{{ i }}\n{% endfor %}",
+        args=["--max-output-bytes", "100", "-o", output.as_posix()],
+    )
+    assert result.exit_code == 1
+    assert "Output size limit of 100 bytes exceeded at <template>:1" in result.stderr
+    assert not output.exists()
+
+
+def test_sandbox(runner: CliRunner) -> None:
+    result = runner.invoke(
+        main,
+        input="{% for i in range(100) %}{% for j in range(100000) %}{% endfor %}{% endfor %}",
+        args=["--sandbox"],
+    )
+    assert result.exit_code == 1
+    assert "Loop iterations limit of 1000000 exceeded" in result.stderr
+
+    result = runner.invoke(
+        main, input="{{ ''.__class__.__mro__ }}", args=["--sandbox"], env={}
+    )
+    assert result.exit_code == 1
+
+    result = runner.invoke(
+        main,
+        input="{% for i in range(3) %}{{ loop.index }}/{{ loop.length }} {% endfor %}",
+        args=["--sandbox", "--timeout", "10", "--max-output-bytes", "100"],
+    )
+    assert result.exit_code == 0
+    assert result.output == "1/3 2/3 3/3 \n"
@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from tests.conftest import PROJECT_ROOT_DIR
+from tests.e2e.conftest import wait_for
+
+
+def read(path: Path) -> str | None:
+    try:
+        return path.read_text()
+    except FileNotFoundError:
+        return None
+
+
+def test_watch(tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    dst = tmp_path / "dst"
+    src.mkdir()
+    dst.mkdir()
+    (src / "base.tpl").write_text("base: {{ FOO }}")
+    (src / "main.txt.tpl").write_text("main: {% include 'base.tpl' %}")
+    (src / "other.txt.tpl").write_text("other")
+    dotenv = tmp_path / "dotenv"
+    dotenv.write_text("FOO=foo")
+    marker = tmp_path / "marker"
+    stderr = tmp_path / "stderr"
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            (PROJECT_ROOT_DIR / "bin" / "temply").as_posix(),
+            "watch",
+            "--dotenv",
+            dotenv.as_posix(),
+            "--debounce",
+            "0.05",
+            "--exec",
+            f"echo run >> {marker.as_posix()}",
+            src.as_posix(),
+            dst.as_posix(),
+        ],
+        env={**os.environ},
+        stderr=stderr.open("w"),
+    )
+    try:
+        assert wait_for(lambda: read(dst / "main.txt") == "main: base: foo")
+        assert read(dst / "other.txt") == "other"
+        assert wait_for(lambda: read(marker) == "run\n")
+        other_mtime = (dst / "other.txt").stat().st_mtime_ns
+
+        # Included template change only renders affected templates
+        (src / "base.tpl").write_text("changed: {{ FOO }}")
+        assert wait_for(lambda: read(dst / "main.txt") == "main: changed: foo")
+        assert (dst / "other.txt").stat().st_mtime_ns == other_mtime
+
+        # Data source change only renders templates reading changed variables
+        dotenv.write_text("FOO=bar")
+        assert wait_for(lambda: read(dst / "main.txt") == "main: changed: bar")
+        assert (dst / "other.txt").stat().st_mtime_ns == other_mtime
+        assert (src / "main.txt.tpl").exists()
+
+        # A template saved mid-edit is reported and watching goes on
+        (src / "base.tpl").write_text("{% if %}")
+        assert wait_for(lambda: "Failed to render main.txt.tpl" in read(stderr))
+        assert process.poll() is None
+        (src / "base.tpl").write_text("fixed: {{ FOO }}")
+        assert wait_for(lambda: read(dst / "main.txt") == "main: fixed: bar")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
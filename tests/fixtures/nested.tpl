@@ -0,0 +1,4 @@
+{% set app = nested_environment('APP__') %}
+{{ app.DB.HOST }}:{{ app.DB.PORT }}
+{{ app.NAME }}
+{{ app | toyaml }}